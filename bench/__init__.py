@@ -0,0 +1,47 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks of TWPS.
+
+Synthetic templates are generated (see :mod:`bench.generate`), and the
+phases of their processing are timed (see :mod:`bench.run`):
+
+    ``parse`` -- reading, parsing and compiling the template,
+
+    ``eval`` -- evaluation and execution of snippets alone,
+
+    ``render`` -- rendering with output capture; ``capture`` is the
+    difference of ``render`` and ``eval``,
+
+    ``write`` -- writing the rendered text to the resulting file,
+
+    ``cli`` -- end-to-end run of ``ppp.py``.
+
+Run the benchmarks from the repository root and save results::
+
+    python -m bench run -o results.json
+
+Compare with a baseline, exit status is 1 if there are regressions::
+
+    python -m bench compare baseline.json results.json
+
+Check that ``import twps`` and ``ppp.py --help`` start fast, exit status is 1
+if they take more than the budget in excess of the bare python start-up::
+
+    python -m bench startup --budget 0.025
+"""
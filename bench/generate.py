@@ -0,0 +1,93 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Generator of synthetic templates.
+"""
+
+import random
+from os import path
+
+# Line of literal text, similar to a cell card of an MCNP input deck.
+_literal = 'c {:>6d}  1 -7.9  -{} {} -{}  imp:n=1  $ literal text line\n'
+
+
+def _snippets(rnd, n, eval_fraction, multiline_fraction, names):
+    """
+    Yield ``n`` snippets.
+    """
+    for i in range(n):
+        name = rnd.choice(names)
+        if rnd.random() < eval_fraction:
+            yield '`{} * {} + len(str(v{}))`'.format(name, i, i % 10)
+        elif rnd.random() < multiline_fraction:
+            yield ('`\nfor k in range(3):\n    v{0} = {1} + k\n'
+                   'print(v{0})\n`').format(i % 10, name)
+        else:
+            yield '`v{} = {} + {}`'.format(i % 10, name, i)
+
+
+def generate(dname, name='bench', size=100, density=10, eval_fraction=0.8,
+             multiline_fraction=0.2, depth=0, dims=(), seed=0):
+    """
+    Write the synthetic template and templates included by it into the
+    directory ``dname``. Returns tuple (fname, clp): name of the main
+    template and the list of parameters for ``pre_pro``.
+
+    ``size`` -- approximate size of each template in kilobytes.
+
+    ``density`` -- number of snippets per kilobyte.
+
+    ``eval_fraction`` -- fraction of evaluated (as opposed to executed)
+    snippets.
+
+    ``multiline_fraction`` -- fraction of multi-line snippets among executed
+    ones.
+
+    ``depth`` -- depth of nested ``pre_pro`` calls: the main template
+    includes another one, which includes the next one etc.
+
+    ``dims`` -- numbers of values of parameters of the parametric study.
+    """
+    rnd = random.Random(seed)
+    clp = [('p{}'.format(i), list(range(n)), 0) for i, n in enumerate(dims)]
+    names = [p[0] for p in clp] or ['1']
+    fnames = ['{}{}.t'.format(name, '_inc{}'.format(d) if d else '')
+              for d in range(depth + 1)]
+    for d, fname in enumerate(fnames):
+        rnd_snippets = _snippets(rnd, int(size * density), eval_fraction,
+                                 multiline_fraction, names)
+        with open(path.join(dname, fname), 'w') as f:
+            f.write('c -l``\n')
+            # Names used by snippets, defined before them.
+            f.write('-d`{}`\n'.format('; '.join(
+                'v{} = {}'.format(i, i) for i in range(10))))
+            if d < depth:
+                f.write("`pre_pro('{}')`\n".format(fnames[d + 1]))
+            written = 0
+            n = 0
+            while written < size * 1024:
+                line = _literal.format(n, n + 1, n + 2, n + 3)
+                s = next(rnd_snippets, None)
+                if s is not None:
+                    line = s + ' ' + line
+                f.write(line)
+                written += len(line)
+                n += 1
+            for s in rnd_snippets:
+                f.write(s + '\n')
+    return path.join(dname, fnames[0]), clp
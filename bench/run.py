@@ -0,0 +1,360 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Timing of template processing phases and comparison with a baseline.
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import time
+import json
+import shutil
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from os import path
+
+import twps
+from twps import text_with_snippets as tws
+from twps import log
+from .generate import generate
+
+# Allowed time of ``import twps`` plus ``ppp.py --help`` in excess of the
+# start-up of bare python, in seconds.
+STARTUP_BUDGET = 0.025
+
+# Benchmark cases: keyword arguments of generate().
+cases = {
+    'text': dict(size=2000, density=0.5),
+    'dense': dict(size=200, density=40),
+    'exec': dict(size=200, density=20, eval_fraction=0.2,
+                 multiline_fraction=0.5),
+    'nested': dict(size=100, density=10, depth=4),
+    'sweep': dict(size=50, density=10, dims=(4, 4)),
+}
+
+
+def measure(func, repeat=3):
+    """
+    Call ``func`` ``repeat`` times. Returns dictionary with the minimal time
+    in seconds and the peak memory allocated by ``func``, in megabytes. The
+    memory is measured in an additional call, since tracing slows it down.
+    """
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'time': min(times), 'peak_mb': peak / 2.0**20}
+
+
+class _Null(object):
+    def write(self, string):
+        pass
+
+    def flush(self):
+        pass
+
+
+def _eval_only(tpl, scope):
+    """
+    Evaluate and execute snippets of ``tpl`` without capture of their output
+    for each snippet. The output is discarded.
+    """
+    stdout = sys.stdout
+    sys.stdout = _Null()
+    try:
+        for seg in tpl.segments:
+            if seg.code is None:
+                continue
+            try:
+                if seg.mode == 'eval':
+                    str(eval(seg.code, scope))
+                else:
+                    exec(seg.code, scope)
+            except Exception:
+                pass
+    finally:
+        sys.stdout = stdout
+
+
+def _write(tpl, chunks):
+    """
+    Write ``chunks`` to a new resulting file.
+    """
+    if path.exists('bench.out'):
+        # Otherwise, the unchanged file is not written.
+        os.remove('bench.out')
+    tws.write_result('bench.out', chunks, tpl.mtime, tpl.atime, tpl._log)
+
+
+def _scope(clp):
+    scope = {'pre_pro': tws.pre_pro}
+    scope.update((p[0], p[1][0]) for p in clp)
+    return scope
+
+
+class _Warnings(object):
+    """
+    Log sink, that collects warnings, see :func:`check`.
+    """
+    level = 1
+
+    def __init__(self):
+        self.messages = []
+
+    def write(self, record):
+        if record['level'] == 1:
+            self.messages.append('{template}, line {line}: {message}'.format(
+                **record))
+
+
+def check(fname, clp):
+    """
+    Render the template ``fname`` once. Raises RuntimeError, if warnings are
+    issued, e.g. snippets fail, since the benchmark would time the error
+    reporting instead of rendering.
+    """
+    sink = _Warnings()
+    tpl = tws.Template(fname, '', None, sink)
+    list(tpl._generate(_scope(clp)))
+    if sink.messages:
+        raise RuntimeError('Template {} renders with warnings:\n{}'.format(
+            fname, '\n'.join(sink.messages[:10])))
+
+
+def run_case(dname, kwargs, repeat=3):
+    """
+    Generate template with ``kwargs`` in directory ``dname`` and measure the
+    phases of its processing. Returns dictionary of phase results.
+    """
+    fname, clp = generate(dname, **kwargs)
+    fname = path.basename(fname)
+    res = {}
+    cwd = os.getcwd()
+    os.chdir(dname)
+    # Output of nested templates is silenced as well.
+    level = log.default_level
+    log.default_level = -1
+    try:
+        check(fname, clp)
+        res['parse'] = measure(lambda: tws.Template(fname), repeat)
+        tpl = tws.Template(fname)
+        res['eval'] = measure(lambda: _eval_only(tpl, _scope(clp)), repeat)
+        res['render'] = measure(
+            lambda: list(tpl._generate(_scope(clp))), repeat)
+        res['capture'] = {
+            'time': max(0.0, res['render']['time'] - res['eval']['time']),
+            'peak_mb': res['render']['peak_mb']}
+        chunks = list(tpl._generate(_scope(clp)))
+        res['write'] = measure(lambda: _write(tpl, chunks), repeat)
+    finally:
+        log.default_level = level
+        os.chdir(cwd)
+    res['cli'] = run_cli(dname, fname, clp, repeat)
+    return res
+
+
+def run_cli(dname, fname, clp, repeat=3):
+    """
+    Measure end-to-end runs of ``ppp.py`` processing template ``fname`` in
+    ``dname``. The peak memory is the maximal resident set size of the
+    ``ppp.py`` process.
+    """
+    ppp = path.join(path.dirname(path.abspath(twps.__file__)), 'ppp.py')
+    args = [sys.executable, ppp, fname, '--log', '0']
+    for name, vals, i0 in clp:
+        args.append('--{} {}'.format(name, ' '.join(map(str, vals))))
+    env = _env()
+    times = []
+    rss = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        p = subprocess.Popen(args, cwd=dname, env=env,
+                             stdout=subprocess.DEVNULL)
+        if hasattr(os, 'wait4'):
+            pid, status, usage = os.wait4(p.pid, 0)
+            p.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in kilobytes on Linux.
+            rss.append(usage.ru_maxrss / 1024.0)
+        else:
+            p.wait()
+        times.append(time.perf_counter() - t0)
+        if p.returncode:
+            raise subprocess.CalledProcessError(p.returncode, args)
+    res = {'time': min(times)}
+    if rss:
+        res['peak_mb'] = max(rss)
+    return res
+
+
+def _env():
+    """
+    Environment for child processes, which import twps from this tree.
+    """
+    env = dict(os.environ)
+    root = path.dirname(path.dirname(path.abspath(twps.__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([root, env.get('PYTHONPATH', '')])
+    return env
+
+
+def startup(repeat=10):
+    """
+    Measure start-up of a new python process: bare interpreter, ``import
+    twps`` and ``ppp.py --help``. Returns dictionary with minimal times in
+    seconds, and ``overhead``, the time of the two latter in excess of the
+    bare interpreter start-up.
+    """
+    ppp = path.join(path.dirname(path.abspath(twps.__file__)), 'ppp.py')
+    commands = {'python': [sys.executable, '-c', 'pass'],
+                'import': [sys.executable, '-c', 'import twps'],
+                'help': [sys.executable, ppp, '--help']}
+    env = _env()
+    res = {}
+    for name, args in sorted(commands.items()):
+        times = []
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            subprocess.check_call(args, env=env, stdout=subprocess.DEVNULL)
+            times.append(time.perf_counter() - t0)
+        res[name] = min(times)
+    res['overhead'] = res['import'] + res['help'] - 2 * res['python']
+    return res
+
+
+def run(names=None, repeat=3, scale=1.0):
+    """
+    Run benchmark cases ``names`` (default: all). ``scale`` multiplies the
+    template sizes. Returns results as a dictionary.
+    """
+    results = {'meta': {'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'twps': twps.__version__,
+                        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                        'repeat': repeat,
+                        'scale': scale},
+               'cases': {}}
+    for name in names or sorted(cases):
+        kwargs = dict(cases[name])
+        kwargs['size'] = max(1, int(kwargs['size'] * scale))
+        dname = tempfile.mkdtemp(prefix='twps-bench-')
+        try:
+            results['cases'][name] = run_case(dname, kwargs, repeat)
+        finally:
+            shutil.rmtree(dname, ignore_errors=True)
+        report({'cases': {name: results['cases'][name]}})
+    return results
+
+
+def report(results):
+    """
+    Print results as a table.
+    """
+    for name, phases in sorted(results['cases'].items()):
+        for phase, r in sorted(phases.items()):
+            print('{:8s} {:8s} {:10.4f} s {:10.1f} MB'.format(
+                name, phase, r['time'], r.get('peak_mb', float('nan'))))
+
+
+def compare(base, new, threshold=0.1, min_time=0.005):
+    """
+    Compare results ``new`` with ``base``. Returns list of regressions, i.e.
+    tuples (case, phase, base time, new time) for phases, which time grew
+    more than by the fraction ``threshold``. Phases shorter than
+    ``min_time`` seconds are too noisy and are not compared.
+    """
+    regressions = []
+    for name, phases in sorted(new['cases'].items()):
+        for phase, r in sorted(phases.items()):
+            b = base['cases'].get(name, {}).get(phase)
+            if b is None or max(b['time'], r['time']) < min_time:
+                continue
+            if r['time'] > b['time'] * (1 + threshold):
+                regressions.append((name, phase, b['time'], r['time']))
+    return regressions
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m bench',
+                                     description='Benchmarks of TWPS.')
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('run', help='run benchmarks')
+    p.add_argument('cases', nargs='*', help='cases to run, default: all')
+    p.add_argument('-o', '--output', help='write results to JSON file')
+    p.add_argument('-n', '--repeat', type=int, default=3)
+    p.add_argument('-s', '--scale', type=float, default=1.0,
+                   help='factor for template sizes')
+    p.add_argument('-b', '--baseline', help='compare with baseline file')
+    p.add_argument('-t', '--threshold', type=float, default=0.1)
+    p = sub.add_parser('compare', help='compare results with baseline')
+    p.add_argument('baseline')
+    p.add_argument('results')
+    p.add_argument('-t', '--threshold', type=float, default=0.1)
+    p = sub.add_parser('startup', help='check start-up time budget')
+    p.add_argument('-n', '--repeat', type=int, default=10)
+    p.add_argument('--budget', type=float, default=STARTUP_BUDGET,
+                   help='allowed overhead in seconds, default: %(default)s')
+    args = parser.parse_args(argv)
+
+    if args.command == 'startup':
+        res = startup(args.repeat)
+        for name in ('python', 'import', 'help', 'overhead'):
+            print('{:8s} {:10.4f} s'.format(name, res[name]))
+        if res['overhead'] > args.budget:
+            print('OVER BUDGET: {:.4f} s > {:.4f} s'.format(
+                res['overhead'], args.budget))
+            return 1
+        print('Within budget of {:.4f} s'.format(args.budget))
+        return 0
+
+    if args.command == 'run':
+        for name in args.cases:
+            if name not in cases:
+                parser.error('unknown case {!r}, available: {}'.format(
+                    name, ', '.join(sorted(cases))))
+        results = run(args.cases, args.repeat, args.scale)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=1, sort_keys=True)
+        if not args.baseline:
+            return 0
+        baseline = args.baseline
+    elif args.command == 'compare':
+        with open(args.results) as f:
+            results = json.load(f)
+        baseline = args.baseline
+    else:
+        parser.print_help()
+        return 2
+    with open(baseline) as f:
+        base = json.load(f)
+    regressions = compare(base, results, args.threshold)
+    for name, phase, b, r in regressions:
+        print('REGRESSION {} {}: {:.4f} s -> {:.4f} s ({:+.0%})'.format(
+            name, phase, b, r, r / b - 1))
+    if not regressions:
+        print('No regressions')
+    return 1 if regressions else 0
@@ -21,6 +21,7 @@ setup(name='twps',
       author_email='anton.travleev@gmail.com',
       url='https://github.com/inr-kit/twps',
       keywords='TEXT PYTHON SNIPPETS TEMPLATE PREPROCESSOR'.split(),
+      python_requires='>=3.9',
       scripts=['twps/ppp.py'],
       package_data={
           '': ['*.rst'],  # for readme.rst
@@ -31,7 +32,12 @@ setup(name='twps',
           'Intended Audience :: Science/Research',
           'Intended Audience :: Education',
           'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',
-          'Programming Language :: Python :: 2.7',
+          'Programming Language :: Python :: 3',
+          'Programming Language :: Python :: 3 :: Only',
+          'Programming Language :: Python :: 3.9',
+          'Programming Language :: Python :: 3.10',
+          'Programming Language :: Python :: 3.11',
+          'Programming Language :: Python :: 3.12',
           'Topic :: Text Processing :: Markup',
           'Topic :: Text Processing :: Filters',
           'Topic :: Text Processing :: General',
@@ -0,0 +1,2 @@
+``
+`bump()` `lst.append(len(lst)) or lst`
@@ -0,0 +1,12 @@
+``
+A limit exceeded in a template included with a nested pre_pro call is the
+limit of the including snippet. Run
+
+    ppp.py t11.t --snippet-time 1 --'a 1 2'
+
+Both variants are reported as not written, at line 3 of t12.t, and no
+resulting files are written. Without limits, t11._0.t and t11._1.t are
+written after 3 s each.
+
+a=`a`
+`pre_pro('t12.t', level='main')`
@@ -0,0 +1,12 @@
+Asynchronous rendering gives the same text as rendering in the template
+order. The text of this template rendered with
+
+    await twps.render_async('t13.t', {})
+
+is t13.res.t. The snippet appending to rows changes it in place, the
+later ones wait for it.
+
+`import asyncio`
+`rows = []`
+None
+count: 1 rows: ['r1']
@@ -0,0 +1,13 @@
+``
+Asynchronous rendering gives the same text as rendering in the template
+order. The text of this template rendered with
+
+    await twps.render_async('t13.t', {})
+
+is t13.res.t. The snippet appending to rows changes it in place, the
+later ones wait for it.
+
+`import asyncio`
+`rows = []`
+`rows.append(await asyncio.sleep(0.1, 'r1'))`
+count: `len(rows)` rows: `rows`
@@ -0,0 +1,2 @@
+``
+`box.v`
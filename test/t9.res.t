@@ -0,0 +1,25 @@
+Included templates, that change the namespace through functions or change
+objects in place, or read objects which cannot be pickled (t14.t), give the
+same text with ppp.py --include-cache as without.
+
+`
+counter = 0
+def bump():
+    global counter
+    counter += 1
+    return counter
+
+lst = []
+
+import threading
+class Box(object):
+    def __init__(self):
+        self.v = 1
+        self.lock = threading.Lock()
+box = Box()
+`
+1: 1 [0]
+2: 2 [0, 1]
+3: 3 [0, 1, 2]
+counter=3
+box: 1 `box.v = 2` 2
@@ -0,0 +1,26 @@
+``
+Included templates, that change the namespace through functions or change
+objects in place, or read objects which cannot be pickled (t14.t), give the
+same text with ppp.py --include-cache as without.
+
+`
+counter = 0
+def bump():
+    global counter
+    counter += 1
+    return counter
+
+lst = []
+
+import threading
+class Box(object):
+    def __init__(self):
+        self.v = 1
+        self.lock = threading.Lock()
+box = Box()
+`
+1: `pre_pro('t10.t', loglevel=-1)`
+2: `pre_pro('t10.t', loglevel=-1)`
+3: `pre_pro('t10.t', loglevel=-1)`
+counter=`counter`
+box: `pre_pro('t14.t', loglevel=-1)` `box.v = 2` `pre_pro('t14.t', loglevel=-1)`
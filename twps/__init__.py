@@ -31,8 +31,22 @@ pre_pro() function can be used.
 
 """
 
-from .text_with_snippets import pre_pro
-from .utils import params
+from .utils import params, VariantSpace
+
+
+def __getattr__(name):
+    # The main module is imported when first used, thus ``import twps`` and
+    # ``ppp.py --help`` are fast.
+    if name in ('pre_pro', 'Template', 'RenderContext', 'preload'):
+        from . import text_with_snippets
+        value = globals()[name] = getattr(text_with_snippets, name)
+        return value
+    if name in ('render_async', 'render_variants_async'):
+        from . import aio
+        value = globals()[name] = getattr(aio, name)
+        return value
+    raise AttributeError('module {!r} has no attribute {!r}'.format(
+        __name__, name))
 
 try:
     from .version import version
@@ -0,0 +1,376 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Rendering of templates with asyncio.
+
+Snippets rendered by :func:`render_async` can await: a snippet can contain
+top-level ``await``, e.g. ```rows = await db.fetch(query)```, or evaluate
+to an awaitable, e.g. ```fetch('http://host/data')```, where ``fetch`` is a
+coroutine function. The awaitable is awaited, and the snippet is replaced
+with its result.
+
+Awaitable snippets run concurrently on the running event loop. A snippet
+starts only after the earlier snippets it depends on are complete, i.e.
+those, which write names it reads, or read or write names it writes (see
+:func:`twps.text_with_snippets.name_access`; names used by functions
+defined in the namespace count too). Reading a name, which value can be
+changed in place, e.g. ``rows.append(x)``, counts as writing it; only
+modules, functions, classes, numbers and strings can be read
+concurrently. Snippets, which call ``pre_pro`` or access the namespace
+dynamically, wait for all earlier snippets. A snippet waiting for others
+does not delay later snippets, which do not depend on it. Results are put
+to the resulting text in the template order, regardless of the order, in
+which the snippets complete.
+
+:func:`render_variants_async` renders variants of a parametric study
+concurrently, each in its own copy of the namespace, and writes them to the
+resulting files.
+
+Templates included with ``pre_pro`` from snippets are rendered
+synchronously.
+"""
+
+import ast
+import asyncio
+import inspect
+import weakref
+from itertools import islice
+from types import BuiltinFunctionType, FunctionType, ModuleType
+
+from . import text_with_snippets as tws
+from . import deps
+from .utils import variants
+
+# Flag of compile(), that allows await outside of coroutine functions.
+_AWAIT = ast.PyCF_ALLOW_TOP_LEVEL_AWAIT
+
+
+class _Step(object):
+    """
+    Snippet segment prepared for asynchronous rendering.
+
+    ``code`` and ``mode`` are those of the segment, or, if the segment
+    cannot be compiled without top-level ``await``, those compiled with it.
+    ``read`` and ``written`` are names, which the code accesses. ``barrier``
+    is True, if the code accesses the namespace dynamically.
+    """
+    __slots__ = ('seg', 'mode', 'code', 'read', 'written', 'barrier')
+
+    def __init__(self, seg):
+        self.seg = seg
+        self.mode = seg.mode
+        self.code = seg.code
+        if self.code is None:
+            self._compile()
+        if self.code is None:
+            self.read = self.written = frozenset()
+            self.barrier = False
+        else:
+            self.read, self.written = tws.name_access(self.code)
+            self.barrier = bool(self.read & tws._dynamic_names or
+                                '*' in self.written)
+
+    def _compile(self):
+        seg = self.seg
+        try:
+            self.code = compile(seg.text[1:-1].lstrip(' \t'), '<string>',
+                                'eval', _AWAIT)
+            self.mode = 'eval'
+        except SyntaxError:
+            try:
+                self.code = compile(seg.source, '<string>', 'exec', _AWAIT)
+            except SyntaxError:
+                # The segment error is reported.
+                pass
+
+
+# Types of values, which snippets cannot change in place.
+_immutable = (ModuleType, FunctionType, BuiltinFunctionType, type, int,
+              float, complex, str, bytes, frozenset, range, type(None))
+
+
+def _mutable(names, scope):
+    """
+    Return set of ``names``, which values in ``scope`` can be changed in
+    place, e.g. by calls of their methods.
+    """
+    return frozenset(n for n in names
+                     if n in scope and not isinstance(scope[n], _immutable))
+
+
+# Prepared steps of templates: {template: {segment index: step}}.
+_steps = weakref.WeakKeyDictionary()
+
+
+def _template_steps(tpl):
+    if isinstance(tpl, tws.StreamTemplate):
+        # Segments are parsed anew for each rendering.
+        return {}
+    try:
+        return _steps[tpl]
+    except KeyError:
+        return _steps.setdefault(tpl, {})
+
+
+class _Pending(object):
+    """
+    Task of a snippet, that is not complete yet, and names it accesses.
+    """
+    __slots__ = ('task', 'read', 'written', 'barrier')
+
+    def __init__(self, task, read, written, barrier):
+        self.task = task
+        self.read = read
+        self.written = written
+        self.barrier = barrier
+
+    def conflicts(self, read, written, barrier):
+        """
+        True, if a snippet accessing names ``read`` and ``written`` must wait
+        for this one.
+        """
+        return (barrier or self.barrier or not self.read.isdisjoint(written)
+                or not self.written.isdisjoint(read)
+                or not self.written.isdisjoint(written))
+
+
+async def _render(tpl, scope):
+    """
+    Render the template ``tpl`` in the namespace ``scope``. Returns list of
+    resulting strings and lists of strings of snippets, in the template
+    order.
+    """
+    reads = tws._reads.get()
+    if reads:
+        reads[-1].add(tpl)
+    steps = _template_steps(tpl)
+    _log = tpl._log
+    slots = list(tpl._head)
+    pending = []
+    with _log:
+        for sid, seg in islice(enumerate(tpl.segments), tpl._start, None):
+            if seg.mode in ('text', 'skip'):
+                slots.append(seg.text)
+                continue
+            step = steps.get(sid)
+            if step is None or step.seg is not seg:
+                step = steps[sid] = _Step(seg)
+            read, written, barrier = step.read, step.written, step.barrier
+            functions = tws.function_access(read, scope)
+            if functions is None:
+                barrier = True
+            else:
+                read = functions[0]
+                written = written | functions[1]
+            # Objects read by several snippets can be changed by any of them.
+            written = written | _mutable(read, scope)
+            pending = [p for p in pending if not p.task.done()]
+            wait = [p.task for p in pending
+                    if p.conflicts(read, written, barrier)]
+            res = []
+            slots.append(res)
+            if wait:
+                # Later snippets are started meanwhile.
+                task = asyncio.ensure_future(
+                    _after(wait, tpl, step, sid, scope, res, _log))
+            else:
+                task = _start(tpl, step, sid, scope, res, _log)
+            if task is not None:
+                pending.append(_Pending(task, read, written, barrier))
+        if pending:
+            await asyncio.wait([p.task for p in pending])
+        _log.sid = _log.line = None
+    return slots
+
+
+async def _after(wait, tpl, step, sid, scope, res, _log):
+    """
+    Start the snippet ``step``, when the tasks ``wait`` are complete, and
+    await its result, see :func:`_start`.
+    """
+    await asyncio.wait(wait)
+    task = _start(tpl, step, sid, scope, res, _log)
+    if task is not None:
+        await task
+
+
+def _start(tpl, step, sid, scope, res, _log):
+    """
+    Evaluate or execute the snippet ``step`` (segment ``sid``) in the
+    namespace ``scope``, with its output captured, see
+    :meth:`twps.text_with_snippets.Template._generate_segments`. If the
+    result is awaitable, returns the task awaiting it, which appends
+    resulting strings to ``res`` when complete. Otherwise, they are appended
+    at once and None is returned.
+    """
+    seg = step.seg
+    _log.sid = sid
+    _log.line = seg.line
+    task = None
+    with tws._snippet_context(scope) as content:
+        try:
+            if step.mode == 'eval':
+                try:
+                    tmp = eval(step.code, scope)
+                    if inspect.isawaitable(tmp):
+                        # The task copies the current context, thus its output
+                        # is captured to ``content`` too.
+                        task = asyncio.ensure_future(
+                            _finish(tpl, step, tmp, res, content, _log))
+                    else:
+                        _eval_result(tpl, seg, tmp, res, scope, _log)
+                except Exception as err:
+                    tpl._eval_error(seg, err, res, _log)
+            else:
+                if seg.option != '-d':
+                    res.append(seg.text.replace('\n', '\n' + tpl.cchar))
+                try:
+                    if step.code is None:
+                        tpl._exec_error(seg, seg.error, _log)
+                    else:
+                        # Code with top-level await returns a coroutine.
+                        tmp = eval(step.code, scope)
+                        if tmp is not None:
+                            task = asyncio.ensure_future(
+                                _finish(tpl, step, tmp, res, content, _log))
+                except Exception as err:
+                    tpl._exec_error(seg, err, _log)
+        finally:
+            if task is None:
+                res += content
+    return task
+
+
+async def _finish(tpl, step, awaitable, res, content, _log):
+    """
+    Await the result of the snippet ``step`` and append resulting strings
+    to ``res``, followed by the snippet output ``content``.
+    """
+    try:
+        tmp = await awaitable
+        if step.mode == 'eval':
+            _eval_result(tpl, step.seg, tmp, res, tws._scope.get(), _log)
+    except Exception as err:
+        if step.mode == 'eval':
+            tpl._eval_error(step.seg, err, res, _log)
+        else:
+            tpl._exec_error(step.seg, err, _log)
+    finally:
+        res += content
+
+
+def _eval_result(tpl, seg, tmp, res, scope, _log):
+    """
+    Append to ``res`` the result ``tmp`` of the snippet segment ``seg``.
+    Streamed results are collected at once, since the text is returned as a
+    whole.
+    """
+    tpl._eval_result(seg, tmp, res)
+    if res and type(res[-1]) is tws._Stream:
+        res.extend(tpl._stream(res.pop(), scope, _log))
+
+
+def _strings(slots, encoding):
+    for s in slots:
+        for r in (s if isinstance(s, list) else (s,)):
+            if not isinstance(r, str):
+                # Text of a MappedTemplate.
+                r = str(r, encoding)
+            yield r
+
+
+async def render_async(tpl, scope=None, **params):
+    """
+    Render the template ``tpl`` (:class:`Template` or file name) and return
+    the resulting text. Awaitable snippets are awaited concurrently, see
+    :mod:`twps.aio`.
+
+    ``scope`` -- namespace of snippets, a dictionary or
+    :class:`RenderContext`. By default, the global one or, when called from
+    a snippet, that of the snippet, see :func:`current_namespace`.
+
+    Keyword arguments ``params`` are set in the namespace before rendering.
+    """
+    if not isinstance(tpl, tws.Template):
+        tpl = tws.load_template(tpl)
+    if scope is None:
+        scope = tws.current_namespace()
+    elif isinstance(scope, tws.RenderContext):
+        scope = scope.namespace
+    scope['pre_pro'] = tws.pre_pro
+    scope.update(params)
+    return ''.join(_strings(await _render(tpl, scope), tpl.encoding))
+
+
+async def render_variants_async(tpl, clp, scope=None, shard=None,
+                                incremental=False, concurrency=None):
+    """
+    Render variants of the template ``tpl`` (:class:`Template` or file name)
+    for parameters ``clp`` (list of tuples (name, values, i0), see
+    :func:`pre_pro`) concurrently, and write them to the resulting files.
+
+    Each variant is rendered in its own copy of the namespace ``scope`` (see
+    :func:`render_async`), where the parameters are set. ``shard`` and
+    ``incremental`` are as for :func:`pre_pro`. At most ``concurrency``
+    variants are rendered at once, all by default.
+
+    Returns list of names of the written files, in the order of variants.
+    None stands for files, which are up to date.
+    """
+    if not isinstance(tpl, tws.Template):
+        tpl = tws.load_template(tpl)
+    if scope is None:
+        scope = tws.current_namespace()
+    elif isinstance(scope, tws.RenderContext):
+        scope = scope.namespace
+    scope['pre_pro'] = tws.pre_pro
+    limit = asyncio.Semaphore(concurrency) if concurrency else None
+
+    async def variant(pidx, Plst):
+        if limit is None:
+            return await _variant(tpl, pidx, Plst, dict(scope), incremental)
+        async with limit:
+            return await _variant(tpl, pidx, Plst, dict(scope), incremental)
+
+    return await asyncio.gather(*[variant(pidx, Plst)
+                                  for pidx, Plst in variants(clp, shard)])
+
+
+async def _variant(tpl, pidx, Plst, scope, incremental):
+    """
+    Render one variant of the template, see :func:`render_variants_async`.
+    """
+    _log = tpl._log
+    _log(3, 'Current parameters: {!r}{!r}', pidx, Plst, event='variant')
+    scope.update(dict(Plst))
+    rname = tws.result_name(tpl.fname, pidx, tpl.compress)
+    if not incremental:
+        slots = await _render(tpl, scope)
+        return tws.write_result(rname, _strings(slots, tpl.encoding),
+                                tpl.mtime, tpl.atime, _log, tpl.compress,
+                                tpl.encoding)
+    key = deps.variant_key(tpl, Plst)
+    if deps.up_to_date(rname, key):
+        _log(0, 'Result {} is up to date', rname, event='write')
+        return None
+    with deps.Recorder(tpl.fname, *tpl._setup_deps) as rec:
+        slots = await _render(tpl, scope)
+    wname = tws.write_result(rname, _strings(slots, tpl.encoding), tpl.mtime,
+                             tpl.atime, _log, tpl.compress, tpl.encoding)
+    deps.save(rname, wname, key, rec.files)
+    return wname
@@ -0,0 +1,269 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Parametric studies written into a single tar or zip archive.
+
+Instead of a separate resulting file for each variant, all variants are
+written into one archive, one after another. The archive members have the
+names of the resulting files (without directory), e.g. ``template._0_1.t``.
+For ``template.t``, the archive is ``template.res.t.tar`` or
+``template.res.t.zip``.
+
+The member ``index.json`` describes the variants: it is a JSON object with
+the key ``variants``, the list of objects with keys ``idx`` (parameter
+indices), ``params`` (parameter names and values as repr strings) and
+``member``. In tar archives, the entries have also keys ``offset`` and
+``size`` of the member data, and the last member ``index.offset`` contains
+the offset of the ``index.json`` header. Thus :func:`read_variant` reads a
+single variant without scanning the archive.
+"""
+
+import os
+import io
+import json
+import time
+import tarfile
+import zipfile
+from os import path
+from stat import S_IREAD
+from tempfile import mkstemp, TemporaryFile
+
+from . import text_with_snippets as tws
+from .utils import variants
+
+INDEX = 'index.json'
+TRAILER = 'index.offset'
+
+# Compression of zip archive members, by the names of the compressed formats
+# of resulting files.
+_zip_compression = {None: zipfile.ZIP_STORED,
+                    'gz': zipfile.ZIP_DEFLATED,
+                    'bz2': zipfile.ZIP_BZIP2,
+                    'xz': zipfile.ZIP_LZMA}
+
+
+def archive_name(fname, fmt, shard=None):
+    """
+    Name of the archive of format ``fmt`` (``'tar'`` or ``'zip'``) with
+    results of the template ``fname``. Each shard of a study, see
+    :func:`twps.utils.variants`, is written to its own archive.
+    """
+    aname = tws.result_name(fname, ())
+    if shard is not None:
+        aname += '.{}of{}'.format(*shard)
+    return aname + '.' + fmt
+
+
+def _params(Plst):
+    return [[k, repr(v)] for k, v in Plst]
+
+
+class ArchiveWriter(object):
+    """
+    Writes variants of the template ``tpl`` to the archive of format ``fmt``.
+
+    ``compress`` -- compression of zip archive members, one of the keys of
+    :data:`twps.text_with_snippets.compressors`. Tar archives are not
+    compressed, since compressed tar archives cannot be read selectively.
+
+    The archive is written to a temporary file, which replaces the archive
+    in :meth:`close`.
+    """
+    def __init__(self, tpl, fmt, shard=None, compress=None):
+        if fmt not in ('tar', 'zip'):
+            raise ValueError('Unknown archive format {!r}'.format(fmt))
+        if fmt == 'tar' and compress:
+            raise ValueError('Tar archives cannot be compressed')
+        self.tpl = tpl
+        self.fmt = fmt
+        self.aname = archive_name(tpl.fname, fmt, shard)
+        dname, bname = path.split(self.aname)
+        self.dname = dname or '.'
+        fd, self.tname = mkstemp(prefix='.' + bname + '.', suffix='.tmp',
+                                 dir=self.dname)
+        os.close(fd)
+        if fmt == 'zip':
+            self.archive = zipfile.ZipFile(self.tname, 'w',
+                                           _zip_compression[compress],
+                                           allowZip64=True)
+        else:
+            self.archive = tarfile.open(self.tname, 'w',
+                                        format=tarfile.PAX_FORMAT)
+        self.index = []
+
+    def add(self, pidx, Plst, chunks):
+        """
+        Write strings from the iterable ``chunks`` as the variant with
+        parameter indices ``pidx`` and values ``Plst``.
+        """
+        tpl = self.tpl
+        member = path.basename(tws.result_name(tpl.fname, pidx))
+        entry = {'idx': list(pidx), 'params': _params(Plst),
+                 'member': member}
+        if self.fmt == 'zip':
+            info = zipfile.ZipInfo(member,
+                                   time.localtime(tpl.mtime)[:6])
+            info.compress_type = self.archive.compression
+            info.external_attr = (0o100000 | S_IREAD) << 16
+            with self.archive.open(info, 'w', force_zip64=True) as f:
+                _write(f, chunks)
+        else:
+            with TemporaryFile(dir=self.dname) as f:
+                _write(f, chunks)
+                info = tarfile.TarInfo(member)
+                info.size = f.tell()
+                info.mtime = tpl.mtime
+                info.mode = S_IREAD
+                f.seek(0)
+                self.archive.addfile(info, f)
+            entry['size'] = info.size
+            entry['offset'] = (self.archive.offset -
+                               (info.size + 511) // 512 * 512)
+        self.index.append(entry)
+        tpl._log(2, 'Variant {} is written to {}', member, self.aname,
+                 event='write')
+
+    def close(self):
+        """
+        Write the index, close the archive and put it in place of the
+        previous one. Returns the archive name.
+        """
+        tpl = self.tpl
+        index = json.dumps({'template': tpl.fname,
+                            'preamb': tpl.preamb,
+                            'variants': self.index}, indent=1).encode()
+        if self.fmt == 'zip':
+            self.archive.writestr(INDEX, index)
+        else:
+            offset = self.archive.offset
+            _add_bytes(self.archive, INDEX, index, tpl.mtime)
+            _add_bytes(self.archive, TRAILER, str(offset).encode(),
+                       tpl.mtime)
+        self.archive.close()
+        os.utime(self.tname, (tpl.atime, tpl.mtime))
+        os.chmod(self.tname, S_IREAD)
+        os.replace(self.tname, self.aname)
+        tpl._log(0, 'Results are written to {}', self.aname, event='write')
+        return self.aname
+
+    def abort(self):
+        """
+        Close and remove the incomplete archive.
+        """
+        self.archive.close()
+        os.remove(self.tname)
+
+
+def _write(f, chunks):
+    """
+    Write strings ``chunks`` to the binary file ``f``, encoded as text files.
+    """
+    w = io.TextIOWrapper(f)
+    w.writelines(chunks)
+    w.flush()
+    w.detach()
+
+
+def _add_bytes(tar, name, data, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = mtime
+    info.mode = S_IREAD
+    tar.addfile(info, io.BytesIO(data))
+
+
+def render_archive(tpl, clp, fmt, workers=None, shard=None, compress=None,
+                   scope=None):
+    """
+    Render variants of parameters ``clp`` (or of their ``shard``) of the
+    template ``tpl`` into the archive of format ``fmt``. With ``workers``,
+    the variants are rendered in parallel processes, see
+    :mod:`twps.sweep`, and written to the archive in order. Otherwise they
+    are rendered in the namespace ``scope``, by default the global one.
+    Returns the archive name.
+    """
+    writer = ArchiveWriter(tpl, fmt, shard, compress)
+    try:
+        if workers and workers > 1:
+            from .sweep import render_texts
+            for pidx, Plst, text in render_texts(tpl, clp, workers, shard):
+                writer.add(pidx, Plst, [text])
+        else:
+            if scope is None:
+                scope = tws.gld
+            for pidx, Plst in variants(clp, shard):
+                scope.update(dict(Plst))
+                writer.add(pidx, Plst, tpl._generate(scope))
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close()
+
+
+def read_index(aname):
+    """
+    Return the index of the archive ``aname``, see the module description.
+    """
+    if zipfile.is_zipfile(aname):
+        with zipfile.ZipFile(aname) as z:
+            return json.loads(z.read(INDEX).decode())
+    with open(aname, 'rb') as f:
+        # The last non-zero block is the data of the trailer member.
+        pos = f.seek(0, 2)
+        block = b''
+        while pos >= 512 and not block.strip(b'\0'):
+            pos -= 512
+            f.seek(pos)
+            block = f.read(512)
+        try:
+            f.seek(int(block.rstrip(b'\0')))
+            info = tarfile.TarInfo.frombuf(f.read(512), tarfile.ENCODING,
+                                           'surrogateescape')
+        except (ValueError, tarfile.TarError):
+            info = None
+        if info is None or info.name != INDEX:
+            raise ValueError('{} is not an archive of results'.format(aname))
+        return json.loads(f.read(info.size).decode())
+
+
+def read_variant(aname, idx=None, **params):
+    """
+    Return text of a variant from the archive ``aname``. The variant is
+    given by the tuple of parameter indices ``idx``, or by parameter values
+    as keyword arguments.
+    """
+    index = read_index(aname)
+    if idx is not None:
+        idx = list(idx)
+        entries = [e for e in index['variants'] if e['idx'] == idx]
+    else:
+        Plst = sorted(_params(params.items()))
+        entries = [e for e in index['variants']
+                   if sorted(e['params']) == Plst]
+    if not entries:
+        raise KeyError('No variant {} {} in {}'.format(idx or '', params,
+                                                      aname))
+    e = entries[0]
+    if 'offset' in e:
+        with open(aname, 'rb') as f:
+            f.seek(e['offset'])
+            data = f.read(e['size'])
+    else:
+        with zipfile.ZipFile(aname) as z:
+            data = z.read(e['member'])
+    return io.TextIOWrapper(io.BytesIO(data)).read()
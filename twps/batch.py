@@ -0,0 +1,144 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Concurrent processing of many independent templates.
+
+Templates are distributed over a pool of worker processes. The workers live
+until all templates are processed, therefore modules imported by snippets are
+imported once per worker, not once per template. Output printed while a
+template is processed is collected and printed in the order of templates.
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from . import text_with_snippets as tws
+from .limits import LimitExceeded
+from .sweep import _context
+
+# Baseline namespace of the worker process.
+_worker = {}
+
+
+def _import(modules):
+    for name in modules:
+        try:
+            tws.preload([name])
+        except Exception:
+            traceback.print_exc()
+
+
+def _init_worker(modules):
+    """
+    Initialize worker process: import ``modules`` into the global namespace
+    (if not inherited from the parent process already) and remember the
+    baseline namespace.
+    """
+    _import(modules)
+    tws.gld['pre_pro'] = tws.pre_pro
+    _worker['baseline'] = dict(tws.gld)
+
+
+def _render(fname, kwargs):
+    """
+    Process template ``fname`` in a fresh copy of the baseline namespace.
+    Returns tuple (ok, output, duration, limited), where ``output`` is
+    everything printed while the template was processed, and ``limited`` is
+    True, if it was aborted by exceeded limits, see :mod:`twps.limits`.
+    """
+    gld = tws.gld
+    gld.clear()
+    gld.update(_worker['baseline'])
+    t0 = time.time()
+    ok = False
+    limited = False
+    with tws.capture() as out:
+        try:
+            tws.pre_pro(fname=fname, level='main', **kwargs)
+            ok = True
+        except LimitExceeded as err:
+            # The variant is reported to the template log already.
+            print('Aborted:', err)
+            limited = True
+        except (Exception, SystemExit):
+            traceback.print_exc()
+    return ok, ''.join(out), time.time() - t0, limited
+
+
+def render_batch(templates, processes, modules=(), **kwargs):
+    """
+    Process ``templates`` concurrently in ``processes`` worker processes,
+    writing results to files. Each template is processed in a fresh
+    namespace.
+
+    ``modules`` -- names of modules to import into the namespace before
+    processing templates, once per worker, see
+    :func:`twps.text_with_snippets.preload`. The modules are imported in
+    the current process first, so that forked workers share them.
+
+    ``kwargs`` are passed to :func:`twps.pre_pro`.
+
+    Output of each template is printed as a whole, in the order of
+    ``templates``. Finally, a summary is printed. Returns list of templates,
+    processing of which failed.
+
+    When a template exceeds the limits given in ``kwargs`` with
+    ``on_limit='abort'``, templates not started yet are cancelled and are
+    counted as failed.
+    """
+    _import(modules)
+    t0 = time.time()
+    failed = []
+    cancelled = []
+    with ProcessPoolExecutor(processes, mp_context=_context(),
+                             initializer=_init_worker,
+                             initargs=(modules,)) as pool:
+        futures = [(t, pool.submit(_render, t, kwargs)) for t in templates]
+        for t, f in futures:
+            if f.cancelled():
+                print('==== {} (cancelled)'.format(t))
+                cancelled.append(t)
+                continue
+            try:
+                ok, output, duration, limited = f.result()
+            except Exception as err:
+                # The worker process died.
+                ok, output, duration = False, '{!r}\n'.format(err), 0.0
+                limited = False
+            print('==== {} ({:.2f} s{})'.format(
+                t, duration, '' if ok else
+                ', FAILED, limit exceeded' if limited else ', FAILED'))
+            sys.stdout.write(output)
+            sys.stdout.flush()
+            if not ok:
+                failed.append(t)
+            if limited:
+                # Running templates are completed.
+                pool.shutdown(wait=False, cancel_futures=True)
+    print('Processed {} templates in {:.2f} s with {} workers, {} failed{}'
+          ''.format(len(templates) - len(cancelled), time.time() - t0,
+                    processes, len(failed),
+                    ', {} cancelled'.format(len(cancelled))
+                    if cancelled else ''))
+    for t in failed:
+        print('    failed:', t)
+    return failed + cancelled
@@ -0,0 +1,102 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Identical resulting files of parametric studies.
+
+When a parameter does not affect the resulting text, several variants of a
+study have identical resulting files. After the study is rendered, such files
+can be found and either replaced with hard links to one of them, or listed in
+the report file next to the template (for ``template.t`` it is
+``.template.t.duplicates``), as a JSON list of groups of identical files.
+"""
+
+import os
+import json
+from os import path
+from collections import defaultdict
+
+from . import deps
+from .text_with_snippets import result_name
+from .utils import variants
+
+
+def report_name(fname):
+    """
+    Name of the report file for the template ``fname``.
+    """
+    dname, bname = path.split(fname)
+    return path.join(dname, '.' + bname + '.duplicates')
+
+
+def duplicates(fnames):
+    """
+    Return list of groups of files from ``fnames`` having the same content.
+    Each group is a list of at least two file names, in the order of
+    ``fnames``.
+    """
+    by_size = defaultdict(list)
+    for f in fnames:
+        if path.exists(f):
+            by_size[path.getsize(f)].append(f)
+    by_hash = defaultdict(list)
+    for fs in by_size.values():
+        if len(fs) > 1:
+            for f in fs:
+                by_hash[deps._hash(f)].append(f)
+    order = dict((f, i) for i, f in enumerate(fnames))
+    groups = [sorted(fs, key=order.get) for fs in by_hash.values()
+              if len(fs) > 1]
+    groups.sort(key=lambda fs: order[fs[0]])
+    return groups
+
+
+def link(groups):
+    """
+    Replace files in each of ``groups`` with hard links to the first file of
+    the group.
+    """
+    for fs in groups:
+        first = fs[0]
+        for f in fs[1:]:
+            if not path.samefile(first, f):
+                tname = f + '.tmp{}'.format(os.getpid())
+                os.link(first, tname)
+                os.replace(tname, f)
+
+
+def dedup_results(tpl, clp, mode, shard=None):
+    """
+    Find identical resulting files of the parametric study ``clp`` (or of its
+    ``shard``) of the template ``tpl``. If ``mode`` is ``'link'``, they are
+    replaced with hard links; if it is ``'report'``, they are listed in the
+    report file. Returns list of groups of identical files.
+    """
+    fnames = [result_name(tpl.fname, pidx, tpl.compress) for pidx, Plst in
+              variants(clp, shard)]
+    groups = duplicates(fnames)
+    n = sum(len(fs) - 1 for fs in groups)
+    tpl._log(0, '{} of {} results are duplicates', n, len(fnames),
+             event='dedup')
+    if mode == 'link':
+        link(groups)
+    elif mode == 'report':
+        with open(report_name(tpl.fname), 'w') as rf:
+            json.dump(groups, rf, indent=1)
+    else:
+        raise ValueError('Unknown deduplication mode {!r}'.format(mode))
+    return groups
@@ -0,0 +1,289 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Dependencies of resulting files, for incremental processing of templates.
+
+When a resulting file is written, its dependencies are saved into the
+manifest file next to it. The dependencies are:
+
+    * the template itself,
+
+    * templates processed by nested ``pre_pro`` calls,
+
+    * python modules imported by snippets, except modules of the standard
+      library and of installed packages,
+
+    * files declared by snippets with :func:`depends`,
+
+    * the command line snippet and the parameter values.
+
+The resulting file is up to date, when none of them has changed since the
+manifest was saved. Files are compared by size and modification time, and by
+content hash if the modification time differs.
+"""
+
+import sys
+import os
+import site
+import threading
+from contextvars import ContextVar
+from os import path
+from types import ModuleType
+
+from . import formats
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+# Original __import__ function.
+_import = builtins.__import__
+
+# Recorders of dependencies of resulting files being rendered in the current
+# context. Renders in other threads have their own recorders.
+_active = ContextVar('twps_deps_active', default=())
+
+# Number of active recorders in all threads. __import__ is replaced while
+# there are any.
+_recording = [0]
+_lock = threading.Lock()
+
+# Directories, where modules are not considered as dependencies.
+_system = None
+
+
+def manifest_name(rname):
+    """
+    Name of the manifest file for the resulting file ``rname``.
+    """
+    dname, bname = path.split(rname)
+    return path.join(dname, '.' + bname + '.deps')
+
+
+def depends(*fnames):
+    """
+    Declare files ``fnames`` as dependencies of the resulting file being
+    rendered. Call this function from snippets that read data files.
+    """
+    active = _active.get()
+    if active:
+        for f in fnames:
+            f = path.abspath(f)
+            for r in active:
+                r.files.add(f)
+
+
+# Templates processed with pre_pro are recorded automatically.
+record = depends
+
+
+class Recorder(object):
+    """
+    Collects dependencies of a resulting file while it is rendered. Use it as
+    a context manager.
+
+    ``fnames`` -- files known to be dependencies in advance.
+
+    While a recorder is active, ``__import__`` is replaced to record user
+    modules imported by snippets.
+    """
+    def __init__(self, *fnames):
+        self.files = set(path.abspath(f) for f in fnames)
+
+    def __enter__(self):
+        _active.set(_active.get() + (self,))
+        with _lock:
+            if not _recording[0]:
+                builtins.__import__ = _recording_import
+            _recording[0] += 1
+        return self
+
+    def __exit__(self, *exc):
+        _active.set(tuple(r for r in _active.get() if r is not self))
+        with _lock:
+            _recording[0] -= 1
+            if not _recording[0]:
+                builtins.__import__ = _import
+
+
+def _system_dirs():
+    global _system
+    if _system is None:
+        dirs = set([sys.prefix, sys.exec_prefix,
+                    getattr(sys, 'base_prefix', sys.prefix),
+                    getattr(sys, 'base_exec_prefix', sys.exec_prefix),
+                    path.dirname(path.abspath(__file__))])
+        try:
+            dirs.update(site.getsitepackages())
+        except AttributeError:
+            # site in virtualenv of old versions
+            pass
+        dirs.add(site.getusersitepackages())
+        _system = tuple(path.join(path.abspath(d), '') for d in dirs)
+    return _system
+
+
+def module_file(m):
+    """
+    Return source file of the module ``m``, if it belongs neither to the
+    standard library nor to installed packages. Otherwise return None.
+    """
+    f = getattr(m, '__file__', None)
+    if not f:
+        return None
+    f = path.abspath(f)
+    if f.endswith('.pyc'):
+        f = f[:-1]
+    if f.endswith('.py') and not f.startswith(_system_dirs()):
+        return f
+    return None
+
+
+def module_deps(m):
+    """
+    Return set of source files of the user module ``m`` and of user modules
+    it uses, i.e. modules and modules of functions and classes found in its
+    namespace.
+    """
+    name = getattr(m, '__name__', None)
+    if name in _module_deps:
+        return _module_deps[name]
+    res = set()
+    _module_deps[name] = res  # to stop recursion
+    f = module_file(m)
+    if f is not None:
+        res.add(f)
+        for v in list(vars(m).values()):
+            if not isinstance(v, ModuleType):
+                v = sys.modules.get(getattr(v, '__module__', None))
+            if v is not None and v is not m and module_file(v):
+                res.update(module_deps(v))
+    return res
+
+
+def forget_modules():
+    """
+    Forget dependencies of modules found by :func:`module_deps`. Must be
+    called when modules are reloaded.
+    """
+    _module_deps.clear()
+
+
+# Dependencies of modules, found by module_deps()
+_module_deps = {}
+
+
+def _recording_import(name, globals=None, locals=None, fromlist=(),
+                      level=0):
+    """
+    Replacement of ``__import__`` used while dependencies are recorded.
+    Source files of imported user modules are recorded, even if the modules
+    have been already imported before.
+    """
+    m = _import(name, globals, locals, fromlist, level)
+    active = _active.get()
+    if active:
+        mods = [m]
+        if level == 0:
+            mods.append(sys.modules.get(name))
+            for a in fromlist or ():
+                mods.append(sys.modules.get(name + '.' + a))
+        files = set()
+        for mod in mods:
+            if mod is not None:
+                files.update(module_deps(mod))
+        for r in active:
+            r.files.update(files)
+    return m
+
+
+def _hash(fname):
+    import hashlib
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _stat(fname):
+    st = os.stat(fname)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def variant_key(tpl, Plst):
+    """
+    Return dictionary describing how the template ``tpl`` is rendered with
+    parameters ``Plst``, i.e. everything except files, that the result
+    depends on.
+    """
+    key = {'template': path.abspath(tpl.fname),
+           'preamb': tpl.preamb,
+           'params': [[k, repr(v)] for k, v in Plst]}
+    registry = formats.registry(tpl)
+    if registry:
+        # Formatters of snippet results change the text.
+        key['formatters'] = formats.describe(registry)
+    return key
+
+
+def save(rname, wname, key, files):
+    """
+    Save manifest of the resulting file ``rname``, that was actually written
+    to ``wname``. ``key`` is returned by :func:`variant_key`, ``files`` is the
+    set of dependency file names.
+    """
+    manifest = {'output': wname,
+                'stat': _stat(wname),
+                'key': key,
+                'files': {}}
+    for f in sorted(files):
+        if path.exists(f):
+            manifest['files'][f] = _stat(f) + [_hash(f)]
+    import json
+    mname = manifest_name(rname)
+    tname = mname + '.tmp{}'.format(os.getpid())
+    with open(tname, 'w') as mf:
+        json.dump(manifest, mf, indent=1)
+    os.replace(tname, mname)
+
+
+def up_to_date(rname, key):
+    """
+    Check if the resulting file ``rname`` is up to date, i.e. its manifest
+    exists, was saved with the same ``key`` and none of the dependency files
+    has changed.
+    """
+    import json
+    try:
+        with open(manifest_name(rname), 'r') as mf:
+            manifest = json.load(mf)
+    except (IOError, OSError, ValueError):
+        return False
+    if manifest.get('key') != key:
+        return False
+    try:
+        if _stat(manifest['output']) != manifest['stat']:
+            return False
+        for f, (mtime, size, sha) in manifest['files'].items():
+            if _stat(f) != [mtime, size]:
+                if path.getsize(f) != size or _hash(f) != sha:
+                    return False
+    except (OSError, KeyError, ValueError, TypeError):
+        return False
+    return True
@@ -0,0 +1,264 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Formatters of snippet results.
+
+By default, the result of an evaluated snippet is converted to text with
+``str()``. A formatter is a callable, that takes the result and returns its
+text, or an iterator of strings, which is streamed into the resulting file,
+or None to fall back to ``str()``. Formatters are selected by the type of
+the result from a registry, i.e. a dictionary {type: formatter}. Types can
+be given also by their qualified names, e.g. ``'numpy.ndarray'``, so that
+numpy is not imported to register a formatter for it.
+
+The registry :data:`formatters` applies to all templates, and is empty by
+default. A template can have its own registry, given to ``pre_pro(...,
+formatters=...)`` (``ppp.py --format SPEC``). Within a snippet, a formatter
+can be called explicitly, e.g. ```Numbers(10, 3, 'f', per_line=6)(x)```.
+
+:class:`Numbers` writes numpy arrays and lists or tuples of numbers in
+fixed-width columns. The values are formatted by blocks with one ``%``
+operation per block, i.e. without Python calls per value. The registry
+returned by :func:`numeric` (``ppp.py --format``) applies it to numeric
+arrays, and to lists and tuples only if all their items are floats, so that
+e.g. ``(1, 2)`` or ``[True, False]`` are written as before.
+
+Formatters change the resulting text, thus the registry is described in
+the key of incremental rendering, see :func:`describe`.
+"""
+
+import re
+from array import array
+
+# Global registry of formatters: {type or qualified type name: formatter}.
+formatters = {}
+
+
+def register(cls, formatter, registry=None):
+    """
+    Register ``formatter`` for results of the type ``cls`` (a type or its
+    qualified name, e.g. ``'numpy.ndarray'``) in the ``registry``, by
+    default in the global one.
+    """
+    if registry is None:
+        registry = formatters
+    registry[cls] = formatter
+
+
+def find(value, registry):
+    """
+    Return formatter from ``registry`` for ``value``, or None. Formatters
+    registered for base classes apply too.
+    """
+    for cls in type(value).__mro__:
+        formatter = registry.get(cls)
+        if formatter is None:
+            formatter = registry.get(cls.__module__ + '.' + cls.__qualname__)
+        if formatter is not None:
+            return formatter
+    return None
+
+
+def registry(tpl):
+    """
+    Return the registry of formatters of the template ``tpl``.
+    """
+    return formatters if tpl.formatters is None else tpl.formatters
+
+
+def describe(registry):
+    """
+    Return list of pairs [type name, formatter description] of ``registry``,
+    which does not change between runs, if the formatters do not.
+    """
+    items = []
+    for cls, formatter in registry.items():
+        if not isinstance(cls, str):
+            cls = cls.__module__ + '.' + cls.__qualname__
+        name = getattr(formatter, '__qualname__', None)
+        if name is None:
+            name = repr(formatter)
+        else:
+            name = getattr(formatter, '__module__', '') + '.' + name
+        items.append([cls, name])
+    return sorted(items)
+
+
+def apply(value, registry):
+    """
+    Format ``value`` with the formatter from ``registry``. Returns the
+    text, an iterator of strings, or None if there is no formatter or it
+    declines the value.
+    """
+    formatter = find(value, registry)
+    if formatter is None:
+        return None
+    return formatter(value)
+
+
+def _escape(s):
+    return s.replace('%', '%%')
+
+
+class Numbers(object):
+    """
+    Formatter of numeric sequences: numpy arrays (flattened) and lists,
+    tuples or arrays of numbers. Other values are declined.
+
+    ``width``, ``precision``, ``style`` -- the ``%`` conversion of each
+    value, ``'%{width}.{precision}{style}'``, e.g. ``%12.5e``.
+
+    ``per_line`` -- number of values per line, all values on one line by
+    default.
+
+    ``separator`` -- string between values on a line.
+
+    ``indent`` -- prefix of lines after the first one. The first line starts
+    where the snippet is.
+
+    ``continuation`` -- suffix of lines before the last one, e.g. ``' &'``.
+
+    ``block`` -- approximate number of values formatted at once. The result
+    is streamed by blocks.
+    """
+    def __init__(self, width=12, precision=5, style='e', per_line=None,
+                 separator=' ', indent='', continuation='', block=1 << 14):
+        self.width = width
+        self.precision = precision
+        self.style = style
+        self.per_line = per_line
+        self.separator = separator
+        self.indent = indent
+        self.continuation = continuation
+        self.block = block
+
+    # Specification of the format, see parse().
+    _spec = re.compile(r'(\d*)\.(\d+)([eEfFgG])(?:/([1-9]\d*))?$')
+
+    @classmethod
+    def parse(cls, spec, **kwargs):
+        """
+        Return formatter for the specification ``'W.PS[/N]'``, e.g.
+        ``'12.5e/6'``: width W (optional), precision P, style S (one of
+        ``eEfFgG``) and N values per line. Raises ValueError, if the
+        specification is wrong.
+        """
+        m = cls._spec.match(spec)
+        if m is None:
+            raise ValueError('Wrong number format {!r}, expected W.PS[/N], '
+                             'e.g. 12.5e/6'.format(spec))
+        width, precision, style, n = m.groups()
+        return cls(int(width or 0), int(precision), style,
+                   int(n) if n else None, **kwargs)
+
+    def __repr__(self):
+        return ('Numbers({!r}, {!r}, {!r}, {!r}, separator={!r}, indent={!r}, '
+                'continuation={!r}, block={!r})').format(
+            self.width, self.precision, self.style, self.per_line,
+            self.separator, self.indent, self.continuation, self.block)
+
+    def __call__(self, value):
+        values = _numbers(value)
+        if values is None:
+            return None
+        return self._blocks(values)
+
+    def _blocks(self, values):
+        """
+        Yield text of ``values`` by blocks.
+        """
+        n = len(values)
+        if not n:
+            return
+        per_line = self.per_line or n
+        conv = '%{}.{}{}'.format(self.width, self.precision, self.style)
+        sep = _escape(self.separator)
+        # Pattern of a line, preceded by the end of the previous one.
+        newline = '{}\n{}'.format(_escape(self.continuation),
+                                  _escape(self.indent))
+        line = newline + sep.join([conv] * per_line)
+        first = min(per_line, n)
+        yield sep.join([conv] * first) % _tuple(values[:first])
+        i = first
+        lines = max(1, self.block // per_line)
+        pattern = line * lines
+        step = lines * per_line
+        while n - i >= step:
+            yield pattern % _tuple(values[i:i + step])
+            i += step
+        full = (n - i) // per_line
+        if full:
+            yield line * full % _tuple(values[i:i + full * per_line])
+            i += full * per_line
+        if i < n:
+            yield (newline + sep.join([conv] * (n - i))) % _tuple(values[i:])
+
+
+def _numbers(value):
+    """
+    Return ``value`` as a flat sequence of numbers, that can be sliced, or
+    None if it is not numeric.
+    """
+    if isinstance(value, (list, tuple)):
+        try:
+            # Checks the items in C. Integers are formatted as they are.
+            array('d', value)
+        except (TypeError, OverflowError):
+            return None
+        return value
+    if isinstance(value, array):
+        return value if value.typecode not in 'uw' else None
+    kind = getattr(getattr(value, 'dtype', None), 'kind', None)
+    if kind is not None and kind in 'iuf' and hasattr(value, 'ravel'):
+        # numpy array.
+        return value.ravel()
+    return None
+
+
+def _tuple(values):
+    tolist = getattr(values, 'tolist', None)
+    return tuple(values if tolist is None else tolist())
+
+
+class _Floats(object):
+    """
+    Formatter of lists and tuples, that applies ``formatter`` to those, all
+    items of which are floats, and declines other ones.
+    """
+    def __init__(self, formatter):
+        self.formatter = formatter
+
+    def __repr__(self):
+        return '_Floats({!r})'.format(self.formatter)
+
+    def __call__(self, value):
+        types = set(map(type, value))
+        if types and all(issubclass(t, float) for t in types):
+            return self.formatter(value)
+        return None
+
+
+def numeric(formatter):
+    """
+    Return registry, in which ``formatter`` (e.g. :class:`Numbers`) is
+    registered for numpy arrays and arrays of numbers, and for lists and
+    tuples of floats.
+    """
+    floats = _Floats(formatter)
+    return {'numpy.ndarray': formatter, array: formatter, list: floats,
+            tuple: floats}
@@ -0,0 +1,329 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Cache of templates included by snippets.
+
+A template, e.g. a material or geometry description, included with
+``pre_pro('t5.t', i=(1, 2, 3))`` from many snippets, is read, parsed and
+rendered each time. When the cache is enabled (``ppp.py --include-cache MB``
+or ``text_with_snippets.include_cache = IncludeCache(max_bytes)``), the text
+of the included template is reused if
+
+    * the template file has the same path, modification time and size,
+
+    * ``pre_pro`` is called with the same arguments,
+
+    * the names of the calling namespace, which snippets of the included
+      template and of templates rendered by them read (see
+      :meth:`twps.text_with_snippets.Template.names`), have the same values
+      as before the included template was rendered. Names read by functions
+      defined in the namespace count too,
+
+    * files, which the included template depends on (see :mod:`twps.deps`),
+      have not changed.
+
+Values are compared by their pickled representation. Modules and functions
+are compared by identity: they are not changed by snippets, and names used
+by functions are followed. Other objects, that cannot be pickled (e.g.
+instances holding a lock), can change in place unnoticed, thus included
+templates reading them, or called with them as arguments, are not cached.
+
+When the text is reused, the names defined or rebound by the included
+template are set in the namespace again, the messages printed while it was
+rendered are printed again and its dependencies are recorded. The objects
+are not copied, and changes made by the included template to objects, that
+existed before, are not repeated.
+
+Templates, which snippets access the namespace dynamically (``globals()``,
+``eval`` etc.), or which are processed in the streaming mode, are not cached.
+The least recently used texts are evicted, when their total size exceeds the
+limit.
+"""
+
+import sys
+import pickle
+import threading
+from collections import OrderedDict
+from os import path
+from types import BuiltinFunctionType, FunctionType, ModuleType
+
+from . import text_with_snippets as tws
+from . import deps
+from . import log
+
+
+class _Identity(object):
+    """
+    Fingerprint of a value, which is compared by identity.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, _Identity) and other.value is self.value
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return id(self.value)
+
+
+# Fingerprint of values, which cannot be compared. Keys of cached entries
+# never contain it.
+_unknown = object()
+
+
+def fingerprint(value):
+    """
+    Return hashable object, that is equal for equal values, or
+    :data:`_unknown`, see the module description.
+    """
+    if isinstance(value, (ModuleType, FunctionType, BuiltinFunctionType)):
+        return _Identity(value)
+    try:
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return _unknown
+
+
+class _Access(object):
+    """
+    Names read and written by templates rendered while an included template
+    is rendered in the namespace ``scope``, and fingerprints of values of
+    the read names before the templates were rendered.
+    """
+    def __init__(self, scope):
+        self.scope = scope
+        self.read = set()
+        self.written = set()
+        self.values = {}
+        self.known = True
+
+    def add(self, tpl):
+        """
+        Add names accessed by the template ``tpl``, which starts rendering,
+        and by functions it calls.
+        """
+        names = tpl.names()
+        functions = None
+        if names is not None:
+            # Functions are followed, if their globals are the namespace
+            # itself, not a copy of it.
+            functions = tws.function_access(names[0], self.scope)
+        if functions is None:
+            self.known = False
+            return
+        self.read |= functions[0]
+        self.written |= names[1] | functions[1]
+        # Values are taken before the snippets change them, in place too.
+        scope = self.scope
+        for n in functions[0]:
+            if n not in self.values:
+                value = fingerprint(scope[n]) if n in scope else None
+                if value is _unknown:
+                    self.known = False
+                self.values[n] = value
+
+    def merge(self, names, values):
+        """
+        Add names read by an included template and their fingerprints.
+        """
+        self.read |= names
+        for n in names:
+            self.values.setdefault(n, values.get(n))
+
+
+class _Entry(object):
+    """
+    Cached included text, with its side effects and dependencies.
+    """
+    __slots__ = ('text', 'output', 'updates', 'deleted', 'files', 'read',
+                 'values', 'written', 'size')
+
+    def valid(self):
+        try:
+            return all(deps._stat(f) == st for f, st in self.files.items())
+        except OSError:
+            return False
+
+
+class IncludeCache(object):
+    """
+    Texts of templates included by snippets. When their total size, in
+    bytes, exceeds ``max_bytes``, the least recently used ones are evicted.
+
+    ``hits`` and ``misses`` count the included templates, which were reused
+    and rendered.
+    """
+    def __init__(self, max_bytes=64 << 20):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Tuples of names used by the cached entries, by the keys of the
+        # template file and the call, with the numbers of such entries.
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def include(self, fname, call, params, scope, render):
+        """
+        Return text of the template ``fname``, included with arguments
+        ``call`` in the namespace ``scope``. If it is not cached, it is
+        rendered with ``render()``. ``params`` are names of parameters set by
+        the call.
+        """
+        st = tuple(deps._stat(fname))
+        active = log._active.get()
+        level = active[-1].level if active else log.default_level
+        base = (path.abspath(fname), st, fingerprint((call, level)))
+        if base[2] is _unknown:
+            # Names read by the included template are added to the including
+            # one directly.
+            return render()
+        with self._lock:
+            candidates = list(self._names.get(base, ()))
+        for names in candidates:
+            key = (base, names, _values(names, scope))
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+            if entry is None:
+                continue
+            if entry.valid():
+                self.hits += 1
+                return _replay(entry, scope)
+            with self._lock:
+                if key in self._entries:
+                    self._remove(key)
+
+        self.misses += 1
+        before = dict(scope)
+        access = _Access(scope)
+        outer = tws._reads.get()
+        tws._reads.set(outer + (access,))
+        try:
+            with tws.capture() as out:
+                with deps.Recorder() as rec:
+                    text = render()
+        finally:
+            tws._reads.set(outer)
+            output = ''.join(out)
+            if output:
+                sys.stdout.write(output)
+        known = access.known
+        # Parameters are set by the call, not read from the namespace.
+        access.read -= set(params)
+        access.written |= set(params)
+        # Names accessed by the included template are accessed by the
+        # including one too.
+        if outer:
+            if known:
+                outer[-1].merge(access.read, access.values)
+                outer[-1].written |= access.written
+            else:
+                outer[-1].known = False
+        if not known:
+            return text
+        names = tuple(sorted(access.read))
+
+        entry = _Entry()
+        entry.text = text
+        entry.output = output
+        # Names written by the included template, also those which got the
+        # same object, and names rebound in other ways.
+        entry.updates = dict((k, v) for k, v in scope.items()
+                             if k in access.written or
+                             k != '__builtins__' and
+                             (k not in before or before[k] is not v))
+        entry.deleted = tuple(k for k in before if k not in scope)
+        entry.files = {}
+        for f in rec.files:
+            if path.exists(f):
+                entry.files[f] = deps._stat(f)
+        entry.read = access.read
+        entry.written = access.written
+        values = tuple(access.values.get(n) for n in names)
+        entry.values = dict(zip(names, values))
+        entry.size = (sys.getsizeof(text) + sys.getsizeof(output) +
+                      sum(len(v) for v in values if isinstance(v, bytes)))
+        self._store((base, names, values), entry)
+        return text
+
+    def _store(self, key, entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            counts = self._names.setdefault(key[0], {})
+            counts[key[1]] = counts.get(key[1], 0) + 1
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+        counts = self._names[key[0]]
+        counts[key[1]] -= 1
+        if not counts[key[1]]:
+            del counts[key[1]]
+            if not counts:
+                del self._names[key[0]]
+
+    def clear(self):
+        """
+        Remove all cached texts.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._names.clear()
+            self.size = 0
+
+
+def _values(names, scope):
+    """
+    Fingerprints of values of ``names`` in ``scope``. None for undefined
+    names.
+    """
+    return tuple(fingerprint(scope[n]) if n in scope else None
+                 for n in names)
+
+
+def _replay(entry, scope):
+    """
+    Repeat side effects of the cached included template, return its text.
+    """
+    scope.update(entry.updates)
+    for k in entry.deleted:
+        scope.pop(k, None)
+    if entry.files:
+        deps.depends(*entry.files)
+    reads = tws._reads.get()
+    if reads:
+        reads[-1].merge(entry.read, entry.values)
+        reads[-1].written |= entry.written
+    if entry.output:
+        sys.stdout.write(entry.output)
+    return entry.text
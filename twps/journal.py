@@ -0,0 +1,169 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Journal of parametric studies, to resume interrupted studies.
+
+While variants of a parametric study are rendered, a record for each variant
+is appended to the journal file next to the template (for ``template.t`` it is
+``.template.t.journal``). The first line of the journal describes the
+template, each next line is a JSON object with the keys:
+
+    ``idx`` -- parameter indices of the variant,
+
+    ``params`` -- list of parameter names and values (as repr strings),
+
+    ``name`` -- name of the resulting file,
+
+    ``output`` -- name of the actually written file, see
+    :func:`twps.text_with_snippets.write_result`,
+
+    ``stat`` and ``sha1`` -- modification time, size and hash of the written
+    file,
+
+    ``status`` -- ``'done'`` or ``'failed'``,
+
+    ``duration`` -- rendering time in seconds.
+
+When a study is resumed, variants with ``'done'`` records, which written
+files have not changed, are not rendered again. Variants are identified by
+parameter values, therefore after adding new values to a parameter only the
+new combinations are rendered (and those, which resulting file names have
+changed).
+
+Only changes of the template file and of the command line snippet make the
+journal invalid. To follow changes of other dependencies, use the incremental
+mode, see :mod:`twps.deps`.
+"""
+
+import json
+from os import path
+
+from . import deps
+
+
+def journal_name(fname, shard=None):
+    """
+    Name of the journal file for the template ``fname``. Each shard of the
+    study, see :func:`twps.utils.variants`, has its own journal.
+    """
+    dname, bname = path.split(fname)
+    if shard is not None:
+        bname += '.{}of{}'.format(*shard)
+    return path.join(dname, '.' + bname + '.journal')
+
+
+def _key(Plst):
+    return json.dumps([[k, repr(v)] for k, v in Plst])
+
+
+class Journal(object):
+    """
+    Journal of the parametric study of the template ``tpl``.
+
+    ``resume`` -- if True, records of the existing journal are read and new
+    records are appended to it. Otherwise, the journal is started anew.
+
+    ``shard`` -- the shard of the study, see :func:`twps.utils.variants`.
+    """
+    def __init__(self, tpl, resume=False, shard=None):
+        self.fname = journal_name(tpl.fname, shard)
+        self.header = {'template': path.abspath(tpl.fname),
+                       'sha1': deps._hash(tpl.fname),
+                       'preamb': tpl.preamb}
+        self.done = {}
+        self.file = None
+        if resume and self._read():
+            tpl._log(2, 'Resuming from journal {}, {} variants done',
+                     self.fname, len(self.done), event='journal')
+        else:
+            if resume:
+                tpl._log(1, 'WARNING: journal {} is missing or belongs to '
+                         'another template version, all variants are '
+                         'rendered', self.fname, event='journal')
+            with open(self.fname, 'w') as jf:
+                jf.write(json.dumps(self.header) + '\n')
+
+    def _read(self):
+        """
+        Read records of the existing journal. Returns False, if there is no
+        journal for the current template.
+        """
+        try:
+            with open(self.fname, 'r') as jf:
+                if json.loads(jf.readline()) != self.header:
+                    return False
+                for line in jf:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # Incomplete line written when the study was killed.
+                        continue
+                    key = json.dumps(rec['params'])
+                    if rec['status'] == 'done':
+                        self.done[key] = rec
+                    else:
+                        self.done.pop(key, None)
+        except (IOError, OSError, ValueError, KeyError):
+            self.done = {}
+            return False
+        return True
+
+    def completed(self, rname, Plst):
+        """
+        Check if the variant with parameters ``Plst`` was rendered to the
+        resulting file ``rname``, and the written file has not changed since.
+        """
+        rec = self.done.get(_key(Plst))
+        if rec is None or rec['name'] != rname:
+            return False
+        try:
+            if deps._stat(rec['output']) != rec['stat']:
+                return deps._hash(rec['output']) == rec['sha1']
+        except (OSError, IOError):
+            return False
+        return True
+
+    def record(self, pidx, Plst, rname, wname, status, duration):
+        """
+        Append record of the variant to the journal.
+        """
+        rec = {'idx': list(pidx),
+               'params': [[k, repr(v)] for k, v in Plst],
+               'name': rname,
+               'output': wname,
+               'status': status,
+               'duration': duration}
+        if wname is not None:
+            rec['stat'] = deps._stat(wname)
+            rec['sha1'] = deps._hash(wname)
+        if self.file is None:
+            # Line buffering and append mode allow several processes to
+            # write into one file.
+            self.file = open(self.fname, 'a', buffering=1)
+        self.file.write(json.dumps(rec) + '\n')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __getstate__(self):
+        # The file is opened again in the unpickling process.
+        state = self.__dict__.copy()
+        state['file'] = None
+        return state
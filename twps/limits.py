@@ -0,0 +1,274 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Time and memory limits of snippets and variants.
+
+A runaway snippet, e.g. an infinite loop or an array growing without bound,
+would stall or kill the whole parametric study. With :class:`Limits` given
+to :func:`twps.text_with_snippets.pre_pro` (``ppp.py --snippet-time S``
+etc.), each snippet and each variant rendered to a resulting file can be
+limited in
+
+    * wall-clock time, in seconds. When it is over, :exc:`LimitExceeded` is
+      raised in the running snippet by the SIGALRM handler.
+
+    * memory, in megabytes, which the process can allocate in addition to
+      its size at the start of the snippet or variant. The address space of
+      the process is limited (RLIMIT_AS), allocations beyond it raise
+      MemoryError, which is reported as :exc:`LimitExceeded`.
+
+Snippets of templates included by a snippet have their own snippet limits,
+and remain bounded by the limits of the including snippet.
+
+The limits are enforced on Linux and other systems with ``setitimer`` and
+``setrlimit``, and only in the main thread of a process, i.e. also in the
+worker and forked processes of ``-j`` and ``--fork``. Otherwise, they are
+ignored.
+
+The variant, that exceeds a limit, is reported with the template and line
+number of the snippet running at the moment, and is not written. With
+``on_limit='skip'``, the parametric study continues with the next variant.
+With ``'abort'``, it stops and :exc:`LimitExceeded` is raised from
+``pre_pro``.
+"""
+
+import os
+import time
+import signal
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+class LimitExceeded(BaseException):
+    """
+    Raised when a snippet or variant exceeds its time or memory limit.
+
+    It is not an Exception, thus it is not caught by snippets, that catch
+    exceptions, and ends rendering of the variant. ``fname`` and ``line``
+    are the template and line of the snippet, where the limit was exceeded,
+    if known.
+    """
+    fname = None
+    line = None
+
+    def __str__(self):
+        msg = BaseException.__str__(self)
+        if self.line is not None:
+            msg += ' at line {} of {}'.format(self.line, self.fname)
+        return msg
+
+
+# Limits and bounds, that apply in the current context: tuple (limits,
+# bound) or None.
+_active = ContextVar('twps_limits', default=None)
+
+
+class _Bound(object):
+    """
+    Deadline (time.monotonic() value) and maximal size of the address space,
+    each with the message of LimitExceeded, or None.
+    """
+    __slots__ = ('deadline', 'time', 'cap', 'memory')
+
+    def __init__(self, outer=None):
+        if outer is None:
+            self.deadline = self.time = self.cap = self.memory = None
+        else:
+            self.deadline = outer.deadline
+            self.time = outer.time
+            self.cap = outer.cap
+            self.memory = outer.memory
+
+
+def active_limits():
+    """
+    Return :class:`Limits` of the variant being rendered in the current
+    context, or None.
+    """
+    active = _active.get()
+    return active and active[0]
+
+
+def check_memory_error(err):
+    """
+    Raise :exc:`LimitExceeded` from the MemoryError ``err``, if the memory
+    is limited in the current context.
+    """
+    active = _active.get()
+    if active and active[1].cap is not None:
+        raise LimitExceeded(active[1].memory) from err
+
+
+def _vm_size():
+    """
+    Size of the address space of the process in bytes, or None if unknown.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def _supported():
+    return (hasattr(signal, 'setitimer') and
+            threading.current_thread() is threading.main_thread())
+
+
+# Deadline, for which LimitExceeded was raised last. Signals are handled in
+# the main thread only, thus it is global.
+_fired = None
+
+
+def _alarm(signum, frame):
+    global _fired
+    active = _active.get()
+    if active is None or active[1].deadline in (None, _fired):
+        # The deadline of an enclosing snippet or variant, rearmed when the
+        # nested one exits, is already being reported.
+        return
+    _fired = active[1].deadline
+    raise LimitExceeded(active[1].time)
+
+
+def _arm(deadline):
+    if deadline is None:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    else:
+        # A zero value would disarm the timer.
+        delay = max(deadline - time.monotonic(), 1e-6)
+        signal.setitimer(signal.ITIMER_REAL, delay)
+
+
+def _set_cap(cap):
+    """
+    Limit the address space of the process to ``cap`` bytes. Returns the
+    previous limits.
+    """
+    import resource
+    old = resource.getrlimit(resource.RLIMIT_AS)
+    soft, hard = old
+    if cap is not None:
+        soft = cap if hard == resource.RLIM_INFINITY else min(cap, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+    return old
+
+
+@contextmanager
+def _enforce(limits, what, seconds, megabytes):
+    """
+    Enforce limits ``seconds`` and ``megabytes`` of the snippet or variant
+    ``what`` in the current context, within the bounds already applied.
+    """
+    active = _active.get()
+    if (active and not (seconds or megabytes)) or not _supported():
+        yield
+        return
+    outer = active and active[1]
+    bound = _Bound(outer)
+    if seconds:
+        deadline = time.monotonic() + seconds
+        if bound.deadline is None or deadline < bound.deadline:
+            bound.deadline = deadline
+            bound.time = '{} time limit of {} s exceeded'.format(what,
+                                                                 seconds)
+    old_cap = None
+    if megabytes:
+        size = _vm_size()
+        if size is not None:
+            cap = size + int(megabytes * 2**20)
+            if bound.cap is None or cap < bound.cap:
+                bound.cap = cap
+                bound.memory = '{} memory limit of {} MB exceeded'.format(
+                    what, megabytes)
+                old_cap = _set_cap(cap)
+    token = _active.set((limits, bound))
+    handler = signal.signal(signal.SIGALRM, _alarm)
+    _arm(bound.deadline)
+    try:
+        yield
+    except MemoryError as err:
+        if bound.cap is None:
+            raise
+        raise LimitExceeded(bound.memory) from err
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        if old_cap is not None:
+            import resource
+            resource.setrlimit(resource.RLIMIT_AS, old_cap)
+        _active.reset(token)
+        signal.signal(signal.SIGALRM, handler)
+        if outer and outer.deadline is not None:
+            _arm(outer.deadline)
+
+
+class Limits(object):
+    """
+    Time and memory limits of snippets and variants, see :mod:`twps.limits`.
+
+    ``snippet_time``, ``variant_time`` -- wall-clock time limits in seconds.
+
+    ``snippet_memory``, ``variant_memory`` -- memory limits in megabytes.
+
+    ``on_limit`` -- ``'skip'`` to continue the parametric study with the next
+    variant, when a variant exceeds a limit, or ``'abort'`` to stop it.
+
+    Limits not given are not applied.
+    """
+    def __init__(self, snippet_time=None, snippet_memory=None,
+                 variant_time=None, variant_memory=None, on_limit='skip'):
+        if on_limit not in ('skip', 'abort'):
+            raise ValueError('Unknown on_limit policy {!r}'.format(on_limit))
+        self.snippet_time = snippet_time
+        self.snippet_memory = snippet_memory
+        self.variant_time = variant_time
+        self.variant_memory = variant_memory
+        self.on_limit = on_limit
+
+    def __repr__(self):
+        return ('Limits(snippet_time={!r}, snippet_memory={!r}, '
+                'variant_time={!r}, variant_memory={!r}, on_limit={!r})'
+                ).format(self.snippet_time, self.snippet_memory,
+                         self.variant_time, self.variant_memory,
+                         self.on_limit)
+
+    @contextmanager
+    def variant(self, tpl, pidx, Plst):
+        """
+        Apply the limits to rendering of the variant ``pidx``, ``Plst`` of
+        the template ``tpl`` and to its snippets. Exceeded limits are
+        reported to the template log.
+        """
+        try:
+            with _enforce(self, 'variant', self.variant_time,
+                          self.variant_memory):
+                yield
+        except LimitExceeded as err:
+            tpl._log(0, 'ERROR: variant {} {} is not written: {}', pidx,
+                     dict(Plst), err, event='limit')
+            raise
+
+    def snippet(self):
+        """
+        Context manager applying the snippet limits to evaluation or
+        execution of a snippet.
+        """
+        return _enforce(self, 'snippet', self.snippet_time,
+                        self.snippet_memory)
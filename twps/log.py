@@ -0,0 +1,185 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Logging of template processing.
+
+Messages have levels:
+
+    0 -- errors
+    1 -- errors and warnings
+    2 -- errors, warnings and info
+    3 -- errors, warnings, info and debug.
+
+A message is printed only if its level is not above the log level. The message
+text is formatted only when the message is actually printed, therefore
+arguments of disabled messages cost nothing.
+
+Optionally, messages are also written to a sink, for example to
+:class:`JSONSink`, which writes one JSON object per message.
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import time
+from contextvars import ContextVar
+
+# Default log level, used when it is not specified for a template and there is
+# no template being processed, which log level could be inherited.
+default_level = 1
+
+# Logs of templates being processed, the innermost is the last one. The
+# tuple is context-local, thus templates rendered concurrently in threads do
+# not inherit from each other.
+_active = ContextVar('twps_log_active', default=())
+
+
+class JSONSink(object):
+    """
+    Writes log messages as JSON lines to the file ``fname``.
+
+    Each line is a JSON object with the keys ``time``, ``pid``, ``level``,
+    ``template``, ``event``, ``line``, ``snippet`` and ``message``. The
+    ``snippet`` key is the index of the snippet segment in the template.
+
+    ``level`` -- messages with level above this are not written. When not
+    given, the sink writes the same messages as printed by the log.
+    """
+    def __init__(self, fname, level=None):
+        self.fname = fname
+        self.level = level
+        # Line buffering and append mode allow several processes to write
+        # into one file.
+        self.file = open(fname, 'a', buffering=1)
+
+    def write(self, record):
+        import json
+        self.file.write(json.dumps(record, default=repr) + '\n')
+
+    def close(self):
+        self.file.close()
+
+    def __getstate__(self):
+        # The file is reopened in the unpickling process.
+        return (self.fname, self.level)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+class Log(object):
+    """
+    Log of the template ``tname``.
+
+    ``level`` -- the log level. The bigger this value, the more information is
+    printed out. When not given, it is taken from the log of the template
+    being processed, or the module default :data:`default_level` is used.
+
+    ``sink`` -- optional object with method ``write(record)``, that receives
+    all enabled messages as dictionaries, see :class:`JSONSink`. When not
+    given, it is taken from the log of the template being processed.
+    """
+    def __init__(self, tname, level=None, sink=None):
+        active = _active.get()
+        parent = active[-1] if active else None
+        if level is None:
+            level = parent.level if parent else default_level
+        if sink is None and parent:
+            sink = parent.sink
+        self.tname = tname  # Current template filename
+        self.level = level  # Log level
+        self.sink = sink
+        # Index and line number of the segment being processed.
+        self.sid = None
+        self.line = None
+
+    def enabled(self, mlev):
+        """
+        Check if messages of level ``mlev`` are printed or written to the
+        sink.
+        """
+        if mlev <= self.level:
+            return True
+        sink = self.sink
+        return (sink is not None and sink.level is not None and
+                mlev <= sink.level)
+
+    def __call__(self, *args, **kwargs):
+        self.log(*args, **kwargs)
+
+    def log(self, mlev, msg, *args, **kwargs):
+        """
+        Print message ``msg`` of the level ``mlev``. The message is actualy
+        printed only if the message level is below the log level.
+
+        Positional arguments ``args``, if given, are used to format ``msg``
+        with ``str.format``.
+
+        Optional keyword arguments:
+
+        ``line`` and ``snippet`` -- when given, they are printed out too, to
+        identify the snipped, to which the message corresponds. The sink
+        receives line number and index of the segment being processed,
+        even if ``line`` is not given.
+
+        ``event`` -- type of the event, written to the sink. Default is
+        ``'message'``.
+        """
+        sink = self.sink
+        printed = mlev <= self.level
+        if sink is not None:
+            slev = self.level if sink.level is None else sink.level
+            written = mlev <= slev
+        else:
+            written = False
+        if not (printed or written):
+            return
+
+        line = kwargs.get('line')
+        snippet = kwargs.get('snippet')
+        if args:
+            msg = msg.format(*args)
+        if printed:
+            sign = 'Message {} from {}'.format(mlev, self.tname)
+            if line:
+                sign += '\n    line {}'.format(line)
+            if snippet:
+                sign += '\n    snippet {}'.format(snippet)
+            # One write, so that messages of parallel processes do not
+            # interleave within a line.
+            sys.stdout.write('{} {}\n'.format(sign, msg))
+            sys.stdout.flush()
+        if written:
+            sink.write({'time': time.time(),
+                        'pid': os.getpid(),
+                        'level': mlev,
+                        'template': self.tname,
+                        'event': kwargs.get('event', 'message'),
+                        'line': line or self.line,
+                        'snippet': self.sid,
+                        'message': str(msg)})
+
+    def __enter__(self):
+        # The log is active while the template is processed. Templates
+        # processed meanwhile inherit its level and sink.
+        _active.set(_active.get() + (self,))
+        return self
+
+    def __exit__(self, *exc):
+        _active.set(_active.get()[:-1])
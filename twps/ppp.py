@@ -28,9 +28,11 @@ Script provides command line interface to the TWPS python package.
 
 from __future__ import print_function
 
+import sys
 from sys import argv
 from os import path
 import twps  # from twps import pre_pro, params
+from twps.log import JSONSink
 
 
 def main():
@@ -45,12 +47,120 @@ def main():
         # considered as the 1-st snippet to evaluate.
         # --'a 1 2 3 4' --'b 6 7 8' -'c = 5'
 
+        # Options with values, given as separate arguments:
+        # -j N -- number of processes to render parametric study variants.
+        # --log N -- log level.
+        # --log-json FILE -- write log messages as JSON lines to FILE.
+        # --batch N -- process templates concurrently in N processes.
+        # --dedup link|report -- link or report identical resulting files.
+        # --compress gz|bz2|xz -- write compressed resulting files.
+        # --archive tar|zip -- write all variants into one archive.
+        # --shard i/N -- render only the i-th (from 0) of N parts of the study.
+        # --serve-socket FILE -- serve render requests from Unix socket FILE.
+        # --preload M1,M2 -- import modules into the namespace of snippets.
+        # --include-cache MB -- reuse texts of included templates, see
+        #                       twps.include.
+        # --snippet-time S, --variant-time S -- wall-clock time limits.
+        # --snippet-memory MB, --variant-memory MB -- memory limits.
+        # --on-limit skip|abort -- continue or stop the study when a variant
+        #                          exceeds the limits, see twps.limits.
+        # --format W.PS[/N] -- write numpy arrays, lists and tuples of
+        #                      floats with %W.PS, N per line, see
+        #                      twps.formats.
+        # Flags:
+        # --mmap -- map template into memory and process it as bytes.
+        # --stream -- process template while reading it, see pre_pro().
+        # --incremental -- do not rewrite resulting files that are up to date.
+        # --watch -- process templates again when they change.
+        # --resume -- skip variants recorded as complete in the journal.
+        # --fork -- process setup snippets once, fork a process per variant.
+        # --serve -- serve render requests from stdin, see twps.server.
+        # --profile -- report time, memory and output of snippets, write
+        #              trace of snippets and includes, see twps.profiler.
+
         # Names and values of the parameter variables
         clp = []
         preamb = ''
         templates = []
-        for a in argv[1:]:
-            if len(a) > 2 and a[:2] == '--':
+        workers = None
+        loglevel = None
+        logsink = None
+        stream = False
+        mapped = False
+        incremental = False
+        watch = False
+        fork = False
+        resume = False
+        batch = None
+        dedup = None
+        compress = None
+        archive = None
+        shard = None
+        serve = False
+        profile = False
+        formatters = None
+        address = None
+        modules = []
+        limits = {}
+        on_limit = 'skip'
+        args = argv[1:]
+        while args:
+            a = args.pop(0)
+            if a == '-j' and args:
+                workers = int(args.pop(0))
+            elif a == '--log' and args:
+                loglevel = int(args.pop(0))
+            elif a == '--log-json' and args:
+                logsink = JSONSink(args.pop(0))
+            elif a == '--mmap':
+                mapped = True
+            elif a == '--stream':
+                stream = True
+            elif a == '--incremental':
+                incremental = True
+            elif a == '--watch':
+                watch = True
+            elif a == '--batch' and args:
+                batch = int(args.pop(0))
+            elif a == '--dedup' and args and args[0] in ('link', 'report'):
+                dedup = args.pop(0)
+            elif a == '--compress' and args and args[0] in ('gz', 'bz2', 'xz'):
+                compress = args.pop(0)
+            elif a == '--archive' and args and args[0] in ('tar', 'zip'):
+                archive = args.pop(0)
+            elif a == '--shard' and args:
+                shard = tuple(map(int, args.pop(0).split('/')))
+            elif a == '--preload' and args:
+                modules.extend(m for m in args.pop(0).split(',') if m)
+            elif a == '--include-cache' and args:
+                from twps import text_with_snippets
+                from twps.include import IncludeCache
+                text_with_snippets.include_cache = IncludeCache(
+                    int(float(args.pop(0)) * 2**20))
+            elif a in ('--snippet-time', '--snippet-memory', '--variant-time',
+                       '--variant-memory') and args:
+                limits[a[2:].replace('-', '_')] = float(args.pop(0))
+            elif a == '--on-limit' and args and args[0] in ('skip', 'abort'):
+                on_limit = args.pop(0)
+            elif a == '--resume':
+                resume = True
+            elif a == '--fork':
+                fork = True
+            elif a == '--format' and args:
+                from twps.formats import Numbers, numeric
+                try:
+                    formatters = numeric(Numbers.parse(args.pop(0)))
+                except ValueError as err:
+                    print('Usage error: --format:', err, file=sys.stderr)
+                    sys.exit(2)
+            elif a == '--profile':
+                profile = True
+            elif a == '--serve':
+                serve = True
+            elif a == '--serve-socket' and args:
+                serve = True
+                address = args.pop(0)
+            elif len(a) > 2 and a[:2] == '--':
                 nvi = twps.params(a[2:])
                 clp.append(nvi)
             elif len(a) > 1 and a[:1] == '-':
@@ -61,12 +171,45 @@ def main():
             else:
                 print('Skipping argument (neither existing file nor recognized option)', repr(a))
 
+        if modules and not batch:
+            # Imported once, before any template is processed.
+            twps.preload(modules)
+        if serve:
+            from twps.server import main as serve_main
+            serve_main(address)
+            return
         if clp:
             print('Parameters:', clp)
         if preamb:
             print('Command-line snippet:', preamb)
-        for t in templates:
-            twps.pre_pro(fname=t, level='main', preamb=preamb, clp=clp)
+        kwargs = dict(preamb=preamb, clp=clp, workers=workers,
+                      loglevel=loglevel, logsink=logsink, stream=stream,
+                      incremental=incremental, fork=fork, shard=shard,
+                      resume=resume, dedup=dedup, compress=compress,
+                      archive=archive, mapped=mapped, profile=profile,
+                      formatters=formatters)
+        if limits:
+            from twps.limits import Limits
+            kwargs['limits'] = Limits(on_limit=on_limit, **limits)
+        if watch:
+            from twps.watch import watch
+            watch(templates, **kwargs)
+        elif batch:
+            from twps.batch import render_batch
+            if render_batch(templates, batch, modules, **kwargs):
+                sys.exit(1)
+        else:
+            try:
+                for t in templates:
+                    twps.pre_pro(fname=t, level='main', **kwargs)
+            except BaseException as err:
+                # Imported here, since the limits are rarely used.
+                from twps.limits import LimitExceeded
+                if not isinstance(err, LimitExceeded):
+                    raise
+                # Already reported to the template log.
+                print('Aborted:', err)
+                sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,314 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Profiling of snippets and of the tree of included templates.
+
+With ``ppp.py --profile`` or ``pre_pro(..., profile=True)``, a
+:class:`Profiler` records for each snippet, identified by its template, line
+and mode (``eval`` or ``exec``):
+
+    * the number of calls,
+
+    * cumulative wall-clock and CPU time, including templates included by
+      the snippet,
+
+    * bytes allocated by the snippet and not freed when it ends, as traced by
+      :mod:`tracemalloc`,
+
+    * size of the captured output of the snippet.
+
+It also records the tree of templates included by snippets with
+``pre_pro``. When rendering is finished, the report sorted by wall-clock
+time is written to the template log, and the trace of all snippets and
+included templates is written to ``template.t.trace.json`` in the Chrome
+trace event format, that can be loaded into chrome://tracing, Perfetto or
+speedscope.
+
+Tracing of memory allocations slows rendering down. Variants rendered in
+other processes (``-j``, ``--fork``) are not profiled.
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Profiler and the include tree node of the template being rendered in the
+# current context: tuple (profiler, node) or None.
+_active = ContextVar('twps_profile', default=None)
+
+
+def active_profiler():
+    """
+    Return :class:`Profiler` active in the current context, or None.
+    """
+    active = _active.get()
+    return active and active[0]
+
+
+class SnippetStats(object):
+    """
+    Statistics of a snippet: ``calls``, ``wall`` and ``cpu`` time in seconds,
+    allocated bytes ``alloc`` and captured ``output`` characters. ``line``,
+    ``mode`` and ``source`` identify the snippet.
+    """
+    __slots__ = ('calls', 'wall', 'cpu', 'alloc', 'output', 'line', 'mode',
+                 'source')
+
+    def __init__(self, line, mode, source):
+        self.line = line
+        self.mode = mode
+        self.source = source
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.alloc = 0
+        self.output = 0
+
+
+class Node(object):
+    """
+    Node of the include tree: template ``fname`` included by the snippet at
+    ``line`` of the parent template. ``calls`` and ``wall`` are the number
+    of renderings and their cumulative wall-clock time.
+    """
+    __slots__ = ('fname', 'line', 'calls', 'wall', 'children')
+
+    def __init__(self, fname, line=None):
+        self.fname = fname
+        self.line = line
+        self.calls = 0
+        self.wall = 0.0
+        self.children = {}
+
+    def child(self, fname, line):
+        key = (line, fname)
+        node = self.children.get(key)
+        if node is None:
+            node = self.children[key] = Node(fname, line)
+        return node
+
+
+class Profiler(object):
+    """
+    Profile of snippets and included templates, see :mod:`twps.profiler`.
+
+    ``memory`` -- if True, allocations are traced.
+
+    ``stats`` -- dictionary {(fname, segment index): :class:`SnippetStats`}.
+
+    ``tree`` -- root :class:`Node` of the include tree, its children are the
+    top-level templates.
+
+    ``events`` -- list of Chrome trace events.
+    """
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.stats = {}
+        self.tree = Node(None)
+        self.events = []
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        # tracemalloc.get_traced_memory, if allocations are traced.
+        self._traced = None
+        self._started = False
+
+    def activate(self):
+        """
+        Make the profiler active in the current context. Returns token for
+        :meth:`deactivate`.
+        """
+        if self.memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started = True
+            self._traced = tracemalloc.get_traced_memory
+        return _active.set((self, self.tree))
+
+    def deactivate(self, token):
+        """
+        Make the profiler inactive, see :meth:`activate`.
+        """
+        _active.reset(token)
+        if self._started:
+            import tracemalloc
+            tracemalloc.stop()
+            self._started = False
+        self._traced = None
+
+    def _us(self, t):
+        return _us(t - self._t0)
+
+    def enter(self, tpl):
+        """
+        Start rendering of the template ``tpl``. Returns state for
+        :meth:`exit`.
+        """
+        parent = _active.get()[1]
+        line = None
+        if parent.fname is not None:
+            # Line of the including snippet, see start().
+            line = _line.get()
+        with self._lock:
+            node = parent.child(tpl.fname, line)
+        token = _active.set((self, node))
+        return node, token, time.perf_counter()
+
+    def exit(self, state):
+        """
+        End rendering of the template, see :meth:`enter`.
+        """
+        node, token, t0 = state
+        t1 = time.perf_counter()
+        _active.reset(token)
+        with self._lock:
+            node.calls += 1
+            node.wall += t1 - t0
+            self.events.append({
+                'name': os.path.basename(node.fname), 'cat': 'template',
+                'ph': 'X', 'ts': self._us(t0), 'dur': _us(t1 - t0),
+                'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'args': {'template': node.fname, 'line': node.line}})
+
+    def start(self, seg):
+        """
+        Start evaluation or execution of the snippet segment ``seg``.
+        Returns state for :meth:`stop`.
+        """
+        traced = self._traced
+        alloc = traced()[0] if traced else 0
+        token = _line.set(seg.line)
+        return token, time.perf_counter(), time.thread_time(), alloc
+
+    def stop(self, tpl, sid, seg, state, content):
+        """
+        End evaluation or execution of the snippet segment ``seg`` with index
+        ``sid`` of the template ``tpl``, with the captured output
+        ``content``.
+        """
+        t1 = time.perf_counter()
+        c1 = time.thread_time()
+        token, t0, c0, a0 = state
+        traced = self._traced
+        alloc = traced()[0] - a0 if traced else 0
+        _line.reset(token)
+        output = sum(len(s) for s in content)
+        key = (tpl.fname, sid)
+        with self._lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = SnippetStats(seg.line, seg.mode,
+                                                       seg.source)
+            stats.calls += 1
+            stats.wall += t1 - t0
+            stats.cpu += c1 - c0
+            stats.alloc += alloc
+            stats.output += output
+            self.events.append({
+                'name': '{}:{}'.format(os.path.basename(tpl.fname),
+                                       seg.line),
+                'cat': seg.mode, 'ph': 'X', 'ts': self._us(t0),
+                'dur': _us(t1 - t0), 'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'args': {'template': tpl.fname, 'line': seg.line,
+                         'cpu': c1 - c0, 'alloc': alloc, 'output': output,
+                         'snippet': _short(seg.source)}})
+
+    def report(self, limit=None):
+        """
+        Return the text report: snippet statistics sorted by wall-clock time
+        (at most ``limit`` snippets) and the include tree.
+        """
+        lines = ['{:>7s} {:>10s} {:>10s} {:>10s} {:>10s}  {:4s}  {}'.format(
+            'calls', 'wall, s', 'cpu, s', 'alloc, kB', 'output, kB', 'mode',
+            'snippet')]
+        items = sorted(self.stats.items(), key=lambda i: -i[1].wall)
+        for (fname, sid), s in items[:limit]:
+            lines.append(
+                '{:7d} {:10.4f} {:10.4f} {:10.1f} {:10.1f}  {:4s}  '
+                '{}:{} {}'.format(s.calls, s.wall, s.cpu, s.alloc / 1024.0,
+                                  s.output / 1024.0, s.mode, fname, s.line,
+                                  _short(s.source)))
+        lines.append('')
+        lines.append('Include tree (calls, wall time):')
+        for node in self.tree.children.values():
+            _tree_lines(node, 0, lines)
+        return '\n'.join(lines)
+
+    def trace(self):
+        """
+        Return the trace in the Chrome trace event format.
+        """
+        return {'traceEvents': sorted(self.events, key=lambda e: e['ts']),
+                'displayTimeUnit': 'ms'}
+
+    def write_trace(self, fname):
+        """
+        Write the trace to the file ``fname``.
+        """
+        import json
+        with open(fname, 'w') as f:
+            json.dump(self.trace(), f)
+
+
+# Line of the snippet being processed in the current context, the parent of
+# templates included by it.
+_line = ContextVar('twps_profile_line', default=None)
+
+
+@contextmanager
+def profiling(profile, tpl):
+    """
+    Context manager activating ``profile``, a :class:`Profiler`, while the
+    template ``tpl`` is rendered. If ``profile`` is True, a new profiler is
+    used, and when rendering is finished, even if it failed, its report is
+    written to the template log, and the trace to ``tpl.fname +
+    '.trace.json'``.
+    """
+    profiler = profile if isinstance(profile, Profiler) else Profiler()
+    token = profiler.activate()
+    try:
+        yield profiler
+    finally:
+        profiler.deactivate(token)
+        if profiler is not profile:
+            tname = tpl.fname + '.trace.json'
+            profiler.write_trace(tname)
+            tpl._log(0, 'Profile, trace is written to {}:\n{}', tname,
+                     profiler.report(), event='profile')
+
+
+def _us(t):
+    # Trace event times are in microseconds.
+    return round(t * 1e6, 3)
+
+
+def _short(source, width=40):
+    s = ' '.join((source or '').split())
+    return repr(s if len(s) <= width else s[:width - 3] + '...')
+
+
+def _tree_lines(node, depth, lines):
+    where = '' if node.line is None else ' (line {})'.format(node.line)
+    lines.append('{}{}{} {} {:.4f} s'.format('  ' * depth, node.fname, where,
+                                              node.calls, node.wall))
+    for child in sorted(node.children.values(), key=lambda n: -n.wall):
+        _tree_lines(child, depth + 1, lines)
@@ -0,0 +1,212 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Long-lived render server.
+
+The server reads render requests as JSON lines from stdin, or from
+connections to a Unix socket, and writes one JSON line reply per request.
+Since the server process stays alive, python startup, import of twps and
+imports made by snippets are paid only once.
+
+Request keys:
+
+    ``template`` -- path to the template, required.
+
+    ``preamb`` -- command line snippet, optional.
+
+    ``params`` -- list of parameter specifications as given to ``ppp.py``
+    after ``--``, e.g. ``["a 1 2 3", "b-1 x y"]``, optional.
+
+    ``content`` -- if true, the resulting text is returned in the reply
+    instead of being written to the resulting files.
+
+    ``incremental`` -- if true, resulting files that are up to date are not
+    written again, see :mod:`twps.deps`.
+
+    ``loglevel`` -- log level, optional.
+
+    ``cwd`` -- directory to process the template in, optional.
+
+    ``id`` -- arbitrary value, returned in the reply.
+
+Reply keys:
+
+    ``id`` -- from the request.
+
+    ``ok`` -- true if the request was processed.
+
+    ``outputs`` -- list of names of the written resulting files (null for
+    files that are up to date), or, when
+    ``content`` was requested, list of objects with keys ``index``,
+    ``params`` and ``content``.
+
+    ``log`` -- log messages printed while the request was processed.
+
+    ``error`` -- error description, if ``ok`` is false.
+
+Each request is processed in a new copy of the global namespace of snippets,
+therefore definitions made by one request are not visible in the others.
+Imported modules (also those preloaded with ``ppp.py --preload``) and parsed
+templates are reused.
+
+A request with ``cwd`` changes the working directory of the process and
+prepends it to ``sys.path`` while it is processed. Therefore, requests are
+processed one at a time in a process: :func:`render` waits for the request
+being processed by another thread. Connections to the socket are served in
+separate processes.
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import json
+import threading
+import traceback
+import socketserver
+
+from . import text_with_snippets as tws
+from .utils import params, variants
+
+
+# Requests change the working directory and sys.path of the process, see
+# render().
+_lock = threading.Lock()
+
+
+def render(request):
+    """
+    Process render request ``request`` (a dictionary) and return the reply
+    dictionary. Requests are processed one at a time.
+    """
+    with _lock:
+        return _render(request)
+
+
+def _render(request):
+    reply = {'id': request.get('id')}
+    # Definitions made by the request do not get into the global namespace.
+    gld = tws.RenderContext(dict(tws.gld)).namespace
+    cwd = os.getcwd()
+    syspath = list(sys.path)
+    with tws.capture() as log:
+        try:
+            if request.get('cwd'):
+                os.chdir(request['cwd'])
+                if request['cwd'] not in sys.path:
+                    sys.path.insert(0, request['cwd'])
+            tpl = tws.load_template(request['template'],
+                                    request.get('preamb', ''),
+                                    request.get('loglevel'))
+            clp = [params(p) for p in request.get('params', [])]
+            outputs = []
+            for pidx, Plst in variants(clp):
+                gld.update(dict(Plst))
+                if request.get('content'):
+                    outputs.append({'index': pidx,
+                                    'params': dict(Plst),
+                                    'content': ''.join(tpl._generate(gld))})
+                else:
+                    outputs.append(tws.render_variant(
+                        tpl, pidx, Plst, gld,
+                        request.get('incremental', False)))
+            reply['ok'] = True
+            reply['outputs'] = outputs
+        except (Exception, SystemExit):
+            reply['ok'] = False
+            reply['error'] = traceback.format_exc()
+        finally:
+            os.chdir(cwd)
+            sys.path[:] = syspath
+    reply['log'] = ''.join(log)
+    return reply
+
+
+def _handle(line):
+    """
+    Process request given as JSON string ``line``, return the reply as JSON
+    string.
+    """
+    try:
+        request = json.loads(line)
+    except ValueError as err:
+        reply = {'ok': False, 'error': 'Invalid request: {}'.format(err)}
+    else:
+        reply = render(request)
+    return json.dumps(reply, default=repr) + '\n'
+
+
+def serve_stdin(inp=None, out=None):
+    """
+    Read requests from ``inp`` (default: stdin) and write replies to ``out``
+    (default: stdout), until end of input.
+    """
+    inp = inp or sys.stdin
+    out = out or sys.stdout
+    for line in inp:
+        if line.strip():
+            out.write(_handle(line))
+            out.flush()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            line = line.decode('utf-8')
+            if line.strip():
+                self.wfile.write(_handle(line).encode('utf-8'))
+                self.wfile.flush()
+
+
+class _Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    # Each connection is served in a forked process, that inherits imported
+    # modules and parsed templates of the server.
+    pass
+
+
+def serve_socket(address):
+    """
+    Serve requests from connections to the Unix socket ``address``, until
+    interrupted. Each connection is served in a separate process.
+    """
+    if os.path.exists(address):
+        os.remove(address)
+    server = _Server(address, _Handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(address)
+
+
+def main(address=None):
+    """
+    Serve requests from the Unix socket ``address`` or, if not given, from
+    stdin.
+    """
+    tws.template_cache = {}
+    if address:
+        serve_socket(address)
+    else:
+        serve_stdin()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
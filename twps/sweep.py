@@ -0,0 +1,250 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Parallel rendering of parametric studies.
+
+Variants of a parametric study are distributed over a pool of processes. Each
+process receives the parsed template once and renders every variant in a
+fresh copy of the global namespace, as it was when the pool was started.
+
+Alternatively, the setup part of the template is processed once and each
+variant is rendered in a child process forked after it, see
+:func:`render_forked`.
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import traceback
+import multiprocessing
+from copy import copy
+from concurrent.futures import ProcessPoolExecutor
+
+from . import text_with_snippets as tws
+from .limits import LimitExceeded
+from .utils import variants
+
+# Exit status of a forked child, which variant exceeded its limits.
+LIMIT_STATUS = 3
+
+# Template and the baseline namespace of the worker process.
+_worker = {}
+
+
+def _init_worker(tpl, incremental, journal, limits=None):
+    """
+    Initialize worker process with the template ``tpl``.
+    """
+    tws.gld['pre_pro'] = tws.pre_pro
+    _worker['template'] = tpl
+    _worker['incremental'] = incremental
+    _worker['journal'] = journal
+    _worker['limits'] = limits
+    _worker['baseline'] = dict(tws.gld)
+
+
+def _render_variant(pidx, Plst):
+    """
+    Render variant with parameter indices ``pidx`` and parameter values
+    ``Plst`` and write it to the resulting file. Returns the file name, or
+    None if the resulting file is up to date.
+    """
+    tpl = _worker['template']
+    gld = tws.gld
+    gld.clear()
+    gld.update(_worker['baseline'])
+    gld.update(dict(Plst))
+    tpl._log(3, 'Eval/exec scope: {}', gld, event='variant')
+    return tws.render_variant(tpl, pidx, Plst, gld, _worker['incremental'],
+                              _worker['journal'], _worker['limits'])
+
+
+def _render_text(Plst):
+    """
+    Render variant with parameter values ``Plst`` and return the resulting
+    text.
+    """
+    gld = tws.gld
+    gld.clear()
+    gld.update(_worker['baseline'])
+    gld.update(dict(Plst))
+    return ''.join(_worker['template']._generate(gld))
+
+
+def _context():
+    """
+    Multiprocessing context for the pool. Fork is preferred, since the forked
+    workers inherit modules imported and names defined before the pool start.
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def render_parallel(tpl, clp, workers, incremental=False, shard=None,
+                    journal=None, limits=None):
+    """
+    Render all variants of parameters ``clp`` of the template ``tpl`` in
+    ``workers`` processes and write them to resulting files. With
+    ``incremental``, only variants, which resulting files are not up to date,
+    are rendered. With ``shard``, only variants of the shard are rendered,
+    see :func:`twps.utils.variants`. Variants are recorded to the optional
+    ``journal`` and rendered within the optional ``limits``, see
+    :func:`twps.text_with_snippets.render_variant`.
+
+    Failed variants are reported to the template log. Returns the list of
+    parameter index tuples of failed variants. If a variant exceeds the
+    limits and they say to abort, variants not started yet are cancelled and
+    :exc:`twps.limits.LimitExceeded` is raised.
+    """
+    _log = tpl._log
+    failed = []
+    with ProcessPoolExecutor(workers, mp_context=_context(),
+                             initializer=_init_worker,
+                             initargs=(tpl, incremental, journal,
+                                       limits)) as pool:
+        futures = []
+        for pidx, Plst in variants(clp, shard):
+            _log(3, 'Current parameters: {!r}{!r}', pidx, Plst,
+                 event='variant')
+            futures.append((pidx, Plst, pool.submit(_render_variant,
+                                                    pidx, Plst)))
+        for pidx, Plst, f in futures:
+            try:
+                f.result()
+            except LimitExceeded:
+                # Reported by the worker.
+                failed.append(pidx)
+                if limits.on_limit == 'abort':
+                    pool.shutdown(cancel_futures=True)
+                    raise
+            except (Exception, SystemExit) as err:
+                failed.append(pidx)
+                _log(0, 'ERROR: variant {} {} failed: {!r}', pidx,
+                     dict(Plst), err, event='error')
+    if failed:
+        _log(0, '{} of {} variants failed', len(failed), len(futures),
+             event='error')
+    return failed
+
+
+def render_texts(tpl, clp, workers, shard=None):
+    """
+    Render variants of parameters ``clp`` (or of their ``shard``) of the
+    template ``tpl`` in ``workers`` processes. Yields tuples (pidx, Plst,
+    text) in the order of variants.
+    """
+    with ProcessPoolExecutor(workers, mp_context=_context(),
+                             initializer=_init_worker,
+                             initargs=(tpl, False, None)) as pool:
+        futures = [(pidx, Plst, pool.submit(_render_text, Plst))
+                   for pidx, Plst in variants(clp, shard)]
+        for pidx, Plst, f in futures:
+            yield pidx, Plst, f.result()
+
+
+def render_forked(tpl, clp, workers=1, incremental=False, shard=None,
+                  journal=None, scope=None, limits=None):
+    """
+    Render all variants of parameters ``clp`` of the template ``tpl`` and
+    write them to resulting files.
+
+    The leading segments of the template, which do not depend on the
+    parameters, are processed once in the current process, see
+    :meth:`twps.text_with_snippets.Template.setup`. Then, for each variant a
+    child process is forked, which renders the rest of the template. Objects
+    created by the setup snippets are shared with the children copy-on-write,
+    and each variant starts from the same state of the namespace. At most
+    ``workers`` children run at once. ``incremental``, ``shard``,
+    ``journal`` and ``limits`` are used as in :func:`render_parallel`.
+    ``scope`` is the namespace of snippets, by default the global one.
+
+    Returns the list of parameter index tuples of failed variants.
+    """
+    _log = tpl._log
+    gld = tws.gld if scope is None else scope
+    gld['pre_pro'] = tws.pre_pro
+    # The setup output is state of this rendering only, the template can be
+    # shared by template_cache.
+    tpl = copy(tpl)
+    n = tpl.setup(gld, [p[0] for p in clp])
+    _log(2, 'Setup segments processed once: {} of {}', n, len(tpl.segments),
+         event='setup')
+    running = {}
+    failed = []
+    limited = []
+    total = 0
+    for pidx, Plst in variants(clp, shard):
+        if limited and limits.on_limit == 'abort':
+            break
+        total += 1
+        while len(running) >= workers:
+            _wait(running, failed, _log, limited)
+        _log(3, 'Current parameters: {!r}{!r}', pidx, Plst, event='variant')
+        # Buffered output would be written by both processes otherwise.
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                gld.update(dict(Plst))
+                tws.render_variant(tpl, pidx, Plst, gld, incremental,
+                                   journal, limits)
+                status = 0
+            except LimitExceeded:
+                # Reported by render_variant().
+                status = LIMIT_STATUS
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+        running[pid] = (pidx, Plst)
+    while running:
+        _wait(running, failed, _log, limited)
+    if failed:
+        _log(0, '{} of {} variants failed', len(failed), total,
+             event='error')
+    if limited and limits.on_limit == 'abort':
+        raise LimitExceeded('variant {} exceeded its limits, the study is '
+                            'aborted'.format(limited[0]))
+    return failed
+
+
+def _wait(running, failed, _log, limited):
+    """
+    Wait for a child process from ``running`` to exit, and report if it
+    failed. Variants, which exceeded their limits, are appended to
+    ``limited`` too.
+    """
+    pid, status = os.wait()
+    if pid not in running:
+        # Not a variant, e.g. a process started by a setup snippet.
+        return
+    pidx, Plst = running.pop(pid)
+    if os.waitstatus_to_exitcode(status) == LIMIT_STATUS:
+        # Reported by the child.
+        failed.append(pidx)
+        limited.append(pidx)
+    elif status != 0:
+        failed.append(pidx)
+        _log(0, 'ERROR: variant {} {} failed, exit status {}', pidx,
+             dict(Plst), os.waitstatus_to_exitcode(status), event='error')
@@ -1,552 +1,1965 @@
-#!/bin/env python
-# Copyright 2012 Karlsruhe Institute of Technology (KIT)
-#
-# This file is part of TWPS.
-#
-# TWPS is free software: you can redistribute it and/or modify
-# it under the terms of the GNU General Public License as published by
-# the Free Software Foundation, either version 3 of the License, or
-# (at your option) any later version.
-#
-# TWPS is distributed in the hope that it will be useful,
-# but WITHOUT ANY WARRANTY; without even the implied warranty of
-# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
-# GNU General Public License for more details.
-#
-# You should have received a copy of the GNU General Public License
-# along with this program.  If not, see <http://www.gnu.org/licenses/>.
-
-
-"""
-The module defines function :func:`pre_pro`, which evaluates or executes python
-snippets inside a text file, and replace snippet code with the
-evaluation/execution result.
-
-See detailed description in 'doc' directory of the source distribution.
-
-.. todo::
-
-
-    * Indentation:
-
-     Optional parameter to prepro to indent all resulting text. (Thus,
-     indentation will be defined in the parent template, not in the child
-     template)
-
-
-    * Sequence of values for parametric studies
-
-     Command line parameter specifying a seequence of input parameters.
-     Generates several resulting files. Possible command line syntax:
-
-        --ParameterName "python expression for sequence"
-
-     i.e one can specify arbitrary variable name. If several ranges are given,
-     the number of resulting files is N1 x N2 x ... Nm, where Ni -- number of
-     values for i-th variable.
-
-        --a "range(10)" --b "np.arange(0.01, 0.05, 10)"
-
-"""
-
-# Author: Anton Travleev, anton.travleev@gmail.com
-# Developed at INR, Karlsruhe Institute of Technology
-
-from __future__ import print_function
-
-import re
-from textwrap import dedent
-import sys
-import os
-import traceback
-from os import path, chmod, getcwd, utime
-from stat import S_IREAD, S_IWRITE
-
-from .utils import variants
-
-# Log level:
-#       0 -- errors
-#       1 -- errors and warnings
-#       2 -- errors, warnings and info
-#       3 -- errors, warnings, info and debug.
-_logLevel = 1  # 0 -- output at least.
-
-
-class _Log(object):
-    """
-    To print out log information. Implemented as a class to contain
-    snippet-specific information as instance properties.
-    """
-    def __init__(self, tname, level):
-        """
-        ``tname`` -- The current template filename
-        ``level`` -- The log level. The bigger this value, the more
-        information is printed out.
-        """
-        self.tname = tname  # Current template filename
-        self.level = level  # Log level
-        return
-
-    def __call__(self, *args, **kwargs):
-        self.log(*args, **kwargs)
-
-    def log(self, mlev, msg, line=None, snippet=None):
-        """
-        Print message ``msg`` of the level ``mlev``. The message is actualy
-        printed only if the message level is below the log level.
-
-        When ``line`` and ``snippet`` are given, they are printed out too,
-        to identify the snipped, to which the message corresponds.
-        """
-        sign = 'Message {} from {}'.format(mlev, self.tname)
-        if line:
-            sign += '\n    line {}'.format(line)
-        if snippet:
-            sign += '\n    snippet {}'.format(snippet)
-
-        if mlev <= self.level:
-            print(sign, msg, file=sys.stdout)
-
-
-class _WritableObject:
-    """
-    Auxiliary class with a write method.  See
-    http://stefaanlippens.net/redirect_python_print
-
-    Instance of this class can be used to catch print outputs.  To redirect the
-    print output, set sys.stdout to an instance of this class.
-
-    Do not forget to set it back to sys.__stdout__
-    """
-    def __init__(self):
-        self.content = []
-
-    def write(self, string):
-        self.content.append(string)
-
-
-# ml = logger.MyLogger()
-
-# if a link is used, one has to ensure that python still searches local
-# directory for the modules. The local directory will be searched first.
-sys.path.insert(0, getcwd())
-
-
-# Options that modify positioning of snippet's result.
-_OptionsList = [
-    'r',  # adjust right
-    'l',  # adjust left
-    'c',  # center
-    'd',  # delete snippet code, i.e. put to resulting file only result
-    's',  # skip the snippet evaluation. Just leave its text representation
-    'D',  # default. Do not preserve snippet place.
-    ]
-
-
-def firstline(l1, _log):
-    """
-    Get commenting string, default key and delimiters from the 1-st line
-    ``l1``.
-
-    ``_log`` is a logger, used to print out warnings etc.
-    """
-    # Check the first line with comment and insertion marks.
-    # Default parameters of the first line:
-    TemplateOpt = '-D'
-    Cchar = ''
-    if len(l1) < 2:
-        msg = """
-        ERROR:
-            The first line of template must specify optional comment string,
-            starting  and ending delimiters,  i.e.  be at least 2 characters
-            long."""
-        msg = dedent(msg[1:])
-        _log(0, msg, line=1)
-        raise SystemExit(msg)
-    else:
-        # read the delimiters:
-        Schar, Echar = l1[-2:]
-        l1 = l1[:-2]
-        # Read the default option, if given:
-        if len(l1) >= 2:
-            # 1st line can contain the default option in its first two chars.
-            # Find the 1-st match of the option:
-            r = re.compile('-[{}]'.format(''.join(_OptionsList)))
-            f = r.findall(l1)
-            if f:
-                TemplateOpt = f[0]
-                l1 = l1.replace(TemplateOpt, '')
-        # read the commenting string, if given:
-        if l1:
-            Cchar = l1[:]
-
-    # perform some check of the Schar and Echar:
-    for char in [Schar, Echar]:
-        if char.isalnum() or char == ' ':
-            msg = """
-            WARNING:
-                the delimiter specified on the first line of
-                the template, is alpha-numeric or blank.
-
-                COMMENTING STRING: {0}
-                STARTING DELIMITER: {1}
-                ENDING DELIMITER: {2}""".format(Cchar, Schar, Echar)
-            msg = dedent(msg[1:])
-            _log(1, msg, line=1)
-            break  # one warning is enough
-
-    # issue warning, if commenting char is empty:
-    if Cchar == '':
-        msg = """
-        WARNING:
-            string of commenting characters is empty.
-            Multi-line  snippets remain uncommented."""
-        msg = dedent(msg[1:])
-        _log(1, msg, line=1)
-    return TemplateOpt, Cchar, Schar, Echar
-
-
-def is_snippet(t, sch, ech):
-    """
-    Returns if ``t`` is a snippet. A snippet must start with sch and end
-    with ech.
-    """
-    if t and t[0] == sch and t[-1] == ech:
-        return True
-    else:
-        return False
-
-
-def removeOpt(t, default):
-    """
-    Remove option of the next snippet from the text ``t`` preceeding it.
-    """
-    # Find options for the next snippet, remember them and remove them
-    # from result:
-    if len(t) > 1 and t[-2] == '-' and t[-1] in _OptionsList:
-        SnippetOpt = t[-2:]
-        if SnippetOpt == '-d':
-            # just remove option from result. The following snippet
-            # will be also removed.
-            t = t[:-2]
-        elif SnippetOpt == '-s':
-            pass              # Do not remove snippet option.
-        else:
-            t = t[:-2] + '  '  # instead of option put spaces
-    else:
-        SnippetOpt = default
-    return t, SnippetOpt
-
-
-# Global scope for all pre_pro calls.
-gld = {}
-
-
-def pre_pro(fname, level='default', preamb='', clp=[], **kwargs):
-    """
-    Preprocess template file fname.
-
-    :arg fname:
-
-        String, name of the template file to be processed.
-
-    :arg level:
-
-        level is necessary to distinguish the top-level template from templates
-        called from withing the top or above templates. Only for the top-level
-        template (which has level not equal to 'default') all resulting strings
-        are written to resulting file.
-
-    :arg preamb:
-
-        A string representing the snippet to be evaluated/executed before
-        snippets in the file. This is to allow snippets in the command line.
-
-    :arg clp:
-
-        A list of (name, vals) tuples, defining parameters for parametric
-        studies.
-
-    :arg kwargs:
-
-        All other keyword arguments are valiable names and their set of values.
-        Similar to ``clp``, but the order cannot be guarantied.
-
-    ``fname`` is a text file with python snippets. The function evaluates or
-    executes snippets and replace the snippet code with the evaluation or
-    execution result.
-
-    If ``level`` is equal to ``default``, ther resulting text is returned as a
-    list of strings. Otherwise, the resulting text will be written to file with
-    the name ``fname + '.res'``, and the modification time of the resulting
-    file will set to the modification time of the template.
-
-    Before writing the resulting file, its modification time is compared with
-    the modification time of the template. If the template is older (i.e. the
-    resulting file was changed after it was generated with ``pre_pro``), the
-    resulting file name will be prefixed with current date and time. Thus,
-    changes introduced into resulting file (for example when a user accidentaly
-    edits the resulting file instead of template) will not get lost.
-
-    The template's first line must contain the two characters, used to denote
-    the beginning and the end of snippets. Optionnaly, one can specify also in
-    the first line the commenting string and snippet default key.
-
-    """
-    tfile = open(fname, 'r')  # why rb?
-    _log = _Log(fname, _logLevel)
-    # check template and resulting files modification time with seconds
-    # precision. More precision is not needed.
-    tmtime = int(path.getmtime(tfile.name))
-    tatime = int(path.getatime(tfile.name))
-    s = tfile.read()
-    _log(0, 'Start processing')
-
-    # this is the 1-st line, without trailing spaces.  Do not put this line to
-    # the resulting file. '+1' to avoid empty line at the begining of the
-    # resulting file.
-    l1 = s[:s.index('\n')].rstrip()
-    s = s[s.index('\n')+1:]
-    TemplateOpt, Cchar, Schar, Echar = firstline(l1, _log)
-    _log(3, 'First line: {0}'.format(l1))
-    _log(3, 'Default option: {0}'.format(TemplateOpt))
-    _log(3, 'Commenting str: {0}'.format(Cchar))
-    _log(3, 'Delimiters    : {0} {1}'.format(Schar, Echar))
-
-    # Regular expression to match insertions:
-    t_ins = re.compile('(' + Schar + '.*?' + Echar + ')', re.DOTALL)
-
-    # Add command line snippet as the first snippet to the file:
-    if preamb:
-        s = '-d{}{}{}'.format(Schar, preamb, Echar) + s
-
-    # find all insertions in the file:
-    # this splits the text into parts matching and not matching the pattern.
-    spl = t_ins.split(s)
-
-    #  define line numbers, where all spl elements start:
-    nl_spl = [2]  # list of the line numbers
-    for t in spl:
-        nl_spl.append(nl_spl[-1] + t.count('\n'))
-    nl_spl.pop(-1)
-    _log(3, 'List of line numbers: {}'.format(nl_spl))
-    _log(3, 'Text parts: {}'.format(spl))
-
-    # check for the unpaired delimiters. If they are,
-    # the last element of spl should have one.
-    if Schar in spl[-1] or Echar in spl[-1]:
-        _log(1, 'WARNING: there are unpaired delimiters.')
-
-    # try to evaluate and to execute. Snippets are evaluated or executed in the
-    # global namespace, which is returned by globals() function.  This ensures
-    # that variables defined in one template will be visible in another
-    # template.
-
-    # Global scope for evaluating/execution of snippets.
-    gld['pre_pro'] = pre_pro
-
-    # Add parameter values from kwargs to clp
-    clp = clp + list(kwargs.items())
-    res = []  # resulting strings.
-    _log(3, 'Complete set of parameters: {}'.format(clp))
-    for pidx, Plst in variants(clp):
-        _log(3, 'Current parameters: ' + repr(pidx) + repr(Plst))
-        gld.update(dict(Plst))
-        _log(3, 'Eval/exec scope: {}'.format(gld))
-
-        for n, t in zip(nl_spl, spl):
-            # If the first and last characters of the string in spl are
-            # respectively Schar and Echar, this is a snippet string. Try
-            # to evaluate or execute it.
-            _log(3, 'Starting with', line=n, snippet=t)
-
-            if not is_snippet(t, Schar, Echar):
-                # this is not a snippet.
-
-                # Find options for the next snippet, remember them and
-                # remove them from result:
-                t, SnippetOpt = removeOpt(t, TemplateOpt)
-                # Just copy it to the resulting file.
-                res.append(t)
-                _log(3, 'Not a snippet')
-            else:
-                # if snippet option set to -s, skip the snippet, i.e., do
-                # not evaluate it and put its string to the result
-                if SnippetOpt == '-s':
-                    _log(3, 'Skipping snippet evaluation')
-                    res.append(t)
-                else:
-                    # this is a snippet. Evaluate or execute it.
-                    # Strip delimiters:
-                    snippet = t[1:-1]
-
-                    # prepare stdout capturer:
-                    # To separate outputs from different snippets, their
-                    # stdouts redirected to localy created instances of
-                    # _WritableObject.  To ensure that execution of prepro
-                    # does not change stdout for parent scopes, sys.stdout
-                    # is saved.
-
-                    pCatcher = _WritableObject()
-                    # save current stdout and stderr:
-                    curStdout = sys.stdout
-                    curStderr = sys.stderr
-                    # redirect output to local variables
-                    sys.stdout = pCatcher
-                    sys.stderr = pCatcher
-                    try:
-                        # try to evaluate:
-                        _log(3, 'Startnig snippet evaluation',
-                                line=n, snippet=snippet)
-                        tmp = eval(snippet, gld)
-                        _log(3, 'Result: {}'.format(repr(tmp)))
-                        et = str(tmp)
-                        # if the snippet can be evaluated, substitute it
-                        # with the result of evaluation.  If the result is
-                        # shorter than the snippet string, positioning of
-                        # the result depends on SnippetOpt:
-                        d = len(t) - len(et)
-                        if d > 0:
-                            if SnippetOpt == '-l':
-                                # adjust left:
-                                et = et + ' '*d
-                            elif SnippetOpt == '-r':
-                                # adjust right:
-                                et = ' '*d + et
-                            elif SnippetOpt == '-c':
-                                # center:
-                                dl = d / 2
-                                dr = d - dl
-                                et = ' '*dl + et + ' '*dr
-
-                        # add snippet evaluation result if no -d option is
-                        # given.
-                        if SnippetOpt != '-d':
-                            res.append(et)
-                    except NameError as err:
-                        # The NameError exception raises when e.g.
-                        # expression is an undefined variable.  Issue a
-                        # warning
-                        _log(1,
-                             'WARNING: Snippet caused evaluation error',
-                             line=n)
-                        _log(1, err)
-                        # In this case, put the snippet itself to the
-                        # output file:
-                        res.append(t)
-                    except SyntaxError:
-                        # If there is syntax error in evaluation, I try to
-                        # execute the snippet.  If snippet is a multi-line
-                        # snippet, it must be prepared for execution:
-                        # indentation possibly used in the input file
-                        # should be removed.
-                        snippet = dedent(snippet)
-                        _log(3,
-                             'Executing snippet',
-                             line=n, snippet=repr(snippet))
-
-                        # If snippet is multi-line, comment the snippet
-                        # strings.  Copy snippet to the result (do not copy
-                        # if option -d is specified):
-                        if SnippetOpt != '-d':
-                            res.append(t.replace('\n', '\n'+Cchar))
-                        try:
-                            # try to execute the snippet:
-                            exec(snippet, gld)
-                        except Exception as ee:
-                            exctype, excvalue = sys.exc_info()[:2]
-                            _log(1, 'WARNING: '
-                                    'Snippet caused execution error:',
-                                    line=n, snippet=repr(snippet))
-                            _log(3, ee)
-                    except Exception as ee:
-                        # evaluation can fail for some other reason. Try to
-                        # catch it and report about it
-                        exct, excv, tb = sys.exc_info()
-                        _log(1, 'WARNING: '
-                                'Snippet caused evaluation error:',
-                                line=n, snippet=repr(snippet))
-                        _log(3, ee)
-                        traceback.print_tb(tb)
-                        res.append(t)
-                    # if there were some outputs in snippet, add it to ther
-                    # resulting strings:
-                    res += pCatcher.content
-                    # return old stdout and stderr. Sys module belongs to
-                    # globals, therefore changing it inside a function will
-                    # interfer also parent functions. By setting it back,
-                    # this interference is avoided.
-                    sys.stdout = curStdout
-                    sys.stderr = curStderr
-
-        if level != 'default':
-            # if the level is not default, i.e. corresponds to the main
-            # template, print resulting strings into file.
-            #
-            # Note about the choice of resulting file name: Originally, I
-            # used extension ``.t`` for the template files and added suffix
-            # ``.res`` to the resulting filename, so that for a template
-            # file ``inp.t`` the file ``inp.t.res`` was created. The
-            # problem with this approach is that the template as well as
-            # the resulting file extensions are not relevant for the syntax
-            # highlighting scheme of vim. Another approach, currently
-            # implemented is to preserve the extension of the template file
-            # (which should be chosen to get the most relevantvim syntax
-            # highlighting scheme) and optionally change the basename. For
-            # example, for the result of preprocessing template
-            # ``model.serp`` is ``model.r.serp`` or ``model.rN.serp``,
-            # where ``N`` is the index for parametric studies.
-
-            bname, extname = os.path.splitext(fname)
-            pname = ('_{}'*len(pidx)).format(*pidx)
-            if not pname:
-                pname = 'res'
-            rname = '{}.{}{}'.format(bname, pname, extname)
-            _log(3, 'Output file:' + repr(rname))
-            try:
-                rfile = open(rname, 'w')
-            except IOError as err:
-                if err.errno == 13:
-                    # this is 'permission denied error', meaning that file
-                    # exists and cannot be rewritten.  Check that the
-                    # template and rfile have the same timestamps. If they
-                    # are the same, it will be assumed that the resulting
-                    # file was created from template without any other
-                    # modifications and thus can be safely rewritten again.
-                    rmtime = int(path.getmtime(rname))
-                    if tmtime >= rmtime:
-                        chmod(rname, S_IWRITE)
-                        rfile = open(rname, 'w')
-                    else:
-                        # if timestamps of template and result differ, put
-                        # new result to another file.
-                        _log(0, 'File exists and is newer than template')
-                        from datetime import datetime
-                        ts = datetime.now().strftime('%y-%m-%d-%H-%M-%S')
-                        rfile = open(rname + ts, 'w')
-
-            rfile.write(''.join(res))
-            rfile.close()
-            res = []
-            _log(0, 'Result is written to {0}'.format(rfile.name))
-            # Often, a user starts to change the resulting file instead of
-            # changing the template, and all the changes went when the
-            # template is processed. To warn user if he tries to change the
-            # resulting file, the permission is set to 'read-only'.
-            utime(rfile.name, (tatime, tmtime))
-            chmod(rfile.name, S_IREAD)
-        else:
-            # when a template is included with the direct call to pre_pro,
-            # the last line of the included template ends with the new-line
-            # character. It is not needed.
-            res[-1] = res[-1][:-1]
-    if level == 'default':
-        # Return string for all input vlaues
-        while res[-1] and res[-1][-1] in '\n\r':
-            res[-1] = res[-1][:-1]
-        return ''.join(res)
-
-
-if __name__ == '__main__':
-    from sys import argv
-    pre_pro(fname=argv[1], level='main')
+#!/bin/env python
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+The module defines function :func:`pre_pro`, which evaluates or executes python
+snippets inside a text file, and replace snippet code with the
+evaluation/execution result.
+
+See detailed description in 'doc' directory of the source distribution.
+
+.. todo::
+
+
+    * Indentation:
+
+     Optional parameter to prepro to indent all resulting text. (Thus,
+     indentation will be defined in the parent template, not in the child
+     template)
+
+
+    * Sequence of values for parametric studies
+
+     Command line parameter specifying a seequence of input parameters.
+     Generates several resulting files. Possible command line syntax:
+
+        --ParameterName "python expression for sequence"
+
+     i.e one can specify arbitrary variable name. If several ranges are given,
+     the number of resulting files is N1 x N2 x ... Nm, where Ni -- number of
+     values for i-th variable.
+
+        --a "range(10)" --b "np.arange(0.01, 0.05, 10)"
+
+"""
+
+# Author: Anton Travleev, anton.travleev@gmail.com
+# Developed at INR, Karlsruhe Institute of Technology
+
+from __future__ import print_function
+
+import re
+import sys
+import os
+import time
+import io
+import threading
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from os import path, chmod, getcwd, utime
+from stat import S_IREAD, S_IWRITE
+from copy import copy
+from itertools import islice, count
+from collections.abc import Iterator
+
+from .utils import variants
+from .log import Log
+from .limits import LimitExceeded, active_limits, check_memory_error
+from .profiler import active_profiler
+from . import deps
+from . import formats
+
+# List, which collects output of the snippet being processed in the current
+# context (thread or asyncio task), or None.
+_output = ContextVar('twps_output', default=None)
+
+
+class _Redirect(object):
+    """
+    Replacement of ``sys.stdout`` and ``sys.stderr``. Strings are appended
+    to the list :data:`_output` of the current context, if any, and are
+    written to the original ``stream`` otherwise.
+
+    The redirection is context-local: snippets processed concurrently in
+    several threads capture their outputs separately, and output of other
+    threads goes to the original stream.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, string):
+        content = _output.get()
+        if content is not None:
+            content.append(string)
+            return len(string)
+        if self.stream is not None:
+            return self.stream.write(string)
+
+    def writelines(self, lines):
+        for l in lines:
+            self.write(l)
+
+    def flush(self):
+        if self.stream is not None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+_redirect_lock = threading.Lock()
+
+
+def _redirect():
+    """
+    Put :class:`_Redirect` in place of ``sys.stdout`` and ``sys.stderr``,
+    unless it is already there.
+    """
+    if type(sys.stdout) is _Redirect and type(sys.stderr) is _Redirect:
+        return
+    with _redirect_lock:
+        if type(sys.stdout) is not _Redirect:
+            sys.stdout = _Redirect(sys.stdout)
+        if type(sys.stderr) is not _Redirect:
+            sys.stderr = _Redirect(sys.stderr)
+
+
+@contextmanager
+def capture():
+    """
+    Capture output written to ``sys.stdout`` and ``sys.stderr`` in the
+    current context (thread or asyncio task). Returns the list of written
+    strings. Output of other threads is not captured.
+    """
+    _redirect()
+    content = []
+    outer = _output.get()
+    _output.set(content)
+    try:
+        yield content
+    finally:
+        _output.set(outer)
+
+
+@contextmanager
+def _snippet_context(scope):
+    """
+    Capture output of a snippet evaluated in the namespace ``scope``, see
+    :func:`capture`. Meanwhile, nested ``pre_pro`` calls use ``scope``.
+    """
+    with capture() as content:
+        outer = _scope.get()
+        _scope.set(scope)
+        try:
+            yield content
+        finally:
+            _scope.set(outer)
+
+
+# ml = logger.MyLogger()
+
+# Modules, which are needed only for some templates or only in case of
+# errors, are imported when needed: their import is noticeable at the start
+# of short ppp.py runs.
+def dedent(text):
+    from textwrap import dedent
+    return dedent(text)
+
+
+# if a link is used, one has to ensure that python still searches local
+# directory for the modules. The local directory will be searched first.
+sys.path.insert(0, getcwd())
+
+
+# Options that modify positioning of snippet's result.
+_OptionsList = [
+    'r',  # adjust right
+    'l',  # adjust left
+    'c',  # center
+    'd',  # delete snippet code, i.e. put to resulting file only result
+    's',  # skip the snippet evaluation. Just leave its text representation
+    'D',  # default. Do not preserve snippet place.
+    ]
+
+
+def firstline(l1, _log):
+    """
+    Get commenting string, default key and delimiters from the 1-st line
+    ``l1``.
+
+    ``_log`` is a logger, used to print out warnings etc.
+    """
+    # Check the first line with comment and insertion marks.
+    # Default parameters of the first line:
+    TemplateOpt = '-D'
+    Cchar = ''
+    if len(l1) < 2:
+        msg = """
+        ERROR:
+            The first line of template must specify optional comment string,
+            starting  and ending delimiters,  i.e.  be at least 2 characters
+            long."""
+        msg = dedent(msg[1:])
+        _log(0, msg, line=1, event='firstline')
+        raise SystemExit(msg)
+    else:
+        # read the delimiters:
+        Schar, Echar = l1[-2:]
+        l1 = l1[:-2]
+        # Read the default option, if given:
+        if len(l1) >= 2:
+            # 1st line can contain the default option in its first two chars.
+            # Find the 1-st match of the option:
+            r = re.compile('-[{}]'.format(''.join(_OptionsList)))
+            f = r.findall(l1)
+            if f:
+                TemplateOpt = f[0]
+                l1 = l1.replace(TemplateOpt, '')
+        # read the commenting string, if given:
+        if l1:
+            Cchar = l1[:]
+
+    # perform some check of the Schar and Echar:
+    for char in [Schar, Echar]:
+        if char.isalnum() or char == ' ':
+            msg = """
+            WARNING:
+                the delimiter specified on the first line of
+                the template, is alpha-numeric or blank.
+
+                COMMENTING STRING: {0}
+                STARTING DELIMITER: {1}
+                ENDING DELIMITER: {2}""".format(Cchar, Schar, Echar)
+            msg = dedent(msg[1:])
+            _log(1, msg, line=1, event='firstline')
+            break  # one warning is enough
+
+    # issue warning, if commenting char is empty:
+    if Cchar == '':
+        msg = """
+        WARNING:
+            string of commenting characters is empty.
+            Multi-line  snippets remain uncommented."""
+        msg = dedent(msg[1:])
+        _log(1, msg, line=1, event='firstline')
+    return TemplateOpt, Cchar, Schar, Echar
+
+
+def is_snippet(t, sch, ech):
+    """
+    Returns if ``t`` is a snippet. A snippet must start with sch and end
+    with ech.
+    """
+    if t and t[0] == sch and t[-1] == ech:
+        return True
+    else:
+        return False
+
+
+def removeOpt(t, default):
+    """
+    Remove option of the next snippet from the text ``t`` preceeding it.
+    """
+    # Find options for the next snippet, remember them and remove them
+    # from result:
+    if len(t) > 1 and t[-2] == '-' and t[-1] in _OptionsList:
+        SnippetOpt = t[-2:]
+        if SnippetOpt == '-d':
+            # just remove option from result. The following snippet
+            # will be also removed.
+            t = t[:-2]
+        elif SnippetOpt == '-s':
+            pass              # Do not remove snippet option.
+        else:
+            t = t[:-2] + '  '  # instead of option put spaces
+    else:
+        SnippetOpt = default
+    return t, SnippetOpt
+
+
+# Global scope for all pre_pro calls.
+gld = {}
+
+# Namespace of the snippet being processed in the current context, or None.
+_scope = ContextVar('twps_scope', default=None)
+
+# Collectors of templates rendered in the current context, see
+# twps.include.
+_reads = ContextVar('twps_reads', default=())
+
+
+def preload(modules, namespace=None):
+    """
+    Import ``modules`` (names of modules) and bind them in ``namespace``, by
+    default the global namespace :data:`gld`, as the ``import`` statement
+    does, e.g. for ``'os.path'`` the name ``os`` is bound. Snippets of all
+    templates processed afterwards use them without importing again.
+    """
+    from importlib import import_module
+    if namespace is None:
+        namespace = gld
+    for name in modules:
+        import_module(name)
+        top = name.split('.')[0]
+        namespace[top] = sys.modules[top]
+
+
+def current_namespace():
+    """
+    Return the namespace of the snippet being processed in the current
+    context (thread or asyncio task). Outside of snippets, it is the global
+    namespace :data:`gld`.
+    """
+    scope = _scope.get()
+    return gld if scope is None else scope
+
+
+# Names, use of which in a snippet can make it depend on any name in the
+# namespace.
+_dynamic_names = frozenset(['pre_pro', 'globals', 'locals', 'vars', 'dir',
+                            'eval', 'exec', 'execfile', '__import__'])
+
+
+def code_names(code):
+    """
+    Return set of names used by the code object ``code`` and by code objects
+    of functions and classes defined in it.
+    """
+    names = set(code.co_names)
+    for c in code.co_consts:
+        if hasattr(c, 'co_names'):
+            names |= code_names(c)
+    return names
+
+
+# Instructions, which read and write names of the namespace. In functions
+# and classes, only global names are written to the namespace.
+_read_ops = frozenset(['LOAD_NAME', 'LOAD_GLOBAL', 'LOAD_FROM_DICT_OR_GLOBALS',
+                       'DELETE_NAME', 'DELETE_GLOBAL'])
+_write_ops = frozenset(['STORE_NAME', 'STORE_GLOBAL', 'DELETE_NAME',
+                        'DELETE_GLOBAL', 'IMPORT_STAR'])
+_global_write_ops = frozenset(['STORE_GLOBAL', 'DELETE_GLOBAL'])
+
+
+def name_access(code, nested=False):
+    """
+    Return tuple (read, written) of sets of names, which the code object
+    ``code`` and code objects of functions and classes defined in it read
+    from and write to the namespace. If the code imports all names from a
+    module, ``'*'`` is among the written names.
+    """
+    import dis
+    read = set()
+    written = set()
+    write_ops = _global_write_ops if nested else _write_ops
+    for ins in dis.get_instructions(code):
+        if ins.opname in _read_ops:
+            read.add(ins.argval)
+        if ins.opname in write_ops:
+            written.add('*' if ins.opname == 'IMPORT_STAR' else ins.argval)
+    for c in code.co_consts:
+        if hasattr(c, 'co_names'):
+            r, w = name_access(c, True)
+            read |= r
+            written |= w
+    return read, written
+
+
+def function_access(names, scope):
+    """
+    Return tuple (read, written) of sets of names, which functions defined
+    in the namespace ``scope`` and referred to by ``names`` (also indirectly)
+    read from and write to the namespace. The read names include ``names``.
+    Returns None, if these functions access the namespace dynamically.
+    """
+    read = set(names)
+    written = set()
+    todo = list(read)
+    while todo:
+        v = scope.get(todo.pop())
+        code = getattr(v, '__code__', None)
+        if code is None or getattr(v, '__globals__', None) is not scope:
+            continue
+        r, w = name_access(code, True)
+        if r & _dynamic_names:
+            return None
+        todo.extend(r - read)
+        read |= r
+        written |= w
+    return read, written
+
+
+class Segment(object):
+    """
+    Part of the template body: either a piece of text or a snippet.
+
+    ``line`` -- number of the template line, where the segment starts.
+
+    ``text`` -- the segment text. For snippets, delimiters are included.
+
+    ``mode`` -- how the segment is processed. One of ``'text'`` (copied to the
+    result as is), ``'skip'`` (snippet with the ``-s`` option, copied to the
+    result as is), ``'eval'`` or ``'exec'``.
+
+    ``option`` -- the snippet option, i.e. one of ``-l``, ``-r``, ``-c``,
+    ``-d``, ``-s`` or ``-D``.
+
+    ``code`` -- code object, compiled for evaluation or execution. When the
+    snippet cannot be compiled neither for evaluation nor for execution, it is
+    None and ``error`` contains the SyntaxError raised by compilation.
+    """
+    __slots__ = ('line', 'text', 'mode', 'option', 'source', 'code', 'error')
+
+    def __init__(self, line, text, mode='text', option=None):
+        self.line = line
+        self.text = text
+        self.mode = mode
+        self.option = option
+        self.source = None
+        self.code = None
+        self.error = None
+
+    def compile(self):
+        """
+        Compile the snippet. The snippet is compiled for evaluation, if
+        possible, otherwise for execution.
+        """
+        # Strip delimiters:
+        snippet = self.text[1:-1]
+        try:
+            # eval() ignores leading spaces and tabs, compile() does not.
+            self.code = compile(snippet.lstrip(' \t'), '<string>', 'eval')
+            self.mode = 'eval'
+            self.source = snippet
+        except SyntaxError:
+            # If there is syntax error in evaluation, the snippet is executed.
+            # If snippet is a multi-line snippet, it must be prepared for
+            # execution: indentation possibly used in the input file should be
+            # removed.
+            self.mode = 'exec'
+            self.source = dedent(snippet)
+            try:
+                self.code = compile(self.source, '<string>', 'exec')
+            except SyntaxError as err:
+                # Reported when the snippet is executed.
+                self.error = err
+
+    def __getstate__(self):
+        # Code objects cannot be pickled. They are compiled again when the
+        # segment is unpickled.
+        return (self.line, self.text, self.mode, self.option)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+        if self.mode in ('eval', 'exec'):
+            self.compile()
+
+    def __repr__(self):
+        return 'Segment({!r}, {!r}, {!r}, {!r})'.format(
+            self.line, self.text, self.mode, self.option)
+
+
+def snippet_segment(n, t, SnippetOpt):
+    """
+    Return segment for the snippet ``t`` starting at line ``n``, with the
+    option ``SnippetOpt``.
+    """
+    if SnippetOpt == '-s':
+        # if snippet option set to -s, skip the snippet, i.e., do not evaluate
+        # it and put its string to the result
+        return Segment(n, t, 'skip', SnippetOpt)
+    seg = Segment(n, t, 'eval', SnippetOpt)
+    seg.compile()
+    return seg
+
+
+class Template(object):
+    """
+    Template parsed into a list of segments.
+
+    The template file is read and parsed once, each snippet is compiled into a
+    code object at this stage. The template can be rendered then with
+    different parameters without parsing and compiling it again.
+
+    ``fname`` -- name of the template file.
+
+    ``preamb`` -- snippet to be evaluated/executed before snippets in the
+    file.
+
+    ``loglevel``, ``logsink`` -- log level and optional sink for log messages,
+    see :class:`twps.log.Log`. When not given, they are inherited from the
+    template being processed, if any.
+    """
+    def __init__(self, fname, preamb='', loglevel=None, logsink=None):
+        self.fname = fname
+        self.preamb = preamb
+        self._log = Log(fname, loglevel, logsink)
+        with open(fname, 'r') as tfile:
+            # check template and resulting files modification time with
+            # seconds precision. More precision is not needed.
+            self.mtime = int(path.getmtime(tfile.name))
+            self.atime = int(path.getatime(tfile.name))
+            self._read(tfile)
+
+    def _read(self, tfile):
+        """
+        Read the template from the opened file ``tfile``.
+        """
+        s = tfile.read()
+        self._log(0, 'Start processing', event='start')
+        # this is the 1-st line, without trailing spaces.  Do not put this
+        # line to the resulting file. '+1' to avoid empty line at the begining
+        # of the resulting file.
+        l1 = s[:s.index('\n')].rstrip()
+        s = s[s.index('\n')+1:]
+        self._firstline(l1)
+        self.segments = self._parse(s)
+
+    def _firstline(self, l1):
+        """
+        Read delimiters, commenting string and default option from the first
+        line ``l1``.
+        """
+        _log = self._log
+        TemplateOpt, Cchar, Schar, Echar = firstline(l1, _log)
+        _log(3, 'First line: {0}', l1, event='firstline')
+        _log(3, 'Default option: {0}', TemplateOpt, event='firstline')
+        _log(3, 'Commenting str: {0}', Cchar, event='firstline')
+        _log(3, 'Delimiters    : {0} {1}', Schar, Echar, event='firstline')
+        self.option = TemplateOpt
+        self.cchar = Cchar
+        self.delimiters = (Schar, Echar)
+
+    def _preamble(self):
+        """
+        Command line snippet, prepared to be put before the template body.
+        """
+        if self.preamb:
+            Schar, Echar = self.delimiters
+            return '-d{}{}{}'.format(Schar, self.preamb, Echar)
+        return ''
+
+    def _parse(self, s):
+        """
+        Split template body ``s`` into segments.
+        """
+        _log = self._log
+        TemplateOpt = self.option
+        Schar, Echar = self.delimiters
+
+        # Regular expression to match insertions:
+        t_ins = re.compile('(' + re.escape(Schar) + '.*?' + re.escape(Echar) +
+                           ')', re.DOTALL)
+
+        # Add command line snippet as the first snippet to the file:
+        s = self._preamble() + s
+
+        # find all insertions in the file:
+        # this splits the text into parts matching and not matching the
+        # pattern.
+        spl = t_ins.split(s)
+
+        #  define line numbers, where all spl elements start:
+        nl_spl = [2]  # list of the line numbers
+        for t in spl:
+            nl_spl.append(nl_spl[-1] + t.count('\n'))
+        nl_spl.pop(-1)
+        _log(3, 'List of line numbers: {}', nl_spl, event='parse')
+        _log(3, 'Text parts: {}', spl, event='parse')
+
+        # check for the unpaired delimiters. If they are,
+        # the last element of spl should have one.
+        if Schar in spl[-1] or Echar in spl[-1]:
+            _log(1, 'WARNING: there are unpaired delimiters.', event='parse')
+
+        segments = []
+        SnippetOpt = TemplateOpt
+        for n, t in zip(nl_spl, spl):
+            # If the first and last characters of the string in spl are
+            # respectively Schar and Echar, this is a snippet string.
+            if not is_snippet(t, Schar, Echar):
+                # this is not a snippet. Find options for the next snippet,
+                # remember them and remove them from result:
+                t, SnippetOpt = removeOpt(t, TemplateOpt)
+                segments.append(Segment(n, t))
+            else:
+                segments.append(snippet_segment(n, t, SnippetOpt))
+        return segments
+
+    # Format of compressed resulting files, see compressors.
+    compress = None
+    # Encoding of templates processed as bytes, see MappedTemplate.
+    encoding = None
+    # Formatters of snippet results, see twps.formats. None means the global
+    # registry.
+    formatters = None
+
+    # Output of the setup segments processed by setup(), and index of the
+    # first segment not processed by it.
+    _head = ()
+    _start = 0
+    # Dependency files recorded while the setup segments were processed.
+    _setup_deps = ()
+    # Names read and written by snippets, see names(). False if not found
+    # yet.
+    _names = False
+
+    def setup_length(self, names):
+        """
+        Number of the leading segments, which do not depend on ``names``, i.e.
+        snippets of which do not use them.
+
+        The first snippet, that uses any of ``names`` (also in functions
+        or classes defined by it), calls ``pre_pro`` or accesses the namespace
+        dynamically, ends the leading segments.
+        """
+        names = set(names) | _dynamic_names
+        n = 0
+        for seg in self.segments:
+            if seg.code is not None and names & code_names(seg.code):
+                break
+            n += 1
+        return n
+
+    def names(self):
+        """
+        Return tuple (read, written) of sets of names, which snippets of the
+        template read from and write to the namespace, see
+        :func:`name_access`, or None if snippets access the namespace
+        dynamically.
+        """
+        names = self._names
+        if names is False:
+            read = set()
+            written = set()
+            for seg in self.segments:
+                if seg.code is not None:
+                    r, w = name_access(seg.code)
+                    read |= r
+                    written |= w
+            if read & _dynamic_names - set(['pre_pro']) or '*' in written:
+                names = None
+            else:
+                names = read, written
+            self._names = names
+        return names
+
+    def setup(self, scope, names):
+        """
+        Process in the namespace ``scope`` the leading segments of the
+        template, which do not depend on ``names``, see
+        :meth:`setup_length`. Subsequent renderings of the template start
+        after these segments and reuse their output.
+
+        Returns the number of processed segments.
+        """
+        n = self.setup_length(names)
+        _log = self._log
+        with deps.Recorder() as rec:
+            with _log:
+                self._head = list(self._generate_segments(scope, _log, 0, n))
+        self._start = n
+        self._setup_deps = tuple(rec.files)
+        return n
+
+    def _run(self, scope, res):
+        """
+        Evaluate or execute snippets in the namespace ``scope``. Resulting
+        strings are appended to the list ``res``.
+        """
+        res.extend(self._generate(scope))
+        return res
+
+    def _generate(self, scope):
+        """
+        Evaluate or execute snippets in the namespace ``scope``. Yields
+        resulting strings.
+        """
+        reads = _reads.get()
+        if reads:
+            reads[-1].add(self)
+        _log = self._log
+        profile = active_profiler()
+        if profile is not None:
+            state = profile.enter(self)
+        try:
+            with _log:
+                for r in self._head:
+                    yield r
+                for r in self._generate_segments(scope, _log, self._start):
+                    yield r
+        finally:
+            if profile is not None:
+                profile.exit(state)
+
+    def _generate_segments(self, scope, _log, start=0, stop=None):
+        # Debug messages are issued for each segment. Check once, whether
+        # they are needed at all.
+        debug = _log.enabled(3)
+        # Limits of the variant being rendered, see twps.limits, and the
+        # profiler, see twps.profiler.
+        limits = active_limits()
+        profile = active_profiler()
+        for sid, seg in islice(enumerate(self.segments), start, stop):
+            n = seg.line
+            t = seg.text
+            # The current segment, to be written to the log sink.
+            _log.sid = sid
+            _log.line = n
+            if debug:
+                _log(3, 'Starting with', line=n, snippet=t, event='snippet')
+
+            if seg.mode == 'text':
+                # Just copy it to the resulting file.
+                yield t
+                if debug:
+                    _log(3, 'Not a snippet', event='text')
+                continue
+            elif seg.mode == 'skip':
+                if debug:
+                    _log(3, 'Skipping snippet evaluation', event='skip')
+                yield t
+                continue
+
+            # Resulting strings of the snippet. They are yielded after the
+            # output capture is finished.
+            res = []
+
+            # To separate outputs from different snippets, output of each
+            # snippet is captured into its own list, see _Redirect. The
+            # capture and the namespace for nested pre_pro calls are local
+            # to the current context, therefore neither parent templates
+            # nor renders in other threads are affected.
+            try:
+                with _snippet_context(scope) as content:
+                    if profile is not None:
+                        stamp = profile.start(seg)
+                    try:
+                        if limits is None:
+                            self._process(seg, scope, res, _log, debug)
+                        else:
+                            with limits.snippet():
+                                self._process(seg, scope, res, _log, debug)
+                    finally:
+                        if profile is not None:
+                            profile.stop(self, sid, seg, stamp, content)
+                        # if there were some outputs in snippet, add it to
+                        # ther resulting strings:
+                        res += content
+            except LimitExceeded as err:
+                if err.line is None:
+                    # The innermost snippet. Output of this and the
+                    # enclosing snippets is discarded, thus it is reported
+                    # for the variant, see twps.limits.
+                    err.fname = self.fname
+                    err.line = n
+                raise
+            for r in res:
+                if type(r) is _Stream:
+                    for s in self._stream(r, scope, _log):
+                        yield s
+                else:
+                    yield r
+        _log.sid = _log.line = None
+
+    def _process(self, seg, scope, res, _log, debug):
+        """
+        Evaluate or execute the snippet segment ``seg`` in the namespace
+        ``scope``. Resulting strings are appended to ``res``.
+        """
+        n = seg.line
+        t = seg.text
+        SnippetOpt = seg.option
+        snippet = seg.source
+        if seg.mode == 'eval':
+            try:
+                # try to evaluate:
+                if debug:
+                    _log(3, 'Startnig snippet evaluation', line=n,
+                         snippet=snippet, event='eval')
+                tmp = eval(seg.code, scope)
+                if debug:
+                    _log(3, 'Result: {!r}', tmp, line=n, event='result')
+                self._eval_result(seg, tmp, res)
+            except Exception as err:
+                self._eval_error(seg, err, res, _log)
+        else:
+            if debug:
+                _log(3, 'Executing snippet', line=n,
+                     snippet=repr(snippet), event='exec')
+
+            # If snippet is multi-line, comment the snippet strings.  Copy
+            # snippet to the result (do not copy if option -d is
+            # specified):
+            if SnippetOpt != '-d':
+                res.append(t.replace('\n', '\n'+self.cchar))
+            try:
+                # try to execute the snippet:
+                if seg.code is not None:
+                    exec(seg.code, scope)
+                ee = seg.error
+            except Exception as err:
+                ee = err
+            if ee is not None:
+                self._exec_error(seg, ee, _log)
+
+    def _eval_result(self, seg, tmp, res):
+        """
+        Append to ``res`` the result ``tmp`` of evaluation of the snippet
+        segment ``seg``.
+        """
+        registry = formats.registry(self)
+        if registry and type(tmp) is not str:
+            text = formats.apply(tmp, registry)
+            if text is not None:
+                tmp = text
+        if isinstance(tmp, Iterator):
+            # Generators, file objects etc. are streamed into the result,
+            # when the resulting strings are yielded, see _stream().
+            res.append(_Stream(seg, tmp))
+            return
+        t = seg.text
+        SnippetOpt = seg.option
+        et = str(tmp)
+        # if the snippet can be evaluated, substitute it with the
+        # result of evaluation.  If the result is shorter than
+        # the snippet string, positioning of the result depends
+        # on SnippetOpt:
+        d = len(t) - len(et)
+        if d > 0:
+            if SnippetOpt == '-l':
+                # adjust left:
+                et = et + ' '*d
+            elif SnippetOpt == '-r':
+                # adjust right:
+                et = ' '*d + et
+            elif SnippetOpt == '-c':
+                # center:
+                dl = d // 2
+                dr = d - dl
+                et = ' '*dl + et + ' '*dr
+
+        # add snippet evaluation result if no -d option is given.
+        if SnippetOpt != '-d':
+            res.append(et)
+
+    def _stream(self, stream, scope, _log):
+        """
+        Yield strings of the streamed result ``stream`` of a snippet, see
+        :class:`_Stream`, and its output, as they are produced.
+
+        Items of the iterator are converted to strings. With the ``-d``
+        option, they are consumed, but not put to the result. A result
+        shorter than the snippet is adjusted as for other snippets: with
+        ``-l`` the spaces are appended, with ``-r`` and ``-c`` the strings
+        are held back until they are longer than the snippet or the iterator
+        is exhausted.
+        """
+        seg = stream.seg
+        option = seg.option
+        width = len(seg.text)
+        held = [] if option in ('-r', '-c') else None
+        n = 0
+        limits = active_limits()
+        done = False
+        while not done:
+            chunk, output, done = self._next_chunk(stream.iterator, seg,
+                                                   scope, _log, limits)
+            if chunk and option != '-d':
+                n += len(chunk)
+                if held is None:
+                    yield chunk
+                else:
+                    held.append(chunk)
+            if held is None:
+                for s in output:
+                    yield s
+            else:
+                held.extend(output)
+                if n >= width:
+                    for s in held:
+                        yield s
+                    held = None
+        d = width - n
+        if held is not None:
+            if d > 0 and option == '-r':
+                held.insert(0, ' '*d)
+            elif d > 0 and option == '-c':
+                held.insert(0, ' '*(d // 2))
+                held.append(' '*(d - d // 2))
+            for s in held:
+                yield s
+        elif d > 0 and option == '-l':
+            yield ' '*d
+
+    def _next_chunk(self, iterator, seg, scope, _log, limits):
+        """
+        Get the next items of the streamed result of the snippet segment
+        ``seg``, up to :data:`STREAM_CHUNK` characters or until the items
+        print something. Returns tuple (chunk, output, done): the items
+        converted to strings and joined, strings of the output captured
+        meanwhile, and True if the iterator is exhausted or failed.
+        """
+        # Code of generators runs in the context of the snippet: its output
+        # is captured, nested pre_pro calls use its namespace and the
+        # snippet limits apply to each chunk.
+        items = []
+        try:
+            with _snippet_context(scope) as content:
+                try:
+                    if limits is None:
+                        done = _take(iterator, items, content)
+                    else:
+                        with limits.snippet():
+                            done = _take(iterator, items, content)
+                    return ''.join(items), content, done
+                except Exception as err:
+                    res = []
+                    self._eval_error(seg, err, res, _log)
+                    return ''.join(items), res + content, True
+        except LimitExceeded as err:
+            if err.line is None:
+                err.fname = self.fname
+                err.line = seg.line
+            raise
+
+    def _eval_error(self, seg, err, res, _log):
+        """
+        Report the exception ``err`` raised by evaluation of the snippet
+        segment ``seg``. The snippet itself is appended to ``res``.
+        """
+        if isinstance(err, MemoryError):
+            check_memory_error(err)
+        n = seg.line
+        if isinstance(err, NameError):
+            # The NameError exception raises when e.g. expression is
+            # an undefined variable.  Issue a warning
+            _log(1, 'WARNING: Snippet caused evaluation error',
+                 line=n, event='error')
+            _log(1, err, event='error')
+        else:
+            # evaluation can fail for some other reason. Try to catch
+            # it and report about it
+            import traceback
+            _log(1, 'WARNING: '
+                    'Snippet caused evaluation error:',
+                    line=n, snippet=repr(seg.source), event='error')
+            _log(3, err, event='error')
+            traceback.print_tb(err.__traceback__)
+        # In this case, put the snippet itself to the output file:
+        res.append(seg.text)
+
+    def _exec_error(self, seg, err, _log):
+        """
+        Report the exception ``err`` raised by execution of the snippet
+        segment ``seg``.
+        """
+        if isinstance(err, MemoryError):
+            check_memory_error(err)
+        _log(1, 'WARNING: '
+                'Snippet caused execution error:',
+                line=seg.line, snippet=repr(seg.source), event='error')
+        _log(3, err, event='error')
+
+    def iter_render(self, **params):
+        """
+        Evaluate/execute the template snippets and yield strings of the
+        resulting text as soon as they are ready.
+
+        Keyword arguments ``params`` are set in the namespace of snippets
+        before evaluation. The namespace is the global one or, when called
+        from a snippet, that of the snippet, see :func:`current_namespace`.
+        Use :class:`RenderContext` to render in a separate namespace.
+        """
+        scope = current_namespace()
+        scope['pre_pro'] = pre_pro
+        scope.update(params)
+        return self._generate(scope)
+
+    def render(self, **params):
+        """
+        Evaluate/execute the template snippets and return the resulting text.
+
+        Keyword arguments ``params`` are set in the namespace of snippets
+        before evaluation, see :meth:`iter_render`.
+        """
+        return ''.join(self.iter_render(**params))
+
+
+def _take(iterator, items, content):
+    """
+    Append strings of items of ``iterator`` to ``items``, until they are
+    :data:`STREAM_CHUNK` characters long or the output ``content`` is not
+    empty. Returns True if the iterator is exhausted.
+    """
+    n = 0
+    for item in iterator:
+        item = str(item)
+        items.append(item)
+        n += len(item)
+        if n >= STREAM_CHUNK or content:
+            return False
+    return True
+
+
+# Number of characters of a streamed snippet result, which are joined into
+# one resulting string.
+STREAM_CHUNK = 1 << 16
+
+
+class _Stream(object):
+    """
+    Iterator, to which the snippet segment ``seg`` evaluated. It is streamed
+    into the result item by item, see :meth:`Template._stream`.
+    """
+    __slots__ = ('seg', 'iterator')
+
+    def __init__(self, seg, iterator):
+        self.seg = seg
+        self.iterator = iterator
+
+
+# Parsed templates, reused by load_template() while the template files do not
+# change. None disables the cache.
+template_cache = None
+
+# Texts of templates included by snippets, an instance of
+# twps.include.IncludeCache. None disables the cache.
+include_cache = None
+
+
+def load_template(fname, preamb='', loglevel=None, logsink=None):
+    """
+    Return :class:`Template` for the file ``fname``. If ``template_cache`` is
+    enabled, i.e. is a dictionary, the template is parsed only if it has not
+    been parsed before or the file has changed since.
+    """
+    if template_cache is None:
+        return Template(fname, preamb, loglevel, logsink)
+    st = os.stat(fname)
+    key = (path.abspath(fname), preamb)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = template_cache.get(key)
+    if cached is not None and cached[0] == stamp:
+        # Segments are shared, the log is new.
+        tpl = copy(cached[1])
+        tpl._log = Log(fname, loglevel, logsink)
+        return tpl
+    tpl = Template(fname, preamb, loglevel, logsink)
+    template_cache[key] = (stamp, tpl)
+    # Attributes set by the caller do not get into the cache.
+    return copy(tpl)
+
+
+# Size of blocks, in characters, by which the template body is read in the
+# streaming mode.
+STREAM_BUFFER = 1 << 20
+
+
+class StreamTemplate(Template):
+    """
+    Template, which body is not kept in memory.
+
+    Only the first line is read when the template is created. Each time the
+    template is rendered, its body is read from the file by blocks of
+    ``bufsize`` characters, see :func:`scan`, and the found segments are
+    processed immediately. Thus, the memory needed to render the template is
+    limited by the size of the largest snippet, not by the template size.
+
+    Snippets are compiled each time they are found in the template, except
+    short snippets: their code objects are kept and reused.
+    """
+    # Maximal length of snippets, which code objects are kept, and the maximal
+    # number of kept code objects.
+    cache_snippet = 256
+    cache_size = 4096
+
+    def __init__(self, fname, preamb='', loglevel=None, logsink=None,
+                 bufsize=None):
+        self.bufsize = bufsize or STREAM_BUFFER
+        self._codes = {}
+        Template.__init__(self, fname, preamb, loglevel, logsink)
+
+    def _snippet_segment(self, n, t, SnippetOpt):
+        """
+        Return segment for the snippet ``t``, reusing the code object compiled
+        for the same snippet before.
+        """
+        if SnippetOpt == '-s' or len(t) > self.cache_snippet:
+            return snippet_segment(n, t, SnippetOpt)
+        seg = Segment(n, t, 'eval', SnippetOpt)
+        compiled = self._codes.get(t)
+        if compiled is None:
+            seg.compile()
+            compiled = (seg.mode, seg.source, seg.code, seg.error)
+            if len(self._codes) < self.cache_size:
+                self._codes[t] = compiled
+        else:
+            seg.mode, seg.source, seg.code, seg.error = compiled
+        return seg
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_codes'] = {}
+        return state
+
+    def _read(self, tfile):
+        self._log(0, 'Start processing', event='start')
+        self._firstline(tfile.readline().rstrip())
+
+    def names(self):
+        # The template body is not kept, names are not known in advance.
+        return None
+
+    @property
+    def segments(self):
+        """
+        Segments of the template body, read from the template file.
+        """
+        TemplateOpt = self.option
+        Schar, Echar = self.delimiters
+        SnippetOpt = TemplateOpt
+        # Unpaired delimiters can appear only in the text after the last
+        # snippet.
+        unpaired = False
+        with open(self.fname, 'r') as tfile:
+            tfile.readline()
+            for n, t, kind in scan(tfile, Schar, Echar, self._preamble(),
+                                   self.bufsize):
+                if kind == 'snippet':
+                    unpaired = False
+                    yield self._snippet_segment(n, t, SnippetOpt)
+                else:
+                    unpaired = unpaired or Schar in t or Echar in t
+                    if kind == 'tail':
+                        # Find options for the next snippet.
+                        t, SnippetOpt = removeOpt(t, TemplateOpt)
+                    yield Segment(n, t)
+        if unpaired:
+            self._log(1, 'WARNING: there are unpaired delimiters.',
+                      event='parse')
+
+
+def scan(tfile, Schar, Echar, head='', bufsize=STREAM_BUFFER):
+    """
+    Find snippets in the text read from the file ``tfile`` block by block.
+
+    Yields tuples ``(n, t, kind)``, where ``t`` is a part of the text, ``n``
+    is the number of the line, where it starts, and ``kind`` is one of
+    ``'snippet'``, ``'text'`` or ``'tail'``. Text between snippets can be
+    yielded in several parts, the last of them has kind ``'tail'`` and is
+    followed by a snippet or is the last part of the text. The tail contains
+    at least the two last characters of the text, so that a snippet option
+    can be found in it.
+
+    ``head`` is the text put before the content of ``tfile``. Line numbers
+    start from 2, since the first line of the template is not a part of the
+    template body.
+
+    Snippets are found in the same way as in :class:`Template`, thus a
+    snippet that is not closed is considered as text. Only text that can be
+    a part of a snippet is kept in memory.
+    """
+    buf = head
+    n = 2
+    eof = False
+    p = 0   # start of the not yet yielded text in buf
+    i0 = 0  # position to start search of Schar
+    j0 = 0  # position to start search of Echar
+    while True:
+        i = buf.find(Schar, max(p, i0))
+        if i >= 0:
+            j = buf.find(Echar, max(i + 1, j0))
+            if j >= 0:
+                t = buf[p:i]
+                yield n, t, 'tail'
+                n += t.count('\n')
+                t = buf[i:j+1]
+                yield n, t, 'snippet'
+                n += t.count('\n')
+                p = j + 1
+                continue
+            # The snippet is not closed yet. Text before it can be given
+            # out, except two chars that can contain snippet option.
+            j0 = len(buf)
+            k = i - 2
+        else:
+            i0 = len(buf)
+            k = len(buf) - 2
+        if eof:
+            yield n, buf[p:], 'tail'
+            return
+        if k > p:
+            t = buf[p:k]
+            yield n, t, 'text'
+            n += t.count('\n')
+            p = k
+        # Drop the yielded text and read the next block.
+        block = tfile.read(bufsize)
+        eof = not block
+        buf = buf[p:] + block
+        i0 = max(i0 - p, 0)
+        j0 = max(j0 - p, 0)
+        p = 0
+
+
+class MappedTemplate(Template):
+    """
+    Template processed as bytes, which file is mapped into memory.
+
+    Text between snippets is not decoded and not copied: the segments refer
+    to regions of the mapped file (as ``memoryview`` objects), which are
+    written to the resulting file as they are. Only snippets are decoded with
+    ``encoding``, and their results are encoded with it.
+
+    The encoding must be compatible with ASCII, as latin-1 or utf-8, and the
+    delimiters must be ASCII characters. In contrast to :class:`Template`,
+    line ends are not translated.
+
+    When the template is rendered into a string, e.g. by nested ``pre_pro``
+    calls, the text between snippets is decoded.
+    """
+    def __init__(self, fname, preamb='', loglevel=None, logsink=None,
+                 encoding='latin-1'):
+        self.encoding = encoding
+        Template.__init__(self, fname, preamb, loglevel, logsink)
+
+    def _read(self, tfile):
+        with open(self.fname, 'rb') as bfile:
+            # The mapping remains valid after the file is closed.
+            import mmap
+            self._map = mmap.mmap(bfile.fileno(), 0, access=mmap.ACCESS_READ)
+        self._log(0, 'Start processing', event='start')
+        m = self._map
+        i = m.find(b'\n')
+        if i < 0:
+            raise ValueError('The template has only one line')
+        self._firstline(m[:i].decode(self.encoding).rstrip())
+        self.segments = self._parse_map(i + 1)
+
+    def _parse_map(self, start):
+        """
+        Split the mapped template body, starting at ``start``, into segments.
+        """
+        m = self._map
+        view = memoryview(m)
+        enc = self.encoding
+        TemplateOpt = self.option
+        Schar, Echar = self.delimiters
+        t_ins = re.compile(re.escape(Schar.encode(enc)) + b'.*?' +
+                           re.escape(Echar.encode(enc)), re.DOTALL)
+        options = set(o.encode(enc) for o in _OptionsList)
+        n = 2  # line number
+        segments = []
+        preamble = self._preamble()
+        if preamble:
+            segments.append(Segment(n, ''))
+            segments.append(snippet_segment(n, preamble[2:], '-d'))
+            n += preamble.count('\n')
+
+        def text(i, j):
+            # Text from i to j. Find the option for the next snippet and
+            # remove it from the text, as removeOpt() does.
+            SnippetOpt = TemplateOpt
+            e = j
+            if j - i > 1 and m[j-2:j-1] == b'-' and m[j-1:j] in options:
+                SnippetOpt = m[j-2:j].decode(enc)
+                if SnippetOpt != '-s':
+                    e = j - 2
+            segments.append(Segment(n, view[i:e]))
+            if SnippetOpt not in ('-d', '-s') and e < j:
+                # instead of option put spaces
+                segments.append(Segment(n, '  '))
+            return SnippetOpt
+
+        i = start
+        for match in t_ins.finditer(m, start):
+            j, k = match.span()
+            SnippetOpt = text(i, j)
+            n += _count_lines(m, i, j)
+            t = m[j:k].decode(enc)
+            segments.append(snippet_segment(n, t, SnippetOpt))
+            n += t.count('\n')
+            i = k
+        text(i, len(m))
+        for d in set([Schar, Echar]):
+            if m.find(d.encode(enc), i) >= 0:
+                self._log(1, 'WARNING: there are unpaired delimiters.',
+                          event='parse')
+                break
+        return segments
+
+    def _generate(self, scope):
+        enc = self.encoding
+        for r in self._generate_bytes(scope):
+            if isinstance(r, str):
+                yield r
+            else:
+                yield str(r, enc)
+
+    def _generate_bytes(self, scope):
+        """
+        Evaluate or execute snippets in the namespace ``scope``. Yields
+        resulting strings and regions of the mapped template (or bytes), to
+        be written to the resulting file.
+        """
+        return Template._generate(self, scope)
+
+    def __getstate__(self):
+        # The file is mapped again in the unpickling process.
+        state = self.__dict__.copy()
+        del state['_map'], state['segments']
+        state['_head'] = [r if isinstance(r, str) else bytes(r)
+                          for r in self._head]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        head = self._head
+        with open(self.fname, 'r') as tfile:
+            self._read(tfile)
+        self._head = head
+
+
+def _count_lines(m, i, j):
+    """
+    Number of new-line characters in the region from ``i`` to ``j`` of the
+    mapped file ``m``.
+    """
+    n = 0
+    for b in range(i, j, STREAM_BUFFER):
+        n += m[b:min(b + STREAM_BUFFER, j)].count(b'\n')
+    return n
+
+
+class RenderContext(object):
+    """
+    Namespace, in which snippets are evaluated and executed.
+
+    Templates rendered in different contexts do not see names defined in
+    each other, and can be rendered concurrently in threads of one process:
+    output of snippets is captured separately for each thread, see
+    :func:`capture`, and nested ``pre_pro`` calls use the namespace of the
+    snippet calling them. Snippets that release the GIL, e.g. numpy
+    operations, run in parallel.
+
+    ``namespace`` -- dictionary used as the namespace. A new one is created
+    by default. Without a context, templates are rendered in the global
+    namespace :data:`gld`.
+
+    Keyword arguments ``params`` are set in the namespace.
+    """
+    def __init__(self, namespace=None, **params):
+        self.namespace = {} if namespace is None else namespace
+        self.namespace['pre_pro'] = pre_pro
+        self.namespace.update(params)
+
+    def iter_render(self, tpl, **params):
+        """
+        Render the template ``tpl`` (:class:`Template` or file name) and
+        yield strings of the resulting text as soon as they are ready.
+        Keyword arguments ``params`` are set in the namespace before.
+        """
+        if not isinstance(tpl, Template):
+            tpl = load_template(tpl)
+        self.namespace.update(params)
+        return tpl._generate(self.namespace)
+
+    def render(self, tpl, **params):
+        """
+        Render the template ``tpl`` and return the resulting text, see
+        :meth:`iter_render`.
+        """
+        return ''.join(self.iter_render(tpl, **params))
+
+    def render_async(self, tpl, **params):
+        """
+        Coroutine rendering the template ``tpl`` and returning the resulting
+        text, see :func:`twps.aio.render_async`.
+        """
+        from .aio import render_async
+        return render_async(tpl, self, **params)
+
+    def pre_pro(self, fname, **kwargs):
+        """
+        Call :func:`pre_pro` in this context.
+        """
+        return pre_pro(fname, context=self, **kwargs)
+
+
+def result_name(fname, pidx, compress=None):
+    """
+    Return name of the resulting file for template ``fname`` and the tuple of
+    parameter indices ``pidx``. If the result is compressed with ``compress``
+    (see :data:`compressors`), the extension of the compressed format is
+    appended.
+    """
+    # Note about the choice of resulting file name: Originally, I used
+    # extension ``.t`` for the template files and added suffix ``.res`` to the
+    # resulting filename, so that for a template file ``inp.t`` the file
+    # ``inp.t.res`` was created. The problem with this approach is that the
+    # template as well as the resulting file extensions are not relevant for
+    # the syntax highlighting scheme of vim. Another approach, currently
+    # implemented is to preserve the extension of the template file (which
+    # should be chosen to get the most relevantvim syntax highlighting scheme)
+    # and optionally change the basename. For example, for the result of
+    # preprocessing template ``model.serp`` is ``model.r.serp`` or
+    # ``model.rN.serp``, where ``N`` is the index for parametric studies.
+    bname, extname = os.path.splitext(fname)
+    pname = ('_{}'*len(pidx)).format(*pidx)
+    if not pname:
+        pname = 'res'
+    rname = '{}.{}{}'.format(bname, pname, extname)
+    if compress:
+        rname += '.' + compress
+    return rname
+
+
+def _gzip(f):
+    import gzip
+    # Zero time stamp in the header: identical results are compressed into
+    # identical files.
+    return gzip.GzipFile(filename='', mode='wb', fileobj=f, compresslevel=6,
+                         mtime=0)
+
+
+def _bz2(f):
+    import bz2
+    return bz2.BZ2File(f, 'wb')
+
+
+def _xz(f):
+    import lzma
+    return lzma.LZMAFile(f, 'wb')
+
+
+# Formats of compressed resulting files, by extension. Values are functions,
+# which return a compressing binary file object writing to the given file
+# object.
+compressors = {'gz': _gzip, 'bz2': _bz2, 'xz': _xz}
+
+
+# Numbers of temporary files created by this process.
+_tmp_count = count()
+
+
+def _mkstemp(prefix, suffix, dname):
+    """
+    Create and open new file in the directory ``dname``, like
+    :func:`tempfile.mkstemp`, which import is slow. Returns tuple of the
+    file descriptor and the file name.
+    """
+    while True:
+        tname = path.join(dname, '{}{}-{}{}'.format(
+            prefix, os.getpid(), next(_tmp_count), suffix))
+        try:
+            fd = os.open(tname, os.O_RDWR | os.O_CREAT | os.O_EXCL |
+                         getattr(os, 'O_BINARY', 0), 0o600)
+        except FileExistsError:
+            continue
+        return fd, tname
+
+
+def _same_content(tname, rname):
+    """
+    Check if the file ``rname`` exists and has the same content as ``tname``.
+    """
+    if not path.exists(rname) or path.getsize(rname) != path.getsize(tname):
+        return False
+    with open(tname, 'rb') as f1, open(rname, 'rb') as f2:
+        while True:
+            b1 = f1.read(STREAM_BUFFER)
+            if b1 != f2.read(STREAM_BUFFER):
+                return False
+            if not b1:
+                return True
+
+
+def _write_bytes(f, chunks, encoding):
+    """
+    Write ``chunks`` to the binary file ``f``, encoding strings.
+    """
+    for c in chunks:
+        if isinstance(c, str):
+            c = c.encode(encoding)
+        f.write(c)
+
+
+def write_result(rname, chunks, tmtime, tatime, _log, compress=None,
+                 encoding=None):
+    """
+    Write strings from the iterable ``chunks`` to the resulting file
+    ``rname``, set its access and modification times to ``tatime`` and
+    ``tmtime`` and make it read-only.
+
+    The strings are written to a temporary file in the same directory, which
+    replaces the resulting file only after all strings are written. Thus the
+    resulting file is never seen incomplete or writable, and it remains
+    unchanged when generation of the strings fails.
+
+    If the resulting file already has the same content, it is left untouched,
+    including its modification time. Thus tools like make do not consider
+    it as changed.
+
+    ``compress`` -- optional format of the resulting file, one of the keys of
+    :data:`compressors`. The strings are compressed as they are written.
+
+    ``encoding`` -- if given, ``chunks`` can contain also bytes-like objects,
+    which are written as they are, while strings are encoded, see
+    :class:`MappedTemplate`.
+
+    Returns name of the actually written file.
+    """
+    _log(3, 'Output file: {!r}', rname, event='write')
+    dname, bname = path.split(rname)
+    fd, tname = _mkstemp('.' + bname + '.', '.tmp', dname or '.')
+    try:
+        if encoding:
+            with os.fdopen(fd, 'wb') as rfile:
+                if compress:
+                    with compressors[compress](rfile) as cfile:
+                        _write_bytes(cfile, chunks, encoding)
+                else:
+                    _write_bytes(rfile, chunks, encoding)
+        elif compress:
+            with os.fdopen(fd, 'wb') as rfile:
+                with io.TextIOWrapper(compressors[compress](rfile)) as cfile:
+                    cfile.writelines(chunks)
+        else:
+            with os.fdopen(fd, 'w') as rfile:
+                rfile.writelines(chunks)
+        if _same_content(tname, rname):
+            os.remove(tname)
+            _log(0, 'Result {0} is unchanged', rname, event='write')
+            return rname
+        if path.exists(rname) and not os.access(rname, os.W_OK):
+            # the file exists and cannot be rewritten. Check that the template
+            # and rfile have the same timestamps. If they are the same, it
+            # will be assumed that the resulting file was created from
+            # template without any other modifications and thus can be safely
+            # rewritten again.
+            rmtime = int(path.getmtime(rname))
+            if tmtime >= rmtime:
+                chmod(rname, S_IWRITE)
+            else:
+                # if timestamps of template and result differ, put new result
+                # to another file.
+                _log(0, 'File exists and is newer than template',
+                     event='write')
+                from datetime import datetime
+                ts = datetime.now().strftime('%y-%m-%d-%H-%M-%S')
+                rname = rname + ts
+        # Often, a user starts to change the resulting file instead of
+        # changing the template, and all the changes went when the template is
+        # processed. To warn user if he tries to change the resulting file,
+        # the permission is set to 'read-only'.
+        utime(tname, (tatime, tmtime))
+        chmod(tname, S_IREAD)
+        os.replace(tname, rname)
+    except BaseException:
+        if path.exists(tname):
+            os.remove(tname)
+        raise
+    _log(0, 'Result is written to {0}', rname, event='write')
+    return rname
+
+
+def render_variant(tpl, pidx, Plst, scope, incremental=False, journal=None,
+                   limits=None):
+    """
+    Render the template ``tpl`` in the namespace ``scope``, where parameters
+    ``Plst`` with indices ``pidx`` are already set, and write the result to
+    the resulting file.
+
+    If ``incremental`` is True, the template is not rendered, when the
+    resulting file is up to date, see :mod:`twps.deps`.
+
+    ``journal`` -- optional :class:`twps.journal.Journal` of the parametric
+    study. The variant is recorded to it, and is not rendered, if the journal
+    says it is complete.
+
+    ``limits`` -- optional :class:`twps.limits.Limits` of the variant and its
+    snippets. When exceeded, :exc:`twps.limits.LimitExceeded` is raised and
+    the resulting file is not written.
+
+    Returns name of the written file, or None if the resulting file is up to
+    date.
+    """
+    if limits is not None:
+        with limits.variant(tpl, pidx, Plst):
+            return render_variant(tpl, pidx, Plst, scope, incremental,
+                                  journal)
+    rname = result_name(tpl.fname, pidx, tpl.compress)
+    if journal is None:
+        return _write_variant(tpl, rname, Plst, scope, incremental)
+    if journal.completed(rname, Plst):
+        tpl._log(0, 'Result {} is complete', rname, event='write')
+        return None
+    t0 = time.time()
+    try:
+        wname = _write_variant(tpl, rname, Plst, scope, incremental)
+    except BaseException:
+        journal.record(pidx, Plst, rname, None, 'failed', time.time() - t0)
+        raise
+    if wname is not None:
+        journal.record(pidx, Plst, rname, wname, 'done', time.time() - t0)
+    return wname
+
+
+def _write_variant(tpl, rname, Plst, scope, incremental):
+    if tpl.encoding:
+        chunks = tpl._generate_bytes(scope)
+    else:
+        chunks = tpl._generate(scope)
+    if not incremental:
+        return write_result(rname, chunks, tpl.mtime, tpl.atime, tpl._log,
+                            tpl.compress, tpl.encoding)
+    key = deps.variant_key(tpl, Plst)
+    if deps.up_to_date(rname, key):
+        tpl._log(0, 'Result {} is up to date', rname, event='write')
+        return None
+    with deps.Recorder(tpl.fname, *tpl._setup_deps) as rec:
+        wname = write_result(rname, chunks, tpl.mtime, tpl.atime, tpl._log,
+                             tpl.compress, tpl.encoding)
+    deps.save(rname, wname, key, rec.files)
+    return wname
+
+
+def pre_pro(fname, level='default', preamb='', clp=[], workers=None,
+            loglevel=None, logsink=None, stream=False, incremental=False,
+            fork=False, shard=None, resume=False, dedup=None, compress=None,
+            archive=None, mapped=False, context=None, limits=None,
+            profile=False, formatters=None, **kwargs):
+    """
+    Preprocess template file fname.
+
+    :arg fname:
+
+        String, name of the template file to be processed.
+
+    :arg level:
+
+        level is necessary to distinguish the top-level template from templates
+        called from withing the top or above templates. Only for the top-level
+        template (which has level not equal to 'default') all resulting strings
+        are written to resulting file.
+
+    :arg preamb:
+
+        A string representing the snippet to be evaluated/executed before
+        snippets in the file. This is to allow snippets in the command line.
+
+    :arg clp:
+
+        A list of (name, vals) tuples, defining parameters for parametric
+        studies.
+
+    :arg workers:
+
+        Number of processes to render the parametric study variants in
+        parallel. Each variant is rendered in the namespace that is a copy of
+        the global namespace at the moment of the ``pre_pro`` call, i.e.
+        definitions made while rendering one variant are not visible in the
+        other ones. Used only when the results are written to files, i.e.
+        when ``level`` is not ``'default'``.
+
+    :arg loglevel:
+
+        Log level of the template. The bigger this value, the more information
+        is printed out. When not given, the log level of the calling template
+        is used, or :data:`twps.log.default_level` for the top-level template.
+
+    :arg logsink:
+
+        Optional sink for log messages, for example
+        :class:`twps.log.JSONSink`. Inherited from the calling template, if
+        not given.
+
+    :arg stream:
+
+        If True, the template body is not read into memory, but is processed
+        while it is read from the file, and the resulting text is written to
+        the resulting file as soon as it is generated, see
+        :class:`StreamTemplate`. This allows processing of templates that are
+        too large to be kept in memory.
+
+    :arg incremental:
+
+        If True, resulting files that are up to date are not written again.
+        For each resulting file, its dependencies are saved into a manifest
+        file, see :mod:`twps.deps`.
+
+    :arg fork:
+
+        If True, the leading segments of the template, which do not depend on
+        the parameters ``clp``, are processed only once, and each variant is
+        rendered in a child process forked after that, see
+        :func:`twps.sweep.render_forked`. Objects created by the setup
+        snippets are shared by the children and are not created again for
+        each variant. Up to ``workers`` children run at once. Used only when
+        the results are written to files, not in the streaming mode and only
+        on systems that support ``os.fork``.
+
+    :arg shard:
+
+        Optional tuple (i, n). When given, only variants of the ``i``-th of
+        ``n`` contiguous shards of the parametric study are rendered, see
+        :class:`twps.utils.VariantSpace`. This allows to render a study on
+        several computers independently. The resulting file names do not
+        depend on sharding.
+
+    :arg resume:
+
+        If True, variants recorded as complete in the journal of the
+        parametric study are not rendered again. The journal is written for
+        each parametric study rendered to files, see :mod:`twps.journal`.
+
+    :arg dedup:
+
+        What to do with identical resulting files of the parametric study:
+        ``'link'`` to replace them with hard links to one of them, or
+        ``'report'`` to list them in the report file, see
+        :mod:`twps.dedup`. Used only when the results are written to files.
+
+    :arg compress:
+
+        Write compressed resulting files: ``'gz'``, ``'bz2'`` or ``'xz'``.
+        The extension is appended to the resulting file name, e.g.
+        ``template._0.t.gz``. The text is compressed while it is generated,
+        the uncompressed result is not kept neither in memory nor on disk.
+
+    :arg archive:
+
+        Write all variants into a single archive, ``'tar'`` or ``'zip'``,
+        instead of separate resulting files, see :mod:`twps.archive`. The
+        archive is always written completely, i.e. ``incremental``,
+        ``resume``, ``dedup`` and ``fork`` are not used. Zip archive members
+        are compressed according to ``compress``.
+
+    :arg mapped:
+
+        If True, the template file is mapped into memory and processed as
+        bytes: text between snippets is written to the resulting file without
+        decoding and copying, see :class:`MappedTemplate`. If a string is
+        given, it is the encoding of the template, otherwise latin-1 is
+        assumed.
+
+    :arg context:
+
+        :class:`RenderContext`, in which namespace snippets are evaluated and
+        executed. By default, it is the namespace of the snippet calling
+        ``pre_pro``, or the global namespace :data:`gld`, see
+        :func:`current_namespace`. Variants rendered by ``workers`` in
+        separate processes use the global namespace of these processes.
+
+    :arg limits:
+
+        Optional :class:`twps.limits.Limits`: time and memory limits of each
+        snippet and each variant, and whether the parametric study continues
+        or stops when a variant exceeds them. Used only when the results are
+        written to separate files, i.e. not with ``archive``.
+
+    :arg profile:
+
+        If True, snippets and included templates are profiled. When the
+        template is rendered, the report is written to the log and the trace
+        to the file ``fname + '.trace.json'``, see :mod:`twps.profiler`. A
+        :class:`twps.profiler.Profiler` instance can be given instead, to
+        collect the profile of several calls, which is not reported then.
+
+    :arg formatters:
+
+        Registry of formatters of snippet results of this template, a
+        dictionary {type: formatter}, see :mod:`twps.formats`. By default,
+        the global registry :data:`twps.formats.formatters` is used.
+        Templates included by the snippets use their own formatters.
+
+    :arg kwargs:
+
+        All other keyword arguments are valiable names and their set of values.
+        Similar to ``clp``, but the order cannot be guarantied.
+
+    ``fname`` is a text file with python snippets. The function evaluates or
+    executes snippets and replace the snippet code with the evaluation or
+    execution result.
+
+    If ``level`` is equal to ``default``, ther resulting text is returned as a
+    list of strings. Otherwise, the resulting text will be written to file with
+    the name ``fname + '.res'``, and the modification time of the resulting
+    file will set to the modification time of the template.
+
+    Before writing the resulting file, its modification time is compared with
+    the modification time of the template. If the template is older (i.e. the
+    resulting file was changed after it was generated with ``pre_pro``), the
+    resulting file name will be prefixed with current date and time. Thus,
+    changes introduced into resulting file (for example when a user accidentaly
+    edits the resulting file instead of template) will not get lost.
+
+    The template's first line must contain the two characters, used to denote
+    the beginning and the end of snippets. Optionnaly, one can specify also in
+    the first line the commenting string and snippet default key.
+
+    The template is parsed and its snippets are compiled only once, see
+    :class:`Template`.
+    """
+    # Nested templates are dependencies of the resulting file being rendered.
+    deps.record(fname)
+
+    # try to evaluate and to execute. Snippets are evaluated or executed in the
+    # global namespace, which is returned by globals() function.  This ensures
+    # that variables defined in one template will be visible in another
+    # template.
+
+    # Global scope for evaluating/execution of snippets.
+    if context is not None:
+        scope = context.namespace
+    else:
+        scope = current_namespace()
+    scope['pre_pro'] = pre_pro
+
+    if level == 'default' and include_cache is not None:
+        # The included text can be reused, see twps.include.
+        def render():
+            tpl = _load(fname, preamb, loglevel, logsink, stream, mapped,
+                        formatters)
+            return _render_include(tpl, clp + list(kwargs.items()), scope)
+        call = (preamb, clp, sorted(kwargs.items()), loglevel,
+                bool(stream), mapped, formatters)
+        params = [p[0] for p in clp] + list(kwargs)
+        return include_cache.include(fname, call, params, scope, render)
+
+    tpl = _load(fname, preamb, loglevel, logsink, stream, mapped, formatters)
+    _log = tpl._log
+    if compress:
+        if compress not in compressors:
+            raise ValueError('Unknown compression {!r}'.format(compress))
+        if not archive:
+            tpl.compress = compress
+
+    # Add parameter values from kwargs to clp
+    clp = clp + list(kwargs.items())
+    res = []  # resulting strings.
+    _log(3, 'Complete set of parameters: {}', clp, event='variant')
+    if profile:
+        from .profiler import profiling
+        profiled = profiling(profile, tpl)
+    else:
+        profiled = nullcontext()
+    with profiled:
+        if archive and level != 'default':
+            from .archive import render_archive
+            render_archive(tpl, clp, archive, workers, shard, compress, scope)
+            return
+        journal = None
+        if clp and level != 'default':
+            from .journal import Journal
+            journal = Journal(tpl, resume, shard)
+        try:
+            if (fork and level != 'default' and not stream and
+                    hasattr(os, 'fork')):
+                from .sweep import render_forked
+                render_forked(tpl, clp, workers or 1, incremental, shard,
+                              journal, scope, limits)
+            elif workers and workers > 1 and level != 'default':
+                from .sweep import render_parallel
+                render_parallel(tpl, clp, workers, incremental, shard,
+                                journal, limits)
+            else:
+                _render_variants(tpl, level, clp, shard, incremental,
+                                 journal, res, scope, limits)
+        finally:
+            # A study aborted by exceeded limits leaves the journal
+            # complete.
+            if journal is not None:
+                journal.close()
+        if dedup and level != 'default':
+            from .dedup import dedup_results
+            dedup_results(tpl, clp, dedup, shard)
+    if level == 'default':
+        # Return string for all input vlaues
+        return _join(res)
+
+
+def _load(fname, preamb, loglevel, logsink, stream, mapped,
+          formatters=None):
+    """
+    Return template ``fname`` of the class, that corresponds to the options
+    of :func:`pre_pro`.
+    """
+    if mapped:
+        encoding = mapped if isinstance(mapped, str) else 'latin-1'
+        tpl = MappedTemplate(fname, preamb, loglevel, logsink, encoding)
+    elif stream:
+        tpl = StreamTemplate(fname, preamb, loglevel, logsink)
+    else:
+        tpl = load_template(fname, preamb, loglevel, logsink)
+    if formatters is not None:
+        # The template can be shared by template_cache.
+        tpl = copy(tpl)
+        tpl.formatters = formatters
+    return tpl
+
+
+def _join(res):
+    """
+    Join resulting strings of an included template, without trailing new-line
+    characters.
+    """
+    while res[-1] and res[-1][-1] in '\n\r':
+        res[-1] = res[-1][:-1]
+    return ''.join(res)
+
+
+def _render_include(tpl, clp, scope):
+    """
+    Render variants of parameters ``clp`` of the template ``tpl`` included
+    by a snippet, return the resulting text.
+    """
+    res = []
+    _log = tpl._log
+    _log(3, 'Complete set of parameters: {}', clp, event='variant')
+    _render_variants(tpl, 'default', clp, None, False, None, res, scope)
+    return _join(res)
+
+
+def _render_variants(tpl, level, clp, shard, incremental, journal, res,
+                     scope, limits=None):
+    """
+    Render variants of the template ``tpl`` one after another in the
+    namespace ``scope``, see :func:`pre_pro`.
+    """
+    _log = tpl._log
+    for pidx, Plst in variants(clp, shard):
+        _log(3, 'Current parameters: {!r}{!r}', pidx, Plst, event='variant')
+        scope.update(dict(Plst))
+        _log(3, 'Eval/exec scope: {}', scope, event='variant')
+
+        if level != 'default':
+            # if the level is not default, i.e. corresponds to the main
+            # template, print resulting strings into file. They are written
+            # as soon as they are ready.
+            try:
+                render_variant(tpl, pidx, Plst, scope, incremental, journal,
+                               limits)
+            except LimitExceeded:
+                # Without own limits, i.e. in a nested pre_pro call, the
+                # limit of the including snippet or variant is exceeded.
+                if limits is None or limits.on_limit == 'abort':
+                    raise
+        else:
+            tpl._run(scope, res)
+            # when a template is included with the direct call to pre_pro,
+            # the last line of the included template ends with the new-line
+            # character. It is not needed.
+            res[-1] = res[-1][:-1]
+
+
+if __name__ == '__main__':
+    from sys import argv
+    pre_pro(fname=argv[1], level='main')
@@ -1,29 +1,76 @@
-def variants(gls):
+class VariantSpace(object):
     """
-    Yields all possible variants of the parameter values.
+    All possible variants of the parameter values, addressable by index.
 
     ``gls`` is a list of tuples (name, vals, i0), where ``name`` is the
     parameter's name, ``vals`` is the list of values this parameter takes and
     the optional ``i0`` is the 1-st index used for file naming purposes.
 
-    The iterator yields idx, Ntot, Plst, where ``idx`` is a tuple of parameter
-    value indices, ``Ntot`` is the total number of variants, and ``Plst`` is a
-    list of parameter names and correspondent values. This list can be passed
-    to ``dict`` constructor to obtain a dictionary defining the scope with the
-    current set of parameter values.
+    ``len(space)`` is the number of variants. ``space[k]`` is the k-th variant,
+    i.e. tuple (idx, Plst), where ``idx`` is a tuple of parameter value
+    indices (starting from ``i0``), and ``Plst`` is a tuple of parameter names
+    and correspondent values. ``Plst`` can be passed to ``dict`` constructor to
+    obtain a dictionary defining the scope with the current set of parameter
+    values. The first parameter changes slowest, i.e. variants are ordered as
+    nested loops over the parameters.
     """
-    if gls:
-        k, vals = gls[0][:2]
-        if len(gls[0]) > 2:
-            n = gls[0][2]
-        else:
-            n = 0
-        for v in vals:
-            for t in variants(gls[1:]):
-                yield (n, ) + t[0], ((k, v),) + t[1]
-            n += 1
-    else:
-        yield ((), ())
+    def __init__(self, gls):
+        self.names = [g[0] for g in gls]
+        self.values = [list(g[1]) for g in gls]
+        self.starts = [g[2] if len(g) > 2 else 0 for g in gls]
+        self.size = 1
+        for vals in self.values:
+            self.size *= len(vals)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, k):
+        if k < 0:
+            k += self.size
+        if not 0 <= k < self.size:
+            raise IndexError('variant index out of range')
+        idx = []
+        Plst = []
+        for name, vals, i0 in zip(self.names[::-1], self.values[::-1],
+                                  self.starts[::-1]):
+            k, i = divmod(k, len(vals))
+            idx.append(i0 + i)
+            Plst.append((name, vals[i]))
+        return tuple(idx[::-1]), tuple(Plst[::-1])
+
+    def __iter__(self):
+        for k in range(self.size):
+            yield self[k]
+
+    def shard(self, i, n):
+        """
+        Return range of indices of variants in the ``i``-th of ``n`` shards.
+        The shards are contiguous, disjoint and cover all variants; ``i``
+        starts from 0.
+        """
+        if not 0 <= i < n:
+            raise ValueError('shard {} of {} does not exist'.format(i, n))
+        return range(self.size * i // n, self.size * (i + 1) // n)
+
+
+def variants(gls, shard=None):
+    """
+    Yields all possible variants of the parameter values.
+
+    ``gls`` is a list of tuples (name, vals, i0), see :class:`VariantSpace`.
+
+    The iterator yields idx, Plst, where ``idx`` is a tuple of parameter
+    value indices, and ``Plst`` is a tuple of parameter names and
+    correspondent values.
+
+    ``shard`` -- optional tuple (i, n). When given, only variants of the
+    ``i``-th of ``n`` shards are yielded, see :meth:`VariantSpace.shard`.
+    """
+    space = VariantSpace(gls)
+    if shard is None:
+        return iter(space)
+    return (space[k] for k in space.shard(*shard))
 
 
 def params(cla):
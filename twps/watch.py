@@ -0,0 +1,133 @@
+# Copyright 2012 Karlsruhe Institute of Technology (KIT)
+#
+# This file is part of TWPS.
+#
+# TWPS is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# TWPS is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Watch templates and process them again when they or their dependencies
+change.
+
+The process stays alive between renderings: parsed templates are reused
+while their files do not change, and imported modules stay imported. Changed
+user modules are reloaded. Changes are found by polling modification times of
+the dependency files, see :mod:`twps.deps`.
+
+Each rendering starts from a copy of the namespace as it was before the
+first one (e.g. with preloaded modules), so that the result is the same as
+of a fresh ``ppp.py`` run. Names defined by earlier renderings are not kept.
+"""
+
+from __future__ import print_function
+
+import sys
+import os
+import time
+import traceback
+from importlib import reload
+
+from . import text_with_snippets as tws
+from . import deps
+
+
+def _stat(fname):
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _render(t, baseline, kwargs):
+    """
+    Process template ``t`` in a copy of the ``baseline`` namespace and return
+    set of its dependency files.
+    """
+    context = tws.RenderContext(dict(baseline))
+    with deps.Recorder(t) as rec:
+        try:
+            tws.pre_pro(fname=t, level='main', context=context, **kwargs)
+        except (Exception, SystemExit):
+            # Report and continue watching: the template can be fixed.
+            traceback.print_exc()
+    return rec.files
+
+
+def _reload(changed):
+    """
+    Reload user modules, which source files are in ``changed``.
+    """
+    for name, m in list(sys.modules.items()):
+        if m is not None and deps.module_file(m) in changed:
+            print('Reloading module', name)
+            try:
+                reload(m)
+            except Exception:
+                traceback.print_exc()
+    deps.forget_modules()
+
+
+def watch(templates, interval=0.5, delay=0.2, **kwargs):
+    """
+    Process ``templates`` and then process again those of them, which
+    dependencies have changed. Runs until interrupted with Ctrl-C.
+
+    ``interval`` -- time in seconds between checks for changes.
+
+    ``delay`` -- time in seconds, during which files must not change before
+    they are processed. This joins several quick saves of a file into one.
+
+    ``kwargs`` are passed to :func:`twps.pre_pro`.
+    """
+    tws.template_cache = {}
+    baseline = dict(tws.gld)
+    files = {}
+    for t in templates:
+        files[t] = _render(t, baseline, kwargs)
+    stats = dict((f, _stat(f)) for fs in files.values() for f in fs)
+    print('Watching {} files. Press Ctrl-C to stop.'.format(len(stats)))
+    try:
+        while True:
+            time.sleep(interval)
+            changed = _changes(stats)
+            if not changed:
+                continue
+            # Wait until the files stop changing.
+            while True:
+                time.sleep(delay)
+                more = _changes(stats)
+                if not more:
+                    break
+                changed |= more
+            _reload(changed)
+            for t in templates:
+                if files[t] & changed:
+                    files[t] = _render(t, baseline, kwargs)
+            stats = dict((f, _stat(f)) for fs in files.values() for f in fs)
+    except KeyboardInterrupt:
+        pass
+
+
+def _changes(stats):
+    """
+    Return set of files, which modification time or size differ from those in
+    ``stats``, and update ``stats``.
+    """
+    changed = set()
+    for f, st in stats.items():
+        st2 = _stat(f)
+        if st2 != st:
+            changed.add(f)
+            stats[f] = st2
+    return changed